@@ -1,15 +1,173 @@
 import re
+import threading
+import time
+import tracemalloc
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, unquote
+import config
+from html_parsers import SelectorSet, get_parser_backend
+from url_params import ParamMatcher, extract_url_params, legacy_param_fields
+
+# 广告跳转解析配置（config.py 中未定义时使用默认值）
+# 同时进行的跳转解析数上限（所有页面共享）
+REDIRECT_MAX_WORKERS = getattr(config, 'REDIRECT_MAX_WORKERS', 8)
+# 对同一主机同时进行的跳转解析数上限
+REDIRECT_PER_HOST_LIMIT = getattr(config, 'REDIRECT_PER_HOST_LIMIT', 4)
+# 每个页面解析所有广告跳转的总时限（秒），超时的广告不记录真实URL
+REDIRECT_PAGE_DEADLINE = getattr(config, 'REDIRECT_PAGE_DEADLINE', 30)
+# 单个广告跳转请求的超时（秒）
+REDIRECT_TIMEOUT = getattr(config, 'REDIRECT_TIMEOUT', 15)
+
+# 解析前先截取广告区域（#tads、#bottomads），不构建整个页面的DOM
+AD_PRE_SLICE = getattr(config, 'AD_PRE_SLICE', True)
+# 是否用 tracemalloc 统计每个页面提取广告时的内存峰值（有额外开销，默认关闭；
+# tracemalloc 按进程统计，多线程并发提取时各页面的数值会相互影响）
+EXTRACT_TRACE_MEMORY = getattr(config, 'EXTRACT_TRACE_MEMORY', False)
+
+# 广告所在区域的元素id
+AD_REGION_IDS = ('tads', 'bottomads')
+
+# 注释、脚本和样式：从左到右扫描，先出现的先匹配，避免把注释或脚本中的标签当作真实标签；
+# 内容部分按"非<字符 + 不是结束标签的<"展开，不用 .*? 逐字符回溯，大段内联脚本也能快速跳过
+_STRIP_RE = re.compile(
+    r'<!--[^-]*(?:-(?!->)[^-]*)*-->'
+    r'|<script\b[^>]*>[^<]*(?:<(?!/script\s*>)[^<]*)*</script\s*>'
+    r'|<style\b[^>]*>[^<]*(?:<(?!/style\s*>)[^<]*)*</style\s*>',
+    re.I
+)
+_REGION_ID_RE = re.compile(
+    r'\sid\s*=\s*["\']?(?:' + '|'.join(AD_REGION_IDS) + r')(?=["\'\s/>])',
+    re.I
+)
+_TAG_NAME_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)')
+_DATA_RW_RE = re.compile(r'\sdata-rw\b', re.I)
+
+# 广告URL中可能携带目标URL的参数，按优先级排列
+_TARGET_URL_PARAMS = ('url', 'adurl', 'q', 'dest_url', 'continue')
+_TARGET_URL_MATCHER = ParamMatcher(_TARGET_URL_PARAMS)
+# 查询参数中没有时，在整个URL中查找 url=、adurl=、dest_url=（一次扫描）
+# 值用前瞻捕获，值中再出现的 adurl= 等也能被找到
+_TARGET_URL_FALLBACK_RE = re.compile(r'(ad|dest_)?url=(?=([^&]+))')
+
+
+def _find_region_end(html_content, tag, start):
+    """从区域起始标签之后按同名标签的嵌套层数找到匹配的结束位置，找不到时返回None"""
+    tag_re = re.compile(r'<(/?)' + re.escape(tag) + r'\b[^>]*>', re.I)
+    depth = 1
+    for match in tag_re.finditer(html_content, start):
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                return match.end()
+        elif not match.group(0).endswith('/>'):
+            depth += 1
+    return None
+
+
+def slice_ad_regions(html_content):
+    """
+    解析前的预处理：去掉注释、脚本和样式，并截取广告区域（#tads、#bottomads）
+    
+    找不到区域标记、标签无法配对，或广告区域外还有 data-rw 链接时，返回去掉脚本和样式的完整页面
+    
+    Returns:
+        (处理后的HTML, 是否只保留了广告区域)
+    """
+    stripped = _STRIP_RE.sub('', html_content)
+    
+    regions = []
+    position = 0
+    while True:
+        match = _REGION_ID_RE.search(stripped, position)
+        if not match:
+            break
+        
+        # id 属性所在的起始标签
+        tag_start = stripped.rfind('<', position, match.start())
+        tag_match = _TAG_NAME_RE.match(stripped, tag_start) if tag_start >= 0 else None
+        if not tag_match or '>' in stripped[tag_start:match.start()]:
+            # 标记不在起始标签内（如出现在文本中），跳过
+            position = match.end()
+            continue
+        
+        tag_end = stripped.find('>', match.end())
+        end = _find_region_end(stripped, tag_match.group(1), tag_end + 1) if tag_end >= 0 else None
+        if end is None:
+            return stripped, False
+        
+        regions.append(stripped[tag_start:end])
+        # 区域内嵌套的区域已包含在内，从区域结束处继续查找
+        position = end
+    
+    if not regions:
+        return stripped, False
+    
+    sliced = ''.join(regions)
+    if len(_DATA_RW_RE.findall(sliced)) != len(_DATA_RW_RE.findall(stripped)):
+        return stripped, False
+    
+    return f'<html><body>{sliced}</body></html>', True
 
 
 class GoogleAdExtractor:
     """Google SERP广告数据提取器"""
     
-    def __init__(self):
+    # 标题选择器，按优先级排列
+    _TITLE_SELECTORS = [
+        # 直接子元素中的标题
+        'div[role="heading"]',
+        'h1', 'h2', 'h3', 'h4',
+        # 常见的Google广告标题类
+        '.CCgQ5', '.vCa9Yd', '.QfkTvb', '.MBeuO', '.Va3FIb',
+        # 其他可能的标题容器
+        '[aria-level="3"]',
+        'span'
+    ]
+    
+    # 描述选择器，按优先级排列（描述通常在广告容器中，但不是标题）
+    _DESCRIPTION_SELECTORS = [
+        '.VwiC3b', '.yXK7lf', '.s3v9rd', '.st', '.IsZvec',
+        '.BNeawe', '.UPmit'
+    ]
+    
+    # 标题和描述选择器编译为一组，一次遍历同时匹配
+    _AD_BLOCK_SELECTORS = SelectorSet(_TITLE_SELECTORS + _DESCRIPTION_SELECTORS)
+    _TITLE_SELECTOR_RANGE = range(len(_TITLE_SELECTORS))
+    _DESCRIPTION_SELECTOR_RANGE = range(len(_TITLE_SELECTORS), len(_AD_BLOCK_SELECTORS))
+    
+    # 在链接内没找到时最多向上查找的父容器层数
+    _MAX_PARENT_LEVELS = 3
+    
+    def __init__(self, max_workers=None, per_host_limit=None, page_deadline=None,
+                 redirect_cache=None, parser_backend=None):
+        """
+        Args:
+            max_workers: 跳转解析并发上限，默认使用 REDIRECT_MAX_WORKERS
+            per_host_limit: 每个主机的并发上限，默认使用 REDIRECT_PER_HOST_LIMIT
+            page_deadline: 每个页面的跳转解析总时限（秒），默认使用 REDIRECT_PAGE_DEADLINE
+            redirect_cache: 跳转解析缓存（RedirectCache），为None时每次都访问网络
+            parser_backend: HTML解析后端名称（'lxml' 或 'bs4'），默认使用 AD_PARSER_BACKEND
+        """
+        self.parser = get_parser_backend(parser_backend)
+        self.redirect_cache = redirect_cache
+        self.max_workers = max(max_workers or REDIRECT_MAX_WORKERS, 1)
+        self.per_host_limit = max(per_host_limit or REDIRECT_PER_HOST_LIMIT, 1)
+        self.page_deadline = page_deadline or REDIRECT_PAGE_DEADLINE
+        
+        # 跳转解析线程池由所有页面共享，批量抓取时并发上限对所有页面整体生效
+        self._redirect_executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='redirect'
+        )
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+        
         # 初始化HTTP会话，用于获取真实目标URL
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
@@ -27,42 +185,107 @@ class GoogleAdExtractor:
             'sec-ch-ua-platform': '"macOS"'
         })
     
-    def extract_ads(self, html_content, get_real_urls=True):
-        """从HTML内容中提取广告数据"""
+    def extract_ads(self, html_content, get_real_urls=True, stats=None):
+        """
+        从HTML内容中提取广告数据
+        
+        Args:
+            html_content: SERP页面HTML
+            get_real_urls: 是否访问广告链接获取真实目标URL和ref参数
+            stats: 传入字典时写入本页的提取统计：用时（毫秒）、原始/解析的HTML大小、
+                   是否使用了区域切片，开启 EXTRACT_TRACE_MEMORY 时还有内存峰值（字节）
+        """
         if not html_content:
             return []
         
-        soup = BeautifulSoup(html_content, 'html.parser')
-        ads_data = self._extract_ads_by_data_rw(soup)
+        trace_memory = EXTRACT_TRACE_MEMORY
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        
+        ads_data = None
+        parsed_html = html_content
+        sliced = False
+        
+        if AD_PRE_SLICE:
+            parsed_html, sliced = slice_ad_regions(html_content)
+            ads_data = self._extract_ads_from_html(parsed_html, require_within_region=sliced)
+        
+        if ads_data is None:
+            # 未启用切片，或有广告的查找范围超出了截取的区域，解析完整页面
+            parsed_html, sliced = html_content, False
+            ads_data = self._extract_ads_from_html(html_content)
+        
+        if stats is not None:
+            stats['extract_ms'] = (time.perf_counter() - started) * 1000
+            stats['html_size'] = len(html_content)
+            stats['parsed_size'] = len(parsed_html)
+            stats['sliced'] = sliced
+            if trace_memory:
+                stats['peak_memory'] = tracemalloc.get_traced_memory()[1] - memory_before
         
         # 如果需要，获取真实的目标URL和ref参数
         if get_real_urls:
-            self._enrich_ads_with_real_urls(ads_data)
+            self.resolve_real_urls(ads_data)
         
         return ads_data
     
-    def _extract_ads_by_data_rw(self, soup):
+    def resolve_real_urls(self, ads_data, log=print):
+        """
+        为已提取的广告解析真实目标URL和跟踪参数（先查跳转缓存，未命中时访问网络）
+        
+        抓取时先用 get_real_urls=False 提取，开启变化检测时只对新增或变化的广告调用此方法
+        
+        Args:
+            log: 输出提示信息的函数，默认直接打印（批量抓取时为抓取任务的输出缓冲区）
+        """
+        if ads_data:
+            self._enrich_ads_with_real_urls(ads_data, log)
+    
+    def _extract_ads_from_html(self, html_content, require_within_region=False):
+        """
+        解析HTML并提取广告
+        
+        Args:
+            require_within_region: HTML为截取的广告区域时为True，此时如果某个广告链接向上查找的
+                父容器超出了广告区域（到达拼接时添加的body），结果可能与完整页面不同，返回None
+        """
+        document = self.parser.parse(html_content)
+        
+        if require_within_region:
+            for link in self.parser.find_ad_links(document):
+                parent = self.parser.get_parent(link)
+                for _ in range(self._MAX_PARENT_LEVELS):
+                    if parent is None or self.parser.get_tag(parent) in ('body', 'html'):
+                        return None
+                    parent = self.parser.get_parent(parent)
+        
+        return self._extract_ads_by_data_rw(document)
+    
+    def _extract_ads_by_data_rw(self, document):
         """使用data-rw属性提取广告"""
         ads = []
         
         # 查找所有带有data-rw属性的a标签
-        ad_links = soup.find_all('a', {'data-rw': True})
+        ad_links = self.parser.find_ad_links(document)
+        shared_scopes = self._find_shared_scopes(ad_links)
+        ad_link_ids = {id(link) for link in ad_links} if shared_scopes else None
         
         for i, link in enumerate(ad_links, 1):
             try:
                 # 获取广告URL (data-rw属性值)
-                ad_url = link.get('data-rw', '')
+                ad_url = self.parser.get_attribute(link, 'data-rw')
                 if not ad_url:
                     continue
                 
                 # 从URL参数中解析目标URL
                 target_url = self._extract_target_url_from_ad_url(ad_url)
                 
-                # 查找广告标题
-                title = self._extract_title_from_ad_element(link)
-                
-                # 查找广告描述
-                description = self._extract_description_from_ad_element(link)
+                # 查找广告标题和描述
+                title, description = self._extract_title_and_description(link, ad_link_ids, shared_scopes)
                 
                 # 验证这是否是有效广告
                 if self._is_valid_ad_data(title, ad_url, target_url):
@@ -72,43 +295,68 @@ class GoogleAdExtractor:
                         'ad_url': ad_url,
                         'target_url': target_url,
                         'description': description,
-                        'position': i
+                        'position': i,
+                        'display_domain': self._extract_display_domain(link, target_url)
                     })
             except Exception:
                 continue
         
         return ads
     
+    def _find_shared_scopes(self, ad_links):
+        """
+        包含不止一个广告链接的元素，返回 {id(元素): 元素}
+        
+        字典同时持有元素的引用，遍历期间 id 不会被复用，lxml 也会对同一节点返回同一个代理对象
+        """
+        seen = {}
+        shared = {}
+        for link in ad_links:
+            node = link
+            while node is not None:
+                key = id(node)
+                if key in seen:
+                    shared[key] = node
+                else:
+                    seen[key] = node
+                node = self.parser.get_parent(node)
+        return shared
+    
+    def _extract_display_domain(self, link_element, target_url):
+        """广告显示的域名：优先使用链接的 data-dtld 属性，没有时取目标URL的域名"""
+        display_domain = self.parser.get_attribute(link_element, 'data-dtld')
+        if not display_domain and target_url:
+            try:
+                display_domain = urlparse(target_url).netloc
+            except ValueError:
+                display_domain = ''
+        return display_domain.lower()
+    
     def _extract_target_url_from_ad_url(self, ad_url):
         """从Google广告URL中提取真实的目标URL"""
         if not ad_url:
             return ""
         
         try:
-            # Google广告URL通常包含多个参数，真实URL可能在不同参数中
-            parsed_url = urlparse(ad_url)
-            query_params = parse_qs(parsed_url.query)
-            
-            # 常见的目标URL参数名
-            url_param_names = ['url', 'adurl', 'q', 'dest_url', 'continue']
+            # Google广告URL通常包含多个参数，真实URL可能在不同参数中（只解析一次URL）
+            query_params = extract_url_params(ad_url, _TARGET_URL_MATCHER)
             
-            for param_name in url_param_names:
-                if param_name in query_params:
-                    target_url = query_params[param_name][0]
-                    if target_url.startswith('http'):
-                        return unquote(target_url)
+            for param_name in _TARGET_URL_PARAMS:
+                target_url = query_params.get(param_name)
+                if target_url and target_url.startswith('http'):
+                    return unquote(target_url)
             
-            # 如果在查询参数中没找到，尝试在URL路径中查找
-            url_patterns = [
-                r'url=([^&]+)',
-                r'adurl=([^&]+)',
-                r'dest_url=([^&]+)'
-            ]
+            # 如果在查询参数中没找到，尝试在URL路径中查找：
+            # 依次检查第一个 url=（也包括 adurl=、dest_url= 中的 url=）、第一个 adurl= 和第一个 dest_url= 的值
+            candidates = {}
+            for match in _TARGET_URL_FALLBACK_RE.finditer(ad_url):
+                candidates.setdefault('', match.group(2))
+                if match.group(1):
+                    candidates.setdefault(match.group(1), match.group(2))
             
-            for pattern in url_patterns:
-                match = re.search(pattern, ad_url)
-                if match:
-                    target_url = unquote(match.group(1))
+            for prefix in ('', 'ad', 'dest_'):
+                if prefix in candidates:
+                    target_url = unquote(candidates[prefix])
                     if target_url.startswith('http'):
                         return target_url
             
@@ -117,81 +365,104 @@ class GoogleAdExtractor:
         except Exception:
             return ""
     
-    def _extract_title_from_ad_element(self, link_element):
-        """从广告元素中提取标题"""
-        # 先在链接本身中查找标题
-        title_selectors = [
-            # 直接子元素中的标题
-            'div[role="heading"]',
-            'h1', 'h2', 'h3', 'h4',
-            # 常见的Google广告标题类
-            '.CCgQ5', '.vCa9Yd', '.QfkTvb', '.MBeuO', '.Va3FIb',
-            # 其他可能的标题容器
-            '[aria-level="3"]',
-            'span'
-        ]
-        
-        for selector in title_selectors:
-            title_elem = link_element.select_one(selector)
-            if title_elem:
-                title_text = title_elem.get_text().strip()
-                if title_text and len(title_text) > 3:
-                    return title_text
-        
-        # 如果在链接内没找到，向上查找父容器
-        parent = link_element.parent
-        for _ in range(3):  # 最多向上查找3层
-            if not parent:
-                break
-            
-            for selector in title_selectors:
-                title_elem = parent.select_one(selector)
-                if title_elem:
-                    title_text = title_elem.get_text().strip()
-                    if title_text and len(title_text) > 3:
-                        return title_text
-            
-            parent = parent.parent
+    def _extract_title_and_description(self, link_element, ad_link_ids=None, shared_scopes=None):
+        """
+        一次遍历广告容器，同时提取标题和描述
         
-        # 最后尝试使用链接的直接文本内容
-        link_text = link_element.get_text().strip()
-        if link_text and len(link_text) > 3:
-            return link_text
+        查找范围依次是链接本身和向上最多 _MAX_PARENT_LEVELS 层父容器，每层范围内按选择器优先级
+        取第一个匹配元素（与 select_one 相同，只匹配后代）。这些范围层层嵌套，只需在最外层范围内
+        按文档顺序遍历一次匹配元素，记录每个元素所在的最内层范围，再由内到外确定结果
         
-        return ""
-    
-    def _extract_description_from_ad_element(self, link_element):
-        """从广告元素中提取描述"""
-        # 描述通常在广告容器中，但不是标题
-        desc_selectors = [
-            '.VwiC3b', '.yXK7lf', '.s3v9rd', '.st', '.IsZvec',
-            '.BNeawe', '.UPmit'
-        ]
-        
-        # 在当前元素中查找
-        for selector in desc_selectors:
-            desc_elem = link_element.select_one(selector)
-            if desc_elem:
-                desc_text = desc_elem.get_text().strip()
-                if desc_text and len(desc_text) > 10:
-                    return desc_text
-        
-        # 在父容器中查找
-        parent = link_element.parent
-        for _ in range(3):
-            if not parent:
-                break
+        范围内还有其他广告链接时（shared_scopes），该范围只使用位于本链接之后、下一个广告链接之前的元素。
+        畸形嵌套（<a> 中嵌套 <a>、<p> 中的 <div>、表格/列表外的 <td>/<li>）经 html.parser 和 libxml2
+        纠错后，广告的描述可能在不同层级的容器中，这样两个解析后端都不会取到其他广告的标题或描述
+        
+        Args:
+            link_element: 广告链接
+            ad_link_ids: 页面中所有广告链接的id集合
+            shared_scopes: _find_shared_scopes() 的结果，为空时不限制范围内元素的位置
+        """
+        parser = self.parser
+        
+        scopes = [link_element]
+        parent = parser.get_parent(link_element)
+        while parent is not None and len(scopes) <= self._MAX_PARENT_LEVELS:
+            scopes.append(parent)
+            parent = parser.get_parent(parent)
+        
+        # 范围元素在整个遍历期间被 scopes 引用，id 不会被复用
+        scope_levels = {id(scope): level for level, scope in enumerate(scopes)}
+        top_level = len(scopes) - 1
+        
+        # 每个选择器在每层范围内（只计最内层）的第一个匹配元素；按文档顺序遍历，先记录的即最靠前
+        level_matches = [[None] * len(scopes) for _ in range(len(self._AD_BLOCK_SELECTORS))]
+        match_order = {}
+        
+        shared_levels = {
+            level for level, scope in enumerate(scopes) if shared_scopes and id(scope) in shared_scopes
+        }
+        marks = ad_link_ids if shared_levels else None
+        # 遍历是否已经过本链接、下一个广告链接
+        after_link = after_next_link = False
+        
+        for order, (element, matched) in enumerate(
+            parser.iter_matches(scopes[-1], self._AD_BLOCK_SELECTORS, marks)
+        ):
+            if marks and id(element) in marks:
+                if element is link_element:
+                    after_link = True
+                elif after_link:
+                    after_next_link = True
+            if not matched:
+                continue
             
-            for selector in desc_selectors:
-                desc_elem = parent.select_one(selector)
-                if desc_elem:
-                    desc_text = desc_elem.get_text().strip()
-                    if desc_text and len(desc_text) > 10:
-                        return desc_text
+            # 向上找到最近的范围元素，即元素所在的最内层范围
+            level = top_level
+            ancestor = parser.get_parent(element)
+            while ancestor is not None:
+                scope_level = scope_levels.get(id(ancestor))
+                if scope_level is not None:
+                    level = scope_level
+                    break
+                ancestor = parser.get_parent(ancestor)
+            if level in shared_levels and (not after_link or after_next_link):
+                continue
             
-            parent = parent.parent
+            for index in matched:
+                if level_matches[index][level] is None:
+                    level_matches[index][level] = element
+                    match_order[id(element)] = order
+        
+        text_cache = {}
         
-        return ""
+        def pick(selector_range, min_length):
+            # 范围由内到外，每层范围内的第一个匹配 = 最内层范围不超过该层的匹配中文档顺序最靠前的
+            first_in_scope = {}
+            for level in range(len(scopes)):
+                for index in selector_range:
+                    match = level_matches[index][level]
+                    current = first_in_scope.get(index)
+                    if match is not None and (current is None or match_order[id(match)] < match_order[id(current)]):
+                        first_in_scope[index] = current = match
+                    if current is None:
+                        continue
+                    
+                    text = text_cache.get(id(current))
+                    if text is None:
+                        text = text_cache[id(current)] = parser.get_text(current).strip()
+                    if text and len(text) > min_length:
+                        return text
+            return None
+        
+        title = pick(self._TITLE_SELECTOR_RANGE, 3)
+        if title is None:
+            # 最后尝试使用链接的直接文本内容
+            link_text = parser.get_text(link_element).strip()
+            title = link_text if link_text and len(link_text) > 3 else ""
+        
+        description = pick(self._DESCRIPTION_SELECTOR_RANGE, 10) or ""
+        
+        return title, description
     
     def _is_valid_ad_data(self, title, ad_url, target_url):
         """验证广告数据是否有效"""
@@ -206,21 +477,81 @@ class GoogleAdExtractor:
         
         return True
     
-    def _enrich_ads_with_real_urls(self, ads_data):
-        """为广告数据添加真实的目标URL和ref参数"""
+    def _enrich_ads_with_real_urls(self, ads_data, log=print):
+        """为广告数据添加真实的目标URL和ref参数（同一页面的广告并发解析）"""
+        deadline = time.monotonic() + self.page_deadline
+        
+        futures = {}
         for ad in ads_data:
             if ad.get('ad_url'):
-                real_target_result = self._get_real_target_url(ad['ad_url'])
-                if real_target_result:
-                    ad['real_target_url'] = real_target_result['final_url']
-                    if real_target_result['ref_parameter']:
-                        ad['ref_parameter'] = real_target_result['ref_parameter']
-                    if real_target_result['ch_parameter']:
-                        ad['ch_parameter'] = real_target_result['ch_parameter']
-                    if real_target_result['utm_campaign_parameter']:
-                        ad['utm_campaign_parameter'] = real_target_result['utm_campaign_parameter']
+                # 先查缓存，命中时不再访问网络
+                if self.redirect_cache:
+                    cached_result = self.redirect_cache.get(ad['ad_url'])
+                    if cached_result:
+                        self._apply_real_target_result(ad, cached_result)
+                        continue
+                
+                future = self._redirect_executor.submit(
+                    self._resolve_real_target_url, ad['ad_url'], deadline
+                )
+                futures[future] = ad
+        
+        if not futures:
+            return
+        
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        
+        for future in done:
+            real_target_result = future.result()
+            if real_target_result:
+                self._apply_real_target_result(futures[future], real_target_result)
+        
+        # 超过页面时限的广告仍然保存，只是不记录真实URL
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            log(f"  ⏰ {len(not_done)} 个广告的跳转解析超过页面时限 ({self.page_deadline}秒)，未记录真实URL")
+    
+    def _apply_real_target_result(self, ad, real_target_result):
+        """将跳转解析结果写入广告数据"""
+        ad['real_target_url'] = real_target_result['final_url']
+        ad['url_params'] = dict(real_target_result['url_params'])
+        for field, value in legacy_param_fields(real_target_result['url_params']).items():
+            if value:
+                ad[field] = value
+    
+    def _get_host_semaphore(self, url):
+        """获取URL所在主机的并发信号量"""
+        host = urlparse(url).netloc.lower()
+        with self._host_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+    
+    def _resolve_real_target_url(self, ad_url, deadline):
+        """在主机并发限制和页面时限内解析广告的真实目标地址"""
+        semaphore = self._get_host_semaphore(ad_url)
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+            return None
+        
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            result = self._get_real_target_url(ad_url, timeout=min(REDIRECT_TIMEOUT, remaining))
+        finally:
+            semaphore.release()
+        
+        if result and self.redirect_cache:
+            self.redirect_cache.put(ad_url, result)
+        
+        return result
     
-    def _get_real_target_url(self, ad_url):
+    def _get_real_target_url(self, ad_url, timeout=REDIRECT_TIMEOUT):
         """访问广告URL获取真实的目标地址"""
         try:
             # 添加Referer头来模拟从Google搜索页面点击
@@ -232,74 +563,20 @@ class GoogleAdExtractor:
             response = self.session.get(
                 ad_url,
                 allow_redirects=True,
-                timeout=15,
+                timeout=timeout,
                 headers=headers
             )
             
             final_url = response.url
             
-            # 提取URL中的各种参数
-            ref_value = self._extract_ref_parameter(final_url)
-            ch_value = self._extract_ch_parameter(final_url)
-            utm_campaign_value = self._extract_utm_campaign_parameter(final_url)
+            # 解析一次URL，提取所有跟踪的参数
+            url_params = extract_url_params(final_url)
             
             return {
                 'final_url': final_url,
-                'ref_parameter': ref_value,
-                'ch_parameter': ch_value,
-                'utm_campaign_parameter': utm_campaign_value
+                'url_params': url_params,
+                **legacy_param_fields(url_params)
             }
                 
         except Exception:
             return None
-    
-    def _extract_ref_parameter(self, url):
-        """从URL中提取ref参数"""
-        try:
-            parsed_url = urlparse(url)
-            query_params = parse_qs(parsed_url.query)
-            
-            # 只查找确切的ref参数
-            if 'ref' in query_params:
-                ref_value = query_params['ref'][0]
-                if ref_value:
-                    return ref_value
-            
-            return None
-            
-        except Exception:
-            return None
-    
-    def _extract_ch_parameter(self, url):
-        """从URL中提取ch参数"""
-        try:
-            parsed_url = urlparse(url)
-            query_params = parse_qs(parsed_url.query)
-            
-            # 只查找确切的ch参数
-            if 'ch' in query_params:
-                ch_value = query_params['ch'][0]
-                if ch_value:
-                    return ch_value
-            
-            return None
-            
-        except Exception:
-            return None
-    
-    def _extract_utm_campaign_parameter(self, url):
-        """从URL中提取utm_campaign参数"""
-        try:
-            parsed_url = urlparse(url)
-            query_params = parse_qs(parsed_url.query)
-            
-            # 只查找确切的utm_campaign参数
-            if 'utm_campaign' in query_params:
-                utm_campaign_value = query_params['utm_campaign'][0]
-                if utm_campaign_value:
-                    return utm_campaign_value
-            
-            return None
-            
-        except Exception:
-            return None
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+异步SERP抓取器
+基于 asyncio + aiohttp 的批量抓取实现，通过连接池复用连接，
+让大量 Bright Data API 请求同时在途
+"""
+
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import aiohttp
+
+import config
+from config import KEYWORDS_LIST, COUNTRY_LIST, MAX_RETRIES, REQUEST_TIMEOUT
+from rate_limiter import RateLimiter
+from scraper import GoogleSERPScraper, BATCH_MAX_WORKERS
+
+# 异步抓取配置（config.py 中未定义时使用默认值）
+# 同时在途的最大API请求数
+ASYNC_MAX_IN_FLIGHT = getattr(config, 'ASYNC_MAX_IN_FLIGHT', 100)
+# 连接池中的最大连接数
+ASYNC_CONNECTION_LIMIT = getattr(config, 'ASYNC_CONNECTION_LIMIT', 50)
+# 全局限速（每秒请求数），<=0 表示只受在途请求数限制
+ASYNC_RATE_LIMIT = getattr(config, 'ASYNC_RATE_LIMIT', 20)
+# 重试退避的基础秒数，第 n 次重试等待约 base * 2^n 秒
+ASYNC_RETRY_BACKOFF = getattr(config, 'ASYNC_RETRY_BACKOFF', 2)
+# 解析页面、解析跳转和写库等阻塞操作使用的线程数
+ASYNC_PROCESS_WORKERS = getattr(config, 'ASYNC_PROCESS_WORKERS', BATCH_MAX_WORKERS)
+
+
+def _tagged_log(keyword, country_code):
+    """
+    返回在每行缩进之后加上 [关键词/国家] 的输出函数，传给同步抓取共用的处理方法，
+    与异步请求的输出一样标明所属组合；每行一次写出，线程池中并发输出的行不会拼接在一起
+    """
+    tag = f"[{keyword}/{country_code}]"
+
+    def log(message):
+        text = message.lstrip(' ')
+        print(f"{message[:len(message) - len(text)]}{tag} {text}\n", end='')
+
+    return log
+
+
+class AsyncGoogleSERPScraper(GoogleSERPScraper):
+    """异步Google SERP数据抓取器"""
+
+    async def _fetch_serp_data_async(self, http, keyword, country_code):
+        """使用共享的 aiohttp 会话获取SERP数据，失败时指数退避重试"""
+        url, payload, headers = self._build_serp_request(keyword, country_code)
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with http.post(url, json=payload, headers=headers) as response:
+                    if response.status == 200:
+                        result = await response.json(content_type=None)
+
+                        html_content = self._extract_html_from_response(result)
+
+                        if html_content:
+                            print(f"  ✅ [{keyword}/{country_code}] API请求成功，获得HTML内容 ({len(html_content)} 字符)")
+                            return html_content
+                        else:
+                            print(f"  ⚠️ [{keyword}/{country_code}] API响应中未找到HTML内容")
+                    else:
+                        text = await response.text()
+                        print(f"  ❌ [{keyword}/{country_code}] API请求失败: HTTP {response.status}")
+                        print(f"  响应内容: {text[:500]}")
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                print(f"  ❌ [{keyword}/{country_code}] 请求异常 (尝试 {attempt + 1}/{MAX_RETRIES}): {str(e) or type(e).__name__}")
+
+            if attempt < MAX_RETRIES - 1:
+                delay = ASYNC_RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, ASYNC_RETRY_BACKOFF)
+                await asyncio.sleep(delay)
+
+        return None
+
+    async def scrape_keyword_country_async(self, http, executor, keyword, country_code):
+        """异步抓取特定关键词在特定国家的SERP数据"""
+        scrape_time = datetime.now()
+        loop = asyncio.get_running_loop()
+        log = _tagged_log(keyword, country_code)
+
+        try:
+            html_content = await self._fetch_serp_data_async(http, keyword, country_code)
+
+            # 解析和写库是阻塞操作，放到线程池中执行，避免阻塞事件循环
+            return await loop.run_in_executor(
+                executor, self._process_serp_html,
+                keyword, country_code, html_content, scrape_time, log
+            )
+
+        except Exception as e:
+            await loop.run_in_executor(
+                executor, self._record_scrape_failure, keyword, country_code, e, log
+            )
+            return False
+
+    async def scrape_all_combinations_async(self, max_in_flight=None):
+        """
+        异步抓取所有关键词和国家的组合
+
+        Args:
+            max_in_flight: 同时在途的最大请求数，默认使用 ASYNC_MAX_IN_FLIGHT
+        """
+        if max_in_flight is None:
+            max_in_flight = ASYNC_MAX_IN_FLIGHT
+        max_in_flight = max(int(max_in_flight), 1)
+
+        combinations = [
+            (keyword, country_code)
+            for keyword in KEYWORDS_LIST
+            for country_code in COUNTRY_LIST
+        ]
+        total_combinations = len(combinations)
+
+        print(f"🚀 开始异步批量抓取，共 {total_combinations} 个组合")
+        print(f"关键词数量: {len(KEYWORDS_LIST)}")
+        print(f"国家数量: {len(COUNTRY_LIST)}")
+        print(f"最大在途请求数: {max_in_flight}，连接池上限: {ASYNC_CONNECTION_LIMIT}")
+        print("-" * 60)
+
+        start_time = datetime.now()
+
+        if self.redirect_cache:
+            self.redirect_cache.reset_stats()
+
+        semaphore = asyncio.Semaphore(max_in_flight)
+        rate_limiter = RateLimiter(ASYNC_RATE_LIMIT, max(int(ASYNC_RATE_LIMIT), 1), 'global')
+
+        connector = aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+        async def scrape_task(index, keyword, country_code):
+            async with semaphore:
+                await rate_limiter.acquire_async()
+                print(f"[{index}/{total_combinations}] 开始抓取关键词 '{keyword}' 在 {country_code} 的数据...")
+                return await self.scrape_keyword_country_async(
+                    http, executor, keyword, country_code
+                )
+
+        with ThreadPoolExecutor(max_workers=max(ASYNC_PROCESS_WORKERS, 1)) as executor:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+                results = await asyncio.gather(*[
+                    scrape_task(index, keyword, country_code)
+                    for index, (keyword, country_code) in enumerate(combinations, 1)
+                ], return_exceptions=True)
+
+        successful = sum(1 for result in results if result is True)
+        self.flush_visibility_rollups()
+
+        end_time = datetime.now()
+        duration = end_time - start_time
+
+        print("\n" + "=" * 60)
+        print(f"🎉 异步批量抓取完成!")
+        print(f"总用时: {duration}")
+        print(f"成功率: {successful}/{total_combinations} ({successful/max(total_combinations, 1)*100:.1f}%)")
+        self.show_redirect_cache_stats()
+
+        return successful
+
+    def scrape_all_combinations_batch_async(self, max_in_flight=None):
+        """同步入口：运行异步批量抓取并显示统计信息"""
+        asyncio.run(self.scrape_all_combinations_async(max_in_flight))
+        self.show_stats()
@@ -0,0 +1,35 @@
+"""
+SERP广告变化检测
+每个广告按 规范化的广告URL + 标题 + 显示域名 计算指纹，每个SERP按其中广告指纹的顺序计算指纹。
+同一关键词/国家已出现过的广告只更新最近出现时间和出现次数，不再解析跳转、不再插入新行
+"""
+
+import hashlib
+import re
+
+import config
+from redirect_cache import normalize_ad_url
+
+# 是否启用变化检测（config.py 中未定义时使用默认值），关闭时每次抓取都插入所有广告
+CHANGE_DETECTION = getattr(config, 'CHANGE_DETECTION', True)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def ad_fingerprint(ad):
+    """计算单个广告的指纹（去掉 gclid 等易变参数后的广告URL、标题和显示域名）"""
+    try:
+        ad_url = normalize_ad_url(ad.get('ad_url', ''))
+    except ValueError:
+        ad_url = ad.get('ad_url', '')
+
+    title = _WHITESPACE_RE.sub(' ', ad.get('title') or '').strip().casefold()
+    display_domain = (ad.get('display_domain') or '').lower()
+
+    key = '\x1f'.join((ad_url, title, display_domain))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def serp_fingerprint(fingerprints):
+    """按广告顺序计算整个SERP广告集合的指纹"""
+    return hashlib.sha1('\n'.join(fingerprints).encode('ascii')).hexdigest()
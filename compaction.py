@@ -0,0 +1,62 @@
+"""
+原始数据压缩
+抓取时间超过保留期的原始广告记录（ads_data 及其 ad_params）删除，或先复制到归档库再删除；
+可见度汇总表和ref登记表保留完整历史，按小时/天/周的图表和日报/周报不受影响
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import config
+from database import AdDatabase
+
+# 压缩配置（config.py 中未定义时使用默认值）
+# 原始广告记录保留天数
+RAW_DATA_RETENTION_DAYS = getattr(config, 'RAW_DATA_RETENTION_DAYS', 180)
+# 归档数据库路径，为None时直接删除（相对路径基于主数据库所在目录）
+RAW_DATA_ARCHIVE = getattr(config, 'RAW_DATA_ARCHIVE', None)
+# 每个事务删除的广告数，分批提交避免长时间阻塞正在进行的抓取
+COMPACT_BATCH_SIZE = getattr(config, 'COMPACT_BATCH_SIZE', 1000)
+
+
+def compact_raw_data(retention_days=None, archive_path=None, dry_run=False):
+    """
+    清理超过保留期的原始广告记录
+
+    Args:
+        retention_days: 保留天数，默认使用 RAW_DATA_RETENTION_DAYS
+        archive_path: 归档数据库路径，默认使用 RAW_DATA_ARCHIVE
+        dry_run: 只统计要清理的行数，不修改数据库
+
+    Returns:
+        统计信息字典
+    """
+    if retention_days is None:
+        retention_days = RAW_DATA_RETENTION_DAYS
+    archive_path = archive_path or RAW_DATA_ARCHIVE
+    cutoff = datetime.now() - timedelta(days=retention_days)
+
+    db = AdDatabase()
+    if archive_path and not os.path.isabs(archive_path):
+        archive_path = os.path.join(os.path.dirname(db.db_path), archive_path)
+
+    print(f"🗜️ 清理 {cutoff.strftime('%Y-%m-%d %H:%M:%S')} 之前的原始广告记录（保留 {retention_days} 天）")
+    if archive_path:
+        print(f"📦 归档到: {archive_path}")
+    if dry_run:
+        print("🔍 dry-run 模式，只统计行数，不修改数据库")
+    print("-" * 60)
+
+    start_time = time.perf_counter()
+    stats = db.prune_raw_ads(cutoff, archive_path, batch_size=COMPACT_BATCH_SIZE, dry_run=dry_run)
+    db.close()
+    elapsed = time.perf_counter() - start_time
+
+    action = '需要清理' if dry_run else ('已归档并清理' if archive_path else '已清理')
+    print(f"{action}: {stats['ads']} 条广告记录，{stats['params']} 条参数记录，{stats['fingerprints']} 条过期指纹")
+    print(f"用时 {elapsed:.1f} 秒")
+    if stats['ads'] and not dry_run:
+        print("💡 删除的空间会被之后的写入复用，如需缩小数据库文件可在停止抓取后执行 VACUUM")
+
+    return stats
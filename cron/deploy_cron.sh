@@ -15,6 +15,7 @@ echo "🔧 设置脚本执行权限..."
 chmod +x "$SCRIPT_DIR/run_hourly.sh"
 chmod +x "$SCRIPT_DIR/run_daily_email.sh" 
 chmod +x "$SCRIPT_DIR/run_weekly_email.sh"
+chmod +x "$SCRIPT_DIR/run_mailer.sh"
 chmod +x "$SCRIPT_DIR/deploy_cron.sh"
 
 # 2. 创建日志目录
@@ -31,7 +32,7 @@ fi
 
 # 4. 测试脚本
 echo "🧪 测试脚本是否可执行..."
-for script in "run_hourly.sh" "run_daily_email.sh" "run_weekly_email.sh"; do
+for script in "run_hourly.sh" "run_daily_email.sh" "run_weekly_email.sh" "run_mailer.sh"; do
     if [ -x "$SCRIPT_DIR/$script" ]; then
         echo "✅ $script 可执行"
     else
@@ -56,3 +57,4 @@ echo "🔍 测试单个脚本:"
 echo "   $SCRIPT_DIR/run_hourly.sh"
 echo "   $SCRIPT_DIR/run_daily_email.sh"
 echo "   $SCRIPT_DIR/run_weekly_email.sh"
+echo "   $SCRIPT_DIR/run_mailer.sh"
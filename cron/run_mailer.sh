@@ -0,0 +1,41 @@
+#!/bin/bash
+
+# Google Ads 发件队列脚本
+# 功能：每隔几分钟运行 main.py --mode mailer，发送抓取任务加入发件队列的邮件（失败的按退避时间重试）
+
+# 脚本配置
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+PROJECT_DIR="$(dirname "$SCRIPT_DIR")"
+VENV_PATH="$PROJECT_DIR/venv"
+PYTHON_PATH="$VENV_PATH/bin/python"
+LOG_FILE="$PROJECT_DIR/logs/mailer.log"
+
+# 创建日志目录
+mkdir -p "$PROJECT_DIR/logs"
+
+# 检查虚拟环境
+if [ ! -f "$PYTHON_PATH" ]; then
+    echo "错误: 虚拟环境不存在: $PYTHON_PATH" >> "$LOG_FILE"
+    exit 1
+fi
+
+# 进入项目目录并运行
+cd "$PROJECT_DIR" || {
+    echo "错误: 无法进入项目目录: $PROJECT_DIR" >> "$LOG_FILE"
+    exit 1
+}
+
+# 上一次运行还没结束时跳过（租约到期前邮件也不会被重复发送）
+exec 9> "$PROJECT_DIR/logs/mailer.lock"
+if ! flock -n 9; then
+    echo "$(date '+%Y-%m-%d %H:%M:%S') 上一次发送仍在运行，跳过" >> "$LOG_FILE"
+    exit 0
+fi
+
+echo "开始时间: $(date '+%Y-%m-%d %H:%M:%S')" >> "$LOG_FILE"
+"$PYTHON_PATH" main.py --mode mailer >> "$LOG_FILE" 2>&1
+
+EXIT_CODE=$?
+echo "结束时间: $(date '+%Y-%m-%d %H:%M:%S')，退出码 $EXIT_CODE" >> "$LOG_FILE"
+
+exit $EXIT_CODE
@@ -1,29 +1,197 @@
 import sqlite3
+import json
 import os
-from datetime import datetime
+import threading
+import uuid
+from datetime import datetime, timedelta
+import config
 from config import DATABASE_NAME
+from url_params import LEGACY_PARAM_FIELDS, extract_url_params
+
+# SQLite 连接的 PRAGMA 配置，可在 config.py 中通过 SQLITE_PRAGMAS 覆盖部分或全部项
+# WAL 模式下读写互不阻塞，抓取任务写入时报表任务也能同时读取
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,       # 负数表示KiB，即约16MB页缓存
+    'mmap_size': 268435456,     # 256MB内存映射
+    'temp_store': 'MEMORY',
+    'busy_timeout': 10000,      # 遇到锁时最多等待10秒
+}
+SQLITE_PRAGMAS = dict(DEFAULT_SQLITE_PRAGMAS, **getattr(config, 'SQLITE_PRAGMAS', {}))
+
+# 报表快照：日报、周报和 ref_stats 的ref查询共用同一份快照，数据版本不变时不再重复查询（config.py 中未定义时使用默认值）
+REPORT_SNAPSHOTS = getattr(config, 'REPORT_SNAPSHOTS', True)
+# 新快照至少覆盖的天数（从当天零点往前算），使不同时间范围的报表尽量共用同一份快照
+REPORT_SNAPSHOT_DAYS = getattr(config, 'REPORT_SNAPSHOT_DAYS', 8)
+
+# 可见度汇总的时间粒度：粒度 -> 由抓取时间计算所在时间桶的SQL表达式（{0} 为时间列）
+# hour: YYYY-MM-DD HH，day: YYYY-MM-DD，week: 所在周周一的日期 YYYY-MM-DD
+VISIBILITY_GRANULARITIES = {
+    'hour': "substr({0}, 1, 13)",
+    'day': "substr({0}, 1, 10)",
+    'week': "date(substr({0}, 1, 10), '-6 days', 'weekday 1')",
+}
+
+
+def get_database_path():
+    """获取数据库文件的绝对路径"""
+    # 将相对路径转换为绝对路径，确保无论从哪个目录运行都能找到数据库
+    if os.path.isabs(DATABASE_NAME):
+        # 如果已经是绝对路径，直接使用
+        return DATABASE_NAME
+    
+    # 如果是相对路径，基于项目根目录计算绝对路径
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(project_root, DATABASE_NAME)
+
+
+def visibility_bucket(scrape_time, granularity):
+    """计算抓取时间所在的时间桶，与 VISIBILITY_GRANULARITIES 中SQL表达式的结果相同"""
+    if isinstance(scrape_time, str):
+        scrape_time = datetime.fromisoformat(scrape_time)
+    
+    if granularity == 'hour':
+        return scrape_time.strftime('%Y-%m-%d %H')
+    if granularity == 'day':
+        return scrape_time.strftime('%Y-%m-%d')
+    if granularity == 'week':
+        return (scrape_time - timedelta(days=scrape_time.weekday())).strftime('%Y-%m-%d')
+    raise ValueError(f"不支持的时间粒度: {granularity}")
+
+
+def connect_database(db_path=None, **kwargs):
+    """
+    创建应用了统一PRAGMA配置的数据库连接
+    
+    所有模块都应通过此函数连接数据库，而不是直接调用 sqlite3.connect
+    
+    Args:
+        db_path: 数据库文件路径，默认使用 get_database_path()
+        **kwargs: 传给 sqlite3.connect 的其他参数
+        
+    Returns:
+        sqlite3.Connection 对象
+    """
+    busy_timeout = SQLITE_PRAGMAS.get('busy_timeout')
+    if busy_timeout is not None:
+        kwargs.setdefault('timeout', busy_timeout / 1000)
+    
+    conn = sqlite3.connect(db_path or get_database_path(), **kwargs)
+    for name, value in SQLITE_PRAGMAS.items():
+        if value is None:
+            continue
+        if name not in DEFAULT_SQLITE_PRAGMAS:
+            raise ValueError(f"不支持的PRAGMA配置项: {name}")
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
 
 
 class AdDatabase:
     """Google广告数据库管理类"""
     
-    def __init__(self):
-        # 将相对路径转换为绝对路径，确保无论从哪个目录运行都能找到数据库
-        if os.path.isabs(DATABASE_NAME):
-            # 如果已经是绝对路径，直接使用
-            self.db_path = DATABASE_NAME
-        else:
-            # 如果是相对路径，基于项目根目录计算绝对路径
-            project_root = os.path.dirname(os.path.abspath(__file__))
-            self.db_path = os.path.join(project_root, DATABASE_NAME)
+    # ref登记表查询（日报、周报和 ref_stats 共用），返回列依次为:
+    # ref, 首次发现关键词, 首次发现时间, 真实链接, 广告标题, 首次发现国家,
+    # ch参数, utm_campaign参数, 出现次数, 出现过的国家(逗号分隔)
+    _REF_REGISTRY_COLUMNS = '''
+        r.ref_parameter, r.first_keyword, r.first_seen, r.first_real_target_url,
+        r.first_ad_title, r.first_country_code, r.first_ch_parameter,
+        r.first_utm_campaign_parameter, r.occurrence_count,
+        (SELECT GROUP_CONCAT(rc.country_code, ',') FROM ref_countries rc
+         WHERE rc.ref_parameter = r.ref_parameter) AS countries
+    '''
+    
+    # 时间范围内首次出现的ref
+    _NEW_REFS_SQL = f'''
+        SELECT {_REF_REGISTRY_COLUMNS}
+        FROM refs r
+        WHERE r.first_seen >= ? AND r.first_seen <= ?
+        ORDER BY r.first_seen DESC
+    '''
+    
+    # 时间范围内出现过的ref（包括更早首次出现的）
+    _ACTIVE_REFS_SQL = f'''
+        SELECT {_REF_REGISTRY_COLUMNS}
+        FROM refs r
+        WHERE r.last_seen >= ? AND r.first_seen <= ?
+        ORDER BY r.first_seen DESC
+    '''
+    
+    # 插入广告数据的SQL（单条插入与批量插入共用）
+    _INSERT_AD_SQL = '''
+        INSERT OR IGNORE INTO ads_data 
+        (keyword, country_code, ad_url, target_url, real_target_url, ref_parameter,
+         ch_parameter, utm_campaign_parameter, ad_title, ad_description, position, 
+         scrape_time, html_file_path)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    # 插入广告跟踪参数：按 ads_data 的唯一键找到广告id，与广告在同一事务中批量写入
+    _INSERT_AD_PARAM_SQL = '''
+        INSERT OR IGNORE INTO ad_params (ad_id, name, value)
+        SELECT id, ?, ? FROM ads_data
+        WHERE keyword = ? AND country_code = ? AND ad_url = ? AND scrape_time = ?
+    '''
+    
+    # 记录新插入广告的指纹：按 ads_data 的唯一键找到广告id，与广告在同一事务中写入
+    _INSERT_AD_FINGERPRINT_SQL = '''
+        INSERT INTO ad_fingerprints
+        (keyword, country_code, fingerprint, ad_id, first_seen, last_seen, seen_count)
+        SELECT keyword, country_code, ?, id, scrape_time, scrape_time, 1 FROM ads_data
+        WHERE keyword = ? AND country_code = ? AND ad_url = ? AND scrape_time = ?
+        ON CONFLICT(keyword, country_code, fingerprint) DO UPDATE SET
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen),
+            seen_count = seen_count + 1
+    '''
+    
+    # 可清理的原始广告记录：抓取时间早于保留期（?1），且不是仍在出现的广告指纹所引用的记录
+    _PRUNE_CONDITION = '''
+        scrape_time < ?1
+        AND id NOT IN (SELECT ad_id FROM ad_fingerprints WHERE last_seen >= ?1 AND ad_id IS NOT NULL)
+    '''
+    
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: 数据库文件路径，默认使用 get_database_path()（基准测试等场景可指定临时库）
+        """
+        self.db_path = db_path or get_database_path()
+        
+        # 长连接在实例内复用，并发抓取的线程通过锁串行访问
+        self._conn = None
+        self._lock = threading.RLock()
         
         self.init_database()
     
+    def _get_connection(self):
+        """获取实例的长连接（首次调用时创建）"""
+        if self._conn is None:
+            self._conn = connect_database(self.db_path, check_same_thread=False)
+        return self._conn
+    
+    def close(self):
+        """关闭长连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
     def init_database(self):
         """初始化数据库和表结构"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                self._create_tables(conn.cursor())
+    
+    def _create_tables(self, cursor):
+        """创建表结构并执行迁移"""
         # 创建广告数据表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ads_data (
@@ -62,9 +230,6 @@ class AdDatabase:
         
         # 检查并添加新字段（用于数据库迁移）
         self._migrate_database(cursor)
-        
-        conn.commit()
-        conn.close()
     
     def _migrate_database(self, cursor):
         """数据库迁移，添加新字段"""
@@ -91,116 +256,1592 @@ class AdDatabase:
                 
         except Exception as e:
             print(f"数据库迁移时出错: {e}")
+        
+        self._apply_versioned_migrations(cursor)
+    
+    def _apply_versioned_migrations(self, cursor):
+        """
+        按版本号依次执行结构迁移，已执行的版本记录在 PRAGMA user_version 中
+        
+        每个版本的结构变更和版本号更新在同一个显式事务中提交，失败时整体回滚并抛出异常，
+        数据库停留在上一个完整的版本，不会出现表已创建但版本号未更新（或相反）的中间状态
+        
+        Raises:
+            迁移失败时的原始异常（数据库已回滚到失败前的版本）
+        """
+        migrations = [
+            (1, '添加报表查询索引', self._migrate_v1_report_indexes),
+            (2, '添加ref首次发现登记表', self._migrate_v2_ref_registry),
+            (3, '添加HTML存储引用索引', self._migrate_v3_html_reference_index),
+            (4, '添加广告跟踪参数表', self._migrate_v4_ad_params),
+            (5, '添加广告变化检测指纹表', self._migrate_v5_fingerprints),
+            (6, '添加统计汇总表', self._migrate_v6_stats_rollups),
+            (7, '添加广告可见度汇总表', self._migrate_v7_visibility_rollups),
+            (8, '添加报表快照表', self._migrate_v8_report_snapshots),
+            (9, '添加邮件发件队列', self._migrate_v9_email_outbox),
+            (10, '添加增量导出检查点表', self._migrate_v10_export_checkpoints),
+        ]
+        
+        conn = cursor.connection
+        cursor.execute('PRAGMA user_version')
+        current_version = cursor.fetchone()[0]
+        if current_version >= migrations[-1][0]:
+            return
+        
+        # 提交之前的隐式事务，之后每个版本使用自己的事务
+        conn.commit()
+        for version, description, migrate in migrations:
+            if version <= current_version:
+                continue
+            # BEGIN IMMEDIATE 取得写锁后重新读取版本号，其他进程同时启动时不会重复执行同一版本
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('PRAGMA user_version')
+                pending = cursor.fetchone()[0] < version
+                if pending:
+                    migrate(cursor)
+                    cursor.execute(f'PRAGMA user_version = {version}')
+                cursor.execute('COMMIT')
+            except Exception as e:
+                # 部分错误（如磁盘已满）SQLite 已自动回滚
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                print(f"❌ 数据库迁移到版本 {version}（{description}）时出错，已回滚: {e}")
+                raise
+            if pending:
+                print(f"✅ 数据库已升级到版本 {version}: {description}")
+    
+    def _migrate_v1_report_indexes(self, cursor):
+        """为按时间范围和ref统计的报表查询添加索引"""
+        # 日报/周报和 ref_stats 按 scrape_time 范围过滤后按 ref 分组
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ads_data_scrape_time_ref
+            ON ads_data(scrape_time, ref_parameter)
+        ''')
+        # 按 ref 查询其出现历史
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ads_data_ref_scrape_time
+            ON ads_data(ref_parameter, scrape_time)
+        ''')
+        # 按关键词/国家统计和查询
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ads_data_keyword_country
+            ON ads_data(keyword, country_code)
+        ''')
+        cursor.execute('ANALYZE ads_data')
+    
+    def _migrate_v2_ref_registry(self, cursor):
+        """创建ref登记表，由触发器在插入广告数据时增量维护，并从历史数据回填"""
+        # 每个ref一行：首次/最近出现时间、出现次数以及首次出现时的广告信息
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS refs (
+                ref_parameter TEXT PRIMARY KEY,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                occurrence_count INTEGER NOT NULL DEFAULT 0,
+                first_keyword TEXT,
+                first_country_code TEXT,
+                first_ad_title TEXT,
+                first_real_target_url TEXT,
+                first_ch_parameter TEXT,
+                first_utm_campaign_parameter TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_refs_first_seen ON refs(first_seen)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_refs_last_seen ON refs(last_seen)')
+        
+        # 每个ref在各个国家的出现情况
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ref_countries (
+                ref_parameter TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                occurrence_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (ref_parameter, country_code)
+            ) WITHOUT ROWID
+        ''')
+        
+        # 回填历史数据（首次出现的广告信息取自每个ref最早的一行）
+        cursor.execute('''
+            INSERT OR IGNORE INTO refs
+            (ref_parameter, first_seen, last_seen, occurrence_count, first_keyword,
+             first_country_code, first_ad_title, first_real_target_url,
+             first_ch_parameter, first_utm_campaign_parameter)
+            SELECT ref_parameter, MIN(scrape_time), MIN(scrape_time), 0, keyword,
+                   country_code, ad_title, real_target_url,
+                   ch_parameter, utm_campaign_parameter
+            FROM ads_data
+            WHERE ref_parameter IS NOT NULL AND ref_parameter != ''
+            GROUP BY ref_parameter
+        ''')
+        cursor.execute('''
+            UPDATE refs SET (last_seen, occurrence_count) = (
+                SELECT MAX(scrape_time), COUNT(*) FROM ads_data
+                WHERE ads_data.ref_parameter = refs.ref_parameter
+            )
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO ref_countries
+            (ref_parameter, country_code, first_seen, last_seen, occurrence_count)
+            SELECT ref_parameter, country_code, MIN(scrape_time), MAX(scrape_time), COUNT(*)
+            FROM ads_data
+            WHERE ref_parameter IS NOT NULL AND ref_parameter != ''
+            GROUP BY ref_parameter, country_code
+        ''')
+        
+        # 新插入的广告数据（单条或批量）在同一事务中更新登记表
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_ads_data_refs
+            AFTER INSERT ON ads_data
+            WHEN NEW.ref_parameter IS NOT NULL AND NEW.ref_parameter != ''
+            BEGIN
+                INSERT INTO refs
+                (ref_parameter, first_seen, last_seen, occurrence_count, first_keyword,
+                 first_country_code, first_ad_title, first_real_target_url,
+                 first_ch_parameter, first_utm_campaign_parameter)
+                VALUES (NEW.ref_parameter, NEW.scrape_time, NEW.scrape_time, 1, NEW.keyword,
+                        NEW.country_code, NEW.ad_title, NEW.real_target_url,
+                        NEW.ch_parameter, NEW.utm_campaign_parameter)
+                ON CONFLICT(ref_parameter) DO UPDATE SET
+                    occurrence_count = occurrence_count + 1,
+                    last_seen = MAX(last_seen, excluded.last_seen),
+                    first_keyword = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_keyword ELSE first_keyword END,
+                    first_country_code = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_country_code ELSE first_country_code END,
+                    first_ad_title = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_ad_title ELSE first_ad_title END,
+                    first_real_target_url = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_real_target_url ELSE first_real_target_url END,
+                    first_ch_parameter = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_ch_parameter ELSE first_ch_parameter END,
+                    first_utm_campaign_parameter = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_utm_campaign_parameter ELSE first_utm_campaign_parameter END,
+                    first_seen = MIN(first_seen, excluded.first_seen);
+                
+                INSERT INTO ref_countries
+                (ref_parameter, country_code, first_seen, last_seen, occurrence_count)
+                VALUES (NEW.ref_parameter, NEW.country_code, NEW.scrape_time, NEW.scrape_time, 1)
+                ON CONFLICT(ref_parameter, country_code) DO UPDATE SET
+                    occurrence_count = occurrence_count + 1,
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen);
+            END
+        ''')
+    
+    def _migrate_v3_html_reference_index(self, cursor):
+        """为按HTML存储引用查询广告数据（离线重新提取）添加索引"""
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ads_data_html_file_path
+            ON ads_data(html_file_path)
+        ''')
+    
+    def _migrate_v4_ad_params(self, cursor):
+        """
+        创建广告跟踪参数表（每个广告的每个参数一行），并从历史数据回填
+        
+        新增跟踪参数只需修改 config.TRACKED_URL_PARAMS，不再需要为每个参数添加字段
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ad_params (
+                ad_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (ad_id, name)
+            ) WITHOUT ROWID
+        ''')
+        # 按参数名/参数值查询和统计
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ad_params_name_value
+            ON ad_params(name, value)
+        ''')
+        
+        # 回填：从真实落地页URL中提取跟踪参数，没有落地页URL时使用原有的参数字段
+        rows = cursor.execute('''
+            SELECT id, real_target_url, ref_parameter, ch_parameter, utm_campaign_parameter
+            FROM ads_data
+            WHERE (real_target_url IS NOT NULL AND real_target_url != '')
+               OR (ref_parameter IS NOT NULL AND ref_parameter != '')
+               OR (ch_parameter IS NOT NULL AND ch_parameter != '')
+               OR (utm_campaign_parameter IS NOT NULL AND utm_campaign_parameter != '')
+        ''').fetchall()
+        
+        param_rows = []
+        for ad_id, real_target_url, *legacy_values in rows:
+            params = extract_url_params(real_target_url)
+            for name, value in zip(LEGACY_PARAM_FIELDS, legacy_values):
+                if value and name not in params:
+                    params[name] = value
+            param_rows.extend((ad_id, name, value) for name, value in params.items())
+        
+        cursor.executemany(
+            'INSERT OR IGNORE INTO ad_params (ad_id, name, value) VALUES (?, ?, ?)', param_rows
+        )
+    
+    def _migrate_v5_fingerprints(self, cursor):
+        """创建广告指纹表和SERP指纹表（变化检测），不回填：升级后首次抓取时建立基线"""
+        # 每个关键词/国家下出现过的每个广告一行，ad_id 为首次插入的广告记录
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ad_fingerprints (
+                keyword TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                ad_id INTEGER,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                seen_count INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (keyword, country_code, fingerprint)
+            ) WITHOUT ROWID
+        ''')
+        # 每个关键词/国家最近一次抓取的广告集合指纹
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS serp_fingerprints (
+                keyword TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                ad_count INTEGER NOT NULL DEFAULT 0,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                seen_count INTEGER NOT NULL DEFAULT 1,
+                change_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (keyword, country_code)
+            ) WITHOUT ROWID
+        ''')
+    
+    def _migrate_v6_stats_rollups(self, cursor):
+        """
+        创建统计汇总表，由 ads_data 和 scrape_logs 上的触发器在插入/删除的同一事务中维护，并从历史数据回填
+        
+        --mode stats 和每次抓取后的统计只读取这些汇总表，不再对全表计数
+        """
+        # 全局汇总，只有一行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_scrapes INTEGER NOT NULL DEFAULT 0,
+                successful_scrapes INTEGER NOT NULL DEFAULT 0,
+                total_ads INTEGER NOT NULL DEFAULT 0,
+                last_scrape TIMESTAMP
+            )
+        ''')
+        # 按关键词/国家汇总
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS keyword_country_stats (
+                keyword TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                scrape_count INTEGER NOT NULL DEFAULT 0,
+                success_count INTEGER NOT NULL DEFAULT 0,
+                ads_count INTEGER NOT NULL DEFAULT 0,
+                last_scrape TIMESTAMP,
+                PRIMARY KEY (keyword, country_code)
+            ) WITHOUT ROWID
+        ''')
+        # 按小时汇总，hour 为抓取时间的前13个字符（YYYY-MM-DD HH）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hourly_stats (
+                hour TEXT PRIMARY KEY,
+                scrape_count INTEGER NOT NULL DEFAULT 0,
+                success_count INTEGER NOT NULL DEFAULT 0,
+                ads_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        
+        # 回填历史数据
+        cursor.execute('''
+            INSERT OR REPLACE INTO stats_totals (id, total_scrapes, successful_scrapes, total_ads, last_scrape)
+            SELECT 1,
+                   (SELECT COUNT(*) FROM scrape_logs),
+                   (SELECT COUNT(*) FROM scrape_logs WHERE status = 'success'),
+                   (SELECT COUNT(*) FROM ads_data),
+                   (SELECT MAX(scrape_time) FROM scrape_logs)
+        ''')
+        cursor.execute('DELETE FROM keyword_country_stats')
+        cursor.execute('''
+            INSERT INTO keyword_country_stats
+            (keyword, country_code, scrape_count, success_count, last_scrape)
+            SELECT keyword, country_code, COUNT(*), SUM(status = 'success'), MAX(scrape_time)
+            FROM scrape_logs
+            GROUP BY keyword, country_code
+        ''')
+        cursor.execute('''
+            INSERT INTO keyword_country_stats (keyword, country_code, ads_count)
+            SELECT keyword, country_code, COUNT(*) FROM ads_data
+            GROUP BY keyword, country_code
+            ON CONFLICT(keyword, country_code) DO UPDATE SET ads_count = excluded.ads_count
+        ''')
+        cursor.execute('DELETE FROM hourly_stats')
+        cursor.execute('''
+            INSERT INTO hourly_stats (hour, scrape_count, success_count)
+            SELECT substr(scrape_time, 1, 13), COUNT(*), SUM(status = 'success')
+            FROM scrape_logs
+            GROUP BY substr(scrape_time, 1, 13)
+        ''')
+        cursor.execute('''
+            INSERT INTO hourly_stats (hour, ads_count)
+            SELECT substr(scrape_time, 1, 13), COUNT(*) FROM ads_data
+            GROUP BY substr(scrape_time, 1, 13)
+            ON CONFLICT(hour) DO UPDATE SET ads_count = excluded.ads_count
+        ''')
+        
+        # 抓取日志的插入/删除
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_scrape_logs_stats_insert
+            AFTER INSERT ON scrape_logs
+            BEGIN
+                UPDATE stats_totals SET
+                    total_scrapes = total_scrapes + 1,
+                    successful_scrapes = successful_scrapes + (NEW.status = 'success'),
+                    last_scrape = MAX(COALESCE(last_scrape, NEW.scrape_time), NEW.scrape_time)
+                WHERE id = 1;
+                
+                INSERT INTO keyword_country_stats
+                (keyword, country_code, scrape_count, success_count, last_scrape)
+                VALUES (NEW.keyword, NEW.country_code, 1, NEW.status = 'success', NEW.scrape_time)
+                ON CONFLICT(keyword, country_code) DO UPDATE SET
+                    scrape_count = scrape_count + 1,
+                    success_count = success_count + excluded.success_count,
+                    last_scrape = MAX(COALESCE(last_scrape, excluded.last_scrape), excluded.last_scrape);
+                
+                INSERT INTO hourly_stats (hour, scrape_count, success_count)
+                VALUES (substr(NEW.scrape_time, 1, 13), 1, NEW.status = 'success')
+                ON CONFLICT(hour) DO UPDATE SET
+                    scrape_count = scrape_count + 1,
+                    success_count = success_count + excluded.success_count;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_scrape_logs_stats_delete
+            AFTER DELETE ON scrape_logs
+            BEGIN
+                UPDATE stats_totals SET
+                    total_scrapes = total_scrapes - 1,
+                    successful_scrapes = successful_scrapes - (OLD.status = 'success')
+                WHERE id = 1;
+                
+                UPDATE keyword_country_stats SET
+                    scrape_count = scrape_count - 1,
+                    success_count = success_count - (OLD.status = 'success')
+                WHERE keyword = OLD.keyword AND country_code = OLD.country_code;
+                
+                UPDATE hourly_stats SET
+                    scrape_count = scrape_count - 1,
+                    success_count = success_count - (OLD.status = 'success')
+                WHERE hour = substr(OLD.scrape_time, 1, 13);
+            END
+        ''')
+        
+        # 广告数据的插入/删除
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_ads_data_stats_insert
+            AFTER INSERT ON ads_data
+            BEGIN
+                UPDATE stats_totals SET total_ads = total_ads + 1 WHERE id = 1;
+                
+                INSERT INTO keyword_country_stats (keyword, country_code, ads_count)
+                VALUES (NEW.keyword, NEW.country_code, 1)
+                ON CONFLICT(keyword, country_code) DO UPDATE SET ads_count = ads_count + 1;
+                
+                INSERT INTO hourly_stats (hour, ads_count)
+                VALUES (substr(NEW.scrape_time, 1, 13), 1)
+                ON CONFLICT(hour) DO UPDATE SET ads_count = ads_count + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_ads_data_stats_delete
+            AFTER DELETE ON ads_data
+            BEGIN
+                UPDATE stats_totals SET total_ads = total_ads - 1 WHERE id = 1;
+                
+                UPDATE keyword_country_stats SET ads_count = ads_count - 1
+                WHERE keyword = OLD.keyword AND country_code = OLD.country_code;
+                
+                UPDATE hourly_stats SET ads_count = ads_count - 1
+                WHERE hour = substr(OLD.scrape_time, 1, 13);
+            END
+        ''')
+    
+    def _migrate_v7_visibility_rollups(self, cursor):
+        """
+        创建广告可见度汇总表（小时/天/周 × 关键词 × 国家），并从历史数据回填
+        
+        汇总表在每批抓取结束时由 update_visibility_rollups() 增量更新，包括变化检测跳过插入的未变化广告；
+        回填只能使用 ads_data 中已有的行，开启变化检测后未变化广告的历史出现次数无法回填
+        """
+        # 每个时间桶/关键词/国家一行：成功抓取的SERP数、广告出现次数、位置之和
+        # （平均位置 = position_sum / appearances）和出现过的不同ref数
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visibility_buckets (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                serp_count INTEGER NOT NULL DEFAULT 0,
+                appearances INTEGER NOT NULL DEFAULT 0,
+                position_sum INTEGER NOT NULL DEFAULT 0,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket, keyword, country_code)
+            ) WITHOUT ROWID
+        ''')
+        # 每个时间桶/关键词/国家下每个ref一行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visibility_refs (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                country_code TEXT NOT NULL,
+                ref_parameter TEXT NOT NULL,
+                appearances INTEGER NOT NULL DEFAULT 0,
+                position_sum INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket, keyword, country_code, ref_parameter)
+            ) WITHOUT ROWID
+        ''')
+        
+        # 回填历史数据
+        cursor.execute('DELETE FROM visibility_buckets')
+        cursor.execute('DELETE FROM visibility_refs')
+        for granularity, bucket_sql in VISIBILITY_GRANULARITIES.items():
+            bucket = bucket_sql.format('scrape_time')
+            cursor.execute(f'''
+                INSERT INTO visibility_buckets (granularity, bucket, keyword, country_code, serp_count)
+                SELECT ?, {bucket}, keyword, country_code, COUNT(*)
+                FROM scrape_logs
+                WHERE status = 'success'
+                GROUP BY 2, 3, 4
+            ''', (granularity,))
+            cursor.execute(f'''
+                INSERT INTO visibility_buckets
+                (granularity, bucket, keyword, country_code, appearances, position_sum)
+                SELECT ?, {bucket}, keyword, country_code, COUNT(*), TOTAL(position)
+                FROM ads_data
+                GROUP BY 2, 3, 4
+                ON CONFLICT(granularity, bucket, keyword, country_code) DO UPDATE SET
+                    appearances = excluded.appearances,
+                    position_sum = excluded.position_sum
+            ''', (granularity,))
+            cursor.execute(f'''
+                INSERT INTO visibility_refs
+                (granularity, bucket, keyword, country_code, ref_parameter, appearances, position_sum)
+                SELECT ?, {bucket}, keyword, country_code, ref_parameter, COUNT(*), TOTAL(position)
+                FROM ads_data
+                WHERE ref_parameter IS NOT NULL AND ref_parameter != ''
+                GROUP BY 2, 3, 4, 5
+            ''', (granularity,))
+        cursor.execute('''
+            UPDATE visibility_buckets SET ref_count = (
+                SELECT COUNT(*) FROM visibility_refs r
+                WHERE r.granularity = visibility_buckets.granularity
+                  AND r.bucket = visibility_buckets.bucket
+                  AND r.keyword = visibility_buckets.keyword
+                  AND r.country_code = visibility_buckets.country_code
+            )
+        ''')
+    
+    def _migrate_v8_report_snapshots(self, cursor):
+        """
+        创建报表快照表和数据版本号
+        
+        ref登记表（refs）每次变化（插入广告或未变化广告再次出现）时由触发器递增数据版本号，
+        快照记录生成时的版本号，版本号变化后旧快照不再使用
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS report_data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO report_data_version (id, version) VALUES (1, 0)')
+        
+        # 每个快照保存 window_start 之后出现过的所有ref（JSON数组，每行为ref登记表查询的列加上最近出现时间）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS report_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                window_start TIMESTAMP NOT NULL,
+                data_version INTEGER NOT NULL,
+                ref_count INTEGER NOT NULL,
+                rows TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_report_snapshots_version
+            ON report_snapshots(data_version, window_start)
+        ''')
+        
+        for event in ('INSERT', 'UPDATE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_refs_report_version_{event.lower()}
+                AFTER {event} ON refs
+                BEGIN
+                    UPDATE report_data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+    
+    def _migrate_v9_email_outbox(self, cursor):
+        """
+        创建发件队列：邮件内容和每个收件人的发送状态
+        
+        邮件由 enqueue_email() 写入后立即返回，由 mailer 模块（--mode mailer）取出发送并记录结果
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                html_content TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+        ''')
+        # 每个收件人一行：status 为 pending/sent/failed；取出发送时写入 claim_token 并把
+        # next_attempt_at 推迟到租约到期时间，发送进程中断时到期后会被重新取出
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox_recipients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER NOT NULL REFERENCES email_outbox(id) ON DELETE CASCADE,
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL,
+                claim_token TEXT,
+                last_error TEXT,
+                sent_at TIMESTAMP,
+                UNIQUE(message_id, recipient)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_email_outbox_recipients_due
+            ON email_outbox_recipients(status, next_attempt_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_email_outbox_recipients_claim
+            ON email_outbox_recipients(claim_token)
+        ''')
+    
+    def _migrate_v10_export_checkpoints(self, cursor):
+        """
+        创建增量导出检查点表：每个消费方一行，记录已导出的最大 ads_data.id
+        
+        由 exporter.export_incremental() 在导出文件写完后更新；
+        之前版本的导出在首次运行时已创建同名表时保持不变
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_checkpoints (
+                consumer TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                last_exported_at TIMESTAMP,
+                last_file TEXT,
+                exported_rows INTEGER NOT NULL DEFAULT 0,
+                run_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+    
+    def _ad_param_rows(self, keyword, country_code, ad_data, scrape_time):
+        """构建 ad_params 插入语句的参数（广告的 url_params，没有时使用原有的参数字段）"""
+        params = ad_data.get('url_params')
+        if params is None:
+            params = {
+                name: ad_data.get(field)
+                for name, field in LEGACY_PARAM_FIELDS.items()
+            }
+        
+        ad_url = ad_data.get('ad_url', '')
+        return [
+            (name, value, keyword, country_code, ad_url, scrape_time)
+            for name, value in params.items()
+            if value
+        ]
+    
+    def _ad_row(self, keyword, country_code, ad_data, scrape_time, html_file_path):
+        """构建 ads_data 插入语句的参数"""
+        return (
+            keyword,
+            country_code,
+            ad_data.get('ad_url', ''),
+            ad_data.get('target_url', ''),
+            ad_data.get('real_target_url', ''),
+            ad_data.get('ref_parameter', ''),
+            ad_data.get('ch_parameter', ''),
+            ad_data.get('utm_campaign_parameter', ''),
+            ad_data.get('title', ''),
+            ad_data.get('description', ''),
+            ad_data.get('position', 0),
+            scrape_time,
+            html_file_path
+        )
     
     def insert_ad_data(self, keyword, country_code, ad_data, scrape_time, html_file_path):
         """插入广告数据"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                with conn:
+                    cursor = conn.execute(self._INSERT_AD_SQL, self._ad_row(
+                        keyword, country_code, ad_data, scrape_time, html_file_path
+                    ))
+                    conn.executemany(self._INSERT_AD_PARAM_SQL, self._ad_param_rows(
+                        keyword, country_code, ad_data, scrape_time
+                    ))
+                return cursor.lastrowid
+            except Exception as e:
+                print(f"插入广告数据时出错: {e}")
+                return None
+    
+    def insert_ads_batch(self, keyword, country_code, ads, scrape_time, html_file_path,
+                         unchanged_fingerprints=(), page_fingerprint=None, page_ad_count=0):
+        """
+        在一个事务中批量插入同一SERP页面的所有广告
         
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO ads_data 
-                (keyword, country_code, ad_url, target_url, real_target_url, ref_parameter,
-                 ch_parameter, utm_campaign_parameter, ad_title, ad_description, position, 
-                 scrape_time, html_file_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                keyword,
-                country_code,
-                ad_data.get('ad_url', ''),
-                ad_data.get('target_url', ''),
-                ad_data.get('real_target_url', ''),
-                ad_data.get('ref_parameter', ''),
-                ad_data.get('ch_parameter', ''),
-                ad_data.get('utm_campaign_parameter', ''),
-                ad_data.get('title', ''),
-                ad_data.get('description', ''),
-                ad_data.get('position', 0),
-                scrape_time,
-                html_file_path
-            ))
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            print(f"插入广告数据时出错: {e}")
-            return None
-        finally:
-            conn.close()
+        开启变化检测时，未变化广告的指纹更新和SERP指纹也在同一事务中写入：写入失败时整个事务回滚，
+        下次抓取不会把这个页面误判为未变化
+        
+        Args:
+            keyword: 搜索关键词
+            country_code: 国家代码
+            ads: 广告数据字典列表
+            scrape_time: 抓取时间
+            html_file_path: 对应的HTML存储引用（存档引用或文件路径）
+            unchanged_fingerprints: 本页未变化（不插入）的广告指纹，见 touch_ad_fingerprints()
+            page_fingerprint: 本页的SERP指纹，见 record_serp_fingerprint()
+            page_ad_count: 本页的广告总数
+            
+        Returns:
+            实际插入的行数（已存在的重复记录不计入）
+        
+        Raises:
+            写入失败时抛出 sqlite3 的异常
+        """
+        rows = [
+            self._ad_row(keyword, country_code, ad_data, scrape_time, html_file_path)
+            for ad_data in ads
+        ]
+        param_rows = [
+            param_row
+            for ad_data in ads
+            for param_row in self._ad_param_rows(keyword, country_code, ad_data, scrape_time)
+        ]
+        # 开启变化检测时广告带有指纹，同时登记到指纹表
+        fingerprint_rows = [
+            (ad_data['fingerprint'], keyword, country_code, ad_data.get('ad_url', ''), scrape_time)
+            for ad_data in ads
+            if ad_data.get('fingerprint')
+        ]
+        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                inserted = 0
+                if rows:
+                    inserted = conn.executemany(self._INSERT_AD_SQL, rows).rowcount
+                if param_rows:
+                    conn.executemany(self._INSERT_AD_PARAM_SQL, param_rows)
+                if fingerprint_rows:
+                    conn.executemany(self._INSERT_AD_FINGERPRINT_SQL, fingerprint_rows)
+                self._touch_ad_fingerprints(conn, keyword, country_code, unchanged_fingerprints, scrape_time)
+                if page_fingerprint:
+                    self._record_serp_fingerprint(
+                        conn, keyword, country_code, page_fingerprint, page_ad_count, scrape_time
+                    )
+            return inserted
+    
+    def get_serp_fingerprint(self, keyword, country_code):
+        """获取关键词/国家最近一次抓取的SERP指纹，没有记录时返回None"""
+        with self._lock:
+            row = self._get_connection().execute('''
+                SELECT fingerprint FROM serp_fingerprints
+                WHERE keyword = ? AND country_code = ?
+            ''', (keyword, country_code)).fetchone()
+        return row[0] if row else None
+    
+    def record_serp_fingerprint(self, keyword, country_code, fingerprint, ad_count, scrape_time):
+        """
+        记录本次抓取的SERP指纹
+        
+        Returns:
+            广告集合与上次抓取相比是否有变化（首次抓取视为有变化）
+        """
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                return self._record_serp_fingerprint(
+                    conn, keyword, country_code, fingerprint, ad_count, scrape_time
+                )
+    
+    def _record_serp_fingerprint(self, conn, keyword, country_code, fingerprint, ad_count, scrape_time):
+        """在调用方的事务中记录SERP指纹，见 record_serp_fingerprint()"""
+        row = conn.execute('''
+            SELECT fingerprint FROM serp_fingerprints
+            WHERE keyword = ? AND country_code = ?
+        ''', (keyword, country_code)).fetchone()
+        
+        if row and row[0] == fingerprint:
+            conn.execute('''
+                UPDATE serp_fingerprints
+                SET last_seen = MAX(last_seen, ?), seen_count = seen_count + 1
+                WHERE keyword = ? AND country_code = ?
+            ''', (scrape_time, keyword, country_code))
+            return False
+        
+        conn.execute('''
+            INSERT INTO serp_fingerprints
+            (keyword, country_code, fingerprint, ad_count, first_seen, last_seen, seen_count, change_count)
+            VALUES (?, ?, ?, ?, ?, ?, 1, 0)
+            ON CONFLICT(keyword, country_code) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                ad_count = excluded.ad_count,
+                first_seen = excluded.first_seen,
+                last_seen = excluded.last_seen,
+                seen_count = 1,
+                change_count = change_count + 1
+        ''', (keyword, country_code, fingerprint, ad_count, scrape_time, scrape_time))
+        return True
+    
+    def get_known_ad_fingerprints(self, keyword, country_code, fingerprints):
+        """返回 fingerprints 中已在该关键词/国家下出现过的广告指纹集合"""
+        fingerprints = list(set(fingerprints))
+        if not fingerprints:
+            return set()
+        
+        placeholders = ','.join('?' * len(fingerprints))
+        with self._lock:
+            rows = self._get_connection().execute(f'''
+                SELECT fingerprint FROM ad_fingerprints
+                WHERE keyword = ? AND country_code = ? AND fingerprint IN ({placeholders})
+            ''', [keyword, country_code, *fingerprints]).fetchall()
+        return {row[0] for row in rows}
+    
+    def get_fingerprinted_ad_urls(self, keyword, country_code):
+        """
+        返回该关键词/国家下已登记指纹的广告链接及其首次出现时间 [(广告URL, 首次出现时间), ...]
+        
+        广告URL取自指纹引用的广告记录，同一广告链接的标题变化后会有多个指纹
+        """
+        with self._lock:
+            return self._get_connection().execute('''
+                SELECT a.ad_url, f.first_seen FROM ad_fingerprints f
+                JOIN ads_data a ON a.id = f.ad_id
+                WHERE f.keyword = ? AND f.country_code = ?
+            ''', (keyword, country_code)).fetchall()
+    
+    def touch_ad_fingerprints(self, keyword, country_code, fingerprints, scrape_time):
+        """
+        记录未变化的广告再次出现：更新指纹表的最近出现时间和次数，不插入新的广告记录
+        
+        ref登记表（refs、ref_countries）按每次出现累计，这里与插入触发器一样更新对应ref的
+        最近出现时间和出现次数，日报/周报中的活跃ref不受影响
+        
+        Returns:
+            更新的指纹数
+        """
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                return self._touch_ad_fingerprints(conn, keyword, country_code, fingerprints, scrape_time)
+    
+    def _touch_ad_fingerprints(self, conn, keyword, country_code, fingerprints, scrape_time):
+        """在调用方的事务中更新未变化广告的指纹和ref登记表，见 touch_ad_fingerprints()"""
+        if not fingerprints:
+            return 0
+        
+        rows = [(scrape_time, keyword, country_code, fingerprint) for fingerprint in fingerprints]
+        # 指纹对应的广告记录中的ref（参数依次为 抓取时间、关键词、国家、指纹）
+        ad_ref_sql = '''
+            SELECT a.ref_parameter FROM ad_fingerprints f
+            JOIN ads_data a ON a.id = f.ad_id
+            WHERE f.keyword = ?2 AND f.country_code = ?3 AND f.fingerprint = ?4
+        '''
+        
+        updated = conn.executemany('''
+            UPDATE ad_fingerprints
+            SET last_seen = MAX(last_seen, ?), seen_count = seen_count + 1
+            WHERE keyword = ? AND country_code = ? AND fingerprint = ?
+        ''', rows).rowcount
+        conn.executemany(f'''
+            UPDATE refs
+            SET last_seen = MAX(last_seen, ?1), occurrence_count = occurrence_count + 1
+            WHERE ref_parameter = ({ad_ref_sql})
+        ''', rows)
+        conn.executemany(f'''
+            UPDATE ref_countries
+            SET last_seen = MAX(last_seen, ?1), occurrence_count = occurrence_count + 1
+            WHERE country_code = ?3 AND ref_parameter = ({ad_ref_sql})
+        ''', rows)
+        return updated
+    
+    def get_ad_fingerprint_refs(self, keyword, country_code, fingerprints):
+        """返回已登记的广告指纹对应广告记录中的ref {指纹: ref}，没有ref的广告不在结果中"""
+        fingerprints = list(set(fingerprints))
+        if not fingerprints:
+            return {}
+        
+        placeholders = ','.join('?' * len(fingerprints))
+        with self._lock:
+            rows = self._get_connection().execute(f'''
+                SELECT f.fingerprint, a.ref_parameter FROM ad_fingerprints f
+                JOIN ads_data a ON a.id = f.ad_id
+                WHERE f.keyword = ? AND f.country_code = ? AND f.fingerprint IN ({placeholders})
+                  AND a.ref_parameter IS NOT NULL AND a.ref_parameter != ''
+            ''', [keyword, country_code, *fingerprints]).fetchall()
+        return dict(rows)
+    
+    def get_html_references(self):
+        """获取 ads_data 中所有不同的HTML存储引用"""
+        with self._lock:
+            rows = self._get_connection().execute('''
+                SELECT DISTINCT html_file_path FROM ads_data
+                WHERE html_file_path IS NOT NULL AND html_file_path != ''
+            ''').fetchall()
+        return [row[0] for row in rows]
+    
+    def update_html_references(self, mapping):
+        """
+        批量替换 ads_data 中的HTML存储引用（HTML存档迁移时使用）
+        
+        Args:
+            mapping: {旧引用: 新引用} 字典
+        
+        Returns:
+            更新的行数
+        """
+        if not mapping:
+            return 0
+        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                # 先写入临时表再一次性更新，避免每个旧引用都扫描一遍 ads_data
+                conn.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS html_ref_mapping (
+                        old_ref TEXT PRIMARY KEY,
+                        new_ref TEXT NOT NULL
+                    )
+                ''')
+                conn.execute('DELETE FROM html_ref_mapping')
+                conn.executemany(
+                    'INSERT OR REPLACE INTO html_ref_mapping (old_ref, new_ref) VALUES (?, ?)',
+                    mapping.items()
+                )
+                cursor = conn.execute('''
+                    UPDATE ads_data SET html_file_path = (
+                        SELECT new_ref FROM html_ref_mapping WHERE old_ref = ads_data.html_file_path
+                    )
+                    WHERE html_file_path IN (SELECT old_ref FROM html_ref_mapping)
+                ''')
+                updated = cursor.rowcount
+                conn.execute('DROP TABLE html_ref_mapping')
+            return updated
+    
+    def get_ads_by_html_reference(self, html_ref):
+        """获取与某个HTML存储引用关联的广告数据（离线重新提取时对比使用）"""
+        with self._lock:
+            return self._get_connection().execute('''
+                SELECT id, keyword, country_code, scrape_time, ad_url, target_url,
+                       ad_title, ad_description, position
+                FROM ads_data
+                WHERE html_file_path = ?
+            ''', (html_ref,)).fetchall()
+    
+    def apply_reextraction(self, updates, inserts):
+        """
+        在一个事务中写入重新提取的修正结果
+        
+        Args:
+            updates: (target_url, ad_title, ad_description, position, id) 元组列表
+            inserts: (keyword, country_code, ad_data, scrape_time, html_file_path) 元组列表，
+                     ad_data 中带有 fingerprint 时同时登记到指纹表
+        
+        Returns:
+            (更新的行数, 插入的行数)
+        """
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                updated = 0
+                if updates:
+                    updated = conn.executemany('''
+                        UPDATE ads_data
+                        SET target_url = ?, ad_title = ?, ad_description = ?, position = ?
+                        WHERE id = ?
+                    ''', updates).rowcount
+                
+                inserted = 0
+                if inserts:
+                    inserted = conn.executemany(self._INSERT_AD_SQL, [
+                        self._ad_row(*insert) for insert in inserts
+                    ]).rowcount
+                    conn.executemany(self._INSERT_AD_PARAM_SQL, [
+                        param_row
+                        for keyword, country_code, ad_data, scrape_time, _ in inserts
+                        for param_row in self._ad_param_rows(keyword, country_code, ad_data, scrape_time)
+                    ])
+                    # 带有指纹的广告（开启变化检测时）登记到指纹表，之后的抓取和重新提取不会再重复插入
+                    conn.executemany(self._INSERT_AD_FINGERPRINT_SQL, [
+                        (ad_data['fingerprint'], keyword, country_code, ad_data.get('ad_url', ''), scrape_time)
+                        for keyword, country_code, ad_data, scrape_time, _ in inserts
+                        if ad_data.get('fingerprint')
+                    ])
+            return updated, inserted
     
     def insert_scrape_log(self, keyword, country_code, status, ads_found=0, error_message=None):
         """插入抓取日志"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO scrape_logs 
-                (keyword, country_code, status, ads_found, error_message, scrape_time)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                keyword,
-                country_code,
-                status,
-                ads_found,
-                error_message,
-                datetime.now()
-            ))
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            print(f"插入日志时出错: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                with conn:
+                    cursor = conn.execute('''
+                        INSERT INTO scrape_logs 
+                        (keyword, country_code, status, ads_found, error_message, scrape_time)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (
+                        keyword,
+                        country_code,
+                        status,
+                        ads_found,
+                        error_message,
+                        datetime.now()
+                    ))
+                return cursor.lastrowid
+            except Exception as e:
+                print(f"插入日志时出错: {e}")
+                return None
     
     def get_ads_by_keyword(self, keyword, country_code=None):
         """根据关键词获取广告数据"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            cursor = self._get_connection().cursor()
+            
+            if country_code:
+                cursor.execute('''
+                    SELECT * FROM ads_data 
+                    WHERE keyword = ? AND country_code = ?
+                    ORDER BY scrape_time DESC
+                ''', (keyword, country_code))
+            else:
+                cursor.execute('''
+                    SELECT * FROM ads_data 
+                    WHERE keyword = ?
+                    ORDER BY scrape_time DESC
+                ''', (keyword,))
+            
+            return cursor.fetchall()
+    
+    def get_new_refs(self, start_time, end_time, use_snapshot=None):
+        """
+        获取在时间范围内首次出现的ref（查询ref登记表，不扫描广告数据）
         
-        if country_code:
-            cursor.execute('''
-                SELECT * FROM ads_data 
-                WHERE keyword = ? AND country_code = ?
-                ORDER BY scrape_time DESC
-            ''', (keyword, country_code))
-        else:
-            cursor.execute('''
-                SELECT * FROM ads_data 
-                WHERE keyword = ?
-                ORDER BY scrape_time DESC
-            ''', (keyword,))
+        开启报表快照时从快照中筛选（见 get_ref_snapshot()），结果与直接查询相同
+        """
+        if REPORT_SNAPSHOTS if use_snapshot is None else use_snapshot:
+            start, end = self._sql_time(start_time), self._sql_time(end_time)
+            return [
+                row[:-1] for row in self.get_ref_snapshot(start_time)
+                if start <= row[2] <= end
+            ]
         
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with self._lock:
+            return self._get_connection().execute(
+                self._NEW_REFS_SQL, (start_time, end_time)
+            ).fetchall()
     
-    def get_scrape_stats(self):
-        """获取抓取统计信息"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_active_refs(self, start_time, end_time, use_snapshot=None):
+        """
+        获取在时间范围内出现过的ref（查询ref登记表，不扫描广告数据）
+        
+        开启报表快照时从快照中筛选（见 get_ref_snapshot()），结果与直接查询相同
+        """
+        if REPORT_SNAPSHOTS if use_snapshot is None else use_snapshot:
+            start, end = self._sql_time(start_time), self._sql_time(end_time)
+            return [
+                row[:-1] for row in self.get_ref_snapshot(start_time)
+                if row[-1] >= start and row[2] <= end
+            ]
+        
+        with self._lock:
+            return self._get_connection().execute(
+                self._ACTIVE_REFS_SQL, (start_time, end_time)
+            ).fetchall()
+    
+    @staticmethod
+    def _sql_time(value):
+        """时间参数在SQLite中的存储形式（与 sqlite3 对 datetime 的默认转换相同），用于与快照中的时间比较"""
+        if isinstance(value, datetime):
+            return value.isoformat(' ')
+        return str(value)
+    
+    def get_report_data_version(self):
+        """获取ref登记表的数据版本号（每次ref数据变化时递增）"""
+        with self._lock:
+            row = self._get_connection().execute(
+                'SELECT version FROM report_data_version WHERE id = 1'
+            ).fetchone()
+        return row[0] if row else 0
+    
+    def get_ref_snapshot(self, start_time):
+        """
+        获取 start_time 之后出现过的所有ref（最近出现时间 >= start_time），按首次出现时间倒序
+        
+        结果按 (起始时间, 数据版本号) 缓存在 report_snapshots 表中，日报、周报和 ref_stats 等进程共用：
+        数据版本号未变化且已有快照覆盖 start_time 时直接读取快照，否则查询一次ref登记表并保存为新快照。
+        新快照至少覆盖 REPORT_SNAPSHOT_DAYS 天，之后时间范围较短的查询也能直接使用
         
-        # 总的抓取次数
-        cursor.execute('SELECT COUNT(*) FROM scrape_logs')
-        total_scrapes = cursor.fetchone()[0]
+        Returns:
+            元组列表，每行为 get_active_refs() 返回的列加上最近出现时间
+        """
+        start = self._sql_time(start_time)
         
-        # 成功抓取次数
-        cursor.execute('SELECT COUNT(*) FROM scrape_logs WHERE status = "success"')
-        successful_scrapes = cursor.fetchone()[0]
+        with self._lock:
+            conn = self._get_connection()
+            # 先读版本号再查询：查询期间有新数据时，快照记录的是旧版本号，不会被使用
+            version = self.get_report_data_version()
+            row = conn.execute('''
+                SELECT rows FROM report_snapshots
+                WHERE data_version = ? AND window_start <= ?
+                ORDER BY window_start DESC
+                LIMIT 1
+            ''', (version, start)).fetchone()
+            if row:
+                return [tuple(values) for values in json.loads(row[0])]
+            
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            window_start = min(start, self._sql_time(today - timedelta(days=REPORT_SNAPSHOT_DAYS)))
+            rows = conn.execute(f'''
+                SELECT {self._REF_REGISTRY_COLUMNS}, r.last_seen
+                FROM refs r
+                WHERE r.last_seen >= ?
+                ORDER BY r.first_seen DESC
+            ''', (window_start,)).fetchall()
+            
+            with conn:
+                conn.execute('DELETE FROM report_snapshots WHERE data_version < ?', (version,))
+                conn.execute('''
+                    INSERT INTO report_snapshots (window_start, data_version, ref_count, rows, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (window_start, version, len(rows), json.dumps(rows, ensure_ascii=False), datetime.now()))
+            return rows
+    
+    def find_ads_by_param(self, name, value=None, start_time=None, end_time=None, limit=None):
+        """
+        按跟踪参数查询广告（通过 ad_params 的 (name, value) 索引，不扫描广告数据）
         
-        # 总发现的广告数量
-        cursor.execute('SELECT COUNT(*) FROM ads_data')
-        total_ads = cursor.fetchone()[0]
+        Args:
+            name: 参数名，如 'gad_campaignid'
+            value: 参数值，为None时返回带有该参数的所有广告
+            start_time, end_time: 抓取时间范围（可选）
+            limit: 最多返回的行数（可选）
         
-        # 最近抓取时间
-        cursor.execute('SELECT MAX(scrape_time) FROM scrape_logs')
-        last_scrape = cursor.fetchone()[0]
+        Returns:
+            (id, keyword, country_code, scrape_time, ad_title, real_target_url, 参数值) 元组列表，按抓取时间倒序
+        """
+        conditions = ['p.name = ?']
+        params = [name]
+        if value is not None:
+            conditions.append('p.value = ?')
+            params.append(value)
+        if start_time is not None:
+            conditions.append('a.scrape_time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append('a.scrape_time <= ?')
+            params.append(end_time)
         
-        conn.close()
+        sql = f'''
+            SELECT a.id, a.keyword, a.country_code, a.scrape_time, a.ad_title,
+                   a.real_target_url, p.value
+            FROM ad_params p
+            JOIN ads_data a ON a.id = p.ad_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY a.scrape_time DESC
+        '''
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
         
+        with self._lock:
+            return self._get_connection().execute(sql, params).fetchall()
+    
+    def get_param_value_counts(self, name, start_time=None, end_time=None, limit=None):
+        """
+        统计某个跟踪参数的各个取值（如按 utm_campaign 或 gad_campaignid 统计投放）
+        
+        Returns:
+            (参数值, 广告数, 关键词数, 国家数, 首次出现时间, 最近出现时间) 元组列表，按广告数倒序
+        """
+        conditions = ['p.name = ?']
+        params = [name]
+        if start_time is not None:
+            conditions.append('a.scrape_time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append('a.scrape_time <= ?')
+            params.append(end_time)
+        
+        sql = f'''
+            SELECT p.value, COUNT(*), COUNT(DISTINCT a.keyword), COUNT(DISTINCT a.country_code),
+                   MIN(a.scrape_time), MAX(a.scrape_time)
+            FROM ad_params p
+            JOIN ads_data a ON a.id = p.ad_id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY p.value
+            ORDER BY COUNT(*) DESC, p.value
+        '''
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        
+        with self._lock:
+            return self._get_connection().execute(sql, params).fetchall()
+    
+    def get_ad_params(self, ad_id):
+        """获取单个广告的所有跟踪参数，返回 {参数名: 值}"""
+        with self._lock:
+            rows = self._get_connection().execute(
+                'SELECT name, value FROM ad_params WHERE ad_id = ?', (ad_id,)
+            ).fetchall()
+        return dict(rows)
+    
+    def get_scrape_stats(self):
+        """获取抓取统计信息（读取触发器维护的汇总表）"""
+        with self._lock:
+            row = self._get_connection().execute('''
+                SELECT total_scrapes, successful_scrapes, total_ads, last_scrape
+                FROM stats_totals WHERE id = 1
+            ''').fetchone()
+        
+        total_scrapes, successful_scrapes, total_ads, last_scrape = row or (0, 0, 0, None)
         return {
             'total_scrapes': total_scrapes,
             'successful_scrapes': successful_scrapes,
             'total_ads': total_ads,
             'last_scrape': last_scrape
-        }
\ No newline at end of file
+        }
+    
+    def get_keyword_stats(self):
+        """
+        按关键词统计（读取汇总表）
+        
+        Returns:
+            (关键词, 广告数, 有广告的国家数, 抓取次数, 成功次数, 最近抓取时间) 元组列表，按广告数倒序
+        """
+        with self._lock:
+            return self._get_connection().execute('''
+                SELECT keyword, SUM(ads_count), SUM(ads_count > 0), SUM(scrape_count),
+                       SUM(success_count), MAX(last_scrape)
+                FROM keyword_country_stats
+                GROUP BY keyword
+                ORDER BY SUM(ads_count) DESC, keyword
+            ''').fetchall()
+    
+    def get_country_stats(self):
+        """
+        按国家统计（读取汇总表）
+        
+        Returns:
+            (国家代码, 广告数, 有广告的关键词数, 抓取次数, 成功次数, 最近抓取时间) 元组列表，按广告数倒序
+        """
+        with self._lock:
+            return self._get_connection().execute('''
+                SELECT country_code, SUM(ads_count), SUM(ads_count > 0), SUM(scrape_count),
+                       SUM(success_count), MAX(last_scrape)
+                FROM keyword_country_stats
+                GROUP BY country_code
+                ORDER BY SUM(ads_count) DESC, country_code
+            ''').fetchall()
+    
+    def get_hourly_stats(self, hours=24, now=None):
+        """
+        最近若干小时内（从 now 前 hours 小时所在的小时起）有抓取记录的小时的统计，
+        不足 hours 行时不会用更早的数据补齐
+        
+        Args:
+            hours: 时间范围（小时）
+            now: 统计截止时间，默认当前时间（与抓取时间一样为本地时间）
+        
+        Returns:
+            (小时 YYYY-MM-DD HH, 抓取次数, 成功次数, 广告数) 元组列表，按时间倒序
+        """
+        since = ((now or datetime.now()) - timedelta(hours=hours)).strftime('%Y-%m-%d %H')
+        with self._lock:
+            return self._get_connection().execute('''
+                SELECT hour, scrape_count, success_count, ads_count
+                FROM hourly_stats
+                WHERE hour >= ?
+                ORDER BY hour DESC
+            ''', (since,)).fetchall()
+    
+    def update_visibility_rollups(self, observations):
+        """
+        将一批抓取中广告的出现情况累加到可见度汇总表（每批抓取结束时调用一次，在一个事务中写入）
+        
+        Args:
+            observations: (关键词, 国家代码, 抓取时间, [(ref, 位置), ...]) 元组列表，每个成功抓取的SERP一项，
+                包括变化检测跳过插入的未变化广告
+        
+        Returns:
+            更新的时间桶数（各粒度合计）
+        """
+        buckets = {}
+        refs = {}
+        for keyword, country_code, scrape_time, ads in observations:
+            for granularity in VISIBILITY_GRANULARITIES:
+                key = (granularity, visibility_bucket(scrape_time, granularity), keyword, country_code)
+                totals = buckets.setdefault(key, [0, 0, 0])
+                totals[0] += 1
+                for ref, position in ads:
+                    position = position or 0
+                    totals[1] += 1
+                    totals[2] += position
+                    if ref:
+                        ref_totals = refs.setdefault(key + (ref,), [0, 0])
+                        ref_totals[0] += 1
+                        ref_totals[1] += position
+        
+        if not buckets:
+            return 0
+        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO visibility_buckets
+                    (granularity, bucket, keyword, country_code, serp_count, appearances, position_sum)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(granularity, bucket, keyword, country_code) DO UPDATE SET
+                        serp_count = serp_count + excluded.serp_count,
+                        appearances = appearances + excluded.appearances,
+                        position_sum = position_sum + excluded.position_sum
+                ''', [key + tuple(totals) for key, totals in buckets.items()])
+                conn.executemany('''
+                    INSERT INTO visibility_refs
+                    (granularity, bucket, keyword, country_code, ref_parameter, appearances, position_sum)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(granularity, bucket, keyword, country_code, ref_parameter) DO UPDATE SET
+                        appearances = appearances + excluded.appearances,
+                        position_sum = position_sum + excluded.position_sum
+                ''', [key + tuple(totals) for key, totals in refs.items()])
+                # 只重新计算本批涉及的时间桶的不同ref数
+                conn.executemany('''
+                    UPDATE visibility_buckets SET ref_count = (
+                        SELECT COUNT(*) FROM visibility_refs r
+                        WHERE r.granularity = ?1 AND r.bucket = ?2 AND r.keyword = ?3 AND r.country_code = ?4
+                    )
+                    WHERE granularity = ?1 AND bucket = ?2 AND keyword = ?3 AND country_code = ?4
+                ''', list(buckets))
+        return len(buckets)
+    
+    def _visibility_conditions(self, alias, granularity, keyword=None, country_code=None,
+                               start_time=None, end_time=None):
+        """构建可见度汇总表查询的过滤条件，时间范围换算为所在的时间桶"""
+        if granularity not in VISIBILITY_GRANULARITIES:
+            raise ValueError(f"不支持的时间粒度: {granularity}")
+        
+        conditions = [f'{alias}.granularity = ?']
+        params = [granularity]
+        if keyword is not None:
+            conditions.append(f'{alias}.keyword = ?')
+            params.append(keyword)
+        if country_code is not None:
+            conditions.append(f'{alias}.country_code = ?')
+            params.append(country_code)
+        if start_time is not None:
+            conditions.append(f'{alias}.bucket >= ?')
+            params.append(visibility_bucket(start_time, granularity))
+        if end_time is not None:
+            conditions.append(f'{alias}.bucket <= ?')
+            params.append(visibility_bucket(end_time, granularity))
+        return conditions, params
+    
+    def get_visibility_series(self, granularity='hour', keyword=None, country_code=None,
+                              start_time=None, end_time=None):
+        """
+        按时间桶获取广告可见度序列（读取可见度汇总表，不扫描广告数据）
+        
+        Args:
+            granularity: 时间粒度 'hour'、'day' 或 'week'
+            keyword, country_code: 只统计指定的关键词/国家（可选）
+            start_time, end_time: 抓取时间范围（可选，按所在时间桶过滤）
+        
+        Returns:
+            (时间桶, SERP数, 广告出现次数, 平均位置, 不同ref数) 元组列表，按时间升序；没有广告时平均位置为None
+        """
+        conditions, params = self._visibility_conditions(
+            'b', granularity, keyword, country_code, start_time, end_time
+        )
+        
+        if keyword is not None and country_code is not None:
+            ref_count_sql = 'SUM(b.ref_count)'
+            ref_params = []
+        else:
+            # 跨关键词/国家汇总时同一个ref只计一次
+            ref_conditions, ref_params = self._visibility_conditions('r', granularity, keyword, country_code)
+            ref_count_sql = f'''(
+                SELECT COUNT(DISTINCT r.ref_parameter) FROM visibility_refs r
+                WHERE {' AND '.join(ref_conditions)} AND r.bucket = b.bucket
+            )'''
+        
+        with self._lock:
+            return self._get_connection().execute(f'''
+                SELECT b.bucket, SUM(b.serp_count), SUM(b.appearances),
+                       SUM(b.position_sum) * 1.0 / NULLIF(SUM(b.appearances), 0),
+                       {ref_count_sql}
+                FROM visibility_buckets b
+                WHERE {' AND '.join(conditions)}
+                GROUP BY b.bucket
+                ORDER BY b.bucket
+            ''', ref_params + params).fetchall()
+    
+    def get_ref_visibility_series(self, ref, granularity='hour', keyword=None, country_code=None,
+                                  start_time=None, end_time=None):
+        """
+        按时间桶获取单个ref的可见度序列（读取可见度汇总表，不扫描广告数据）
+        
+        ref 未出现的时间桶也会返回（出现次数为0），便于计算出现率 = 出现次数 / SERP数
+        
+        Returns:
+            (时间桶, SERP数, 出现次数, 平均位置) 元组列表，按时间升序；未出现时平均位置为None
+        """
+        conditions, params = self._visibility_conditions(
+            'b', granularity, keyword, country_code, start_time, end_time
+        )
+        
+        with self._lock:
+            return self._get_connection().execute(f'''
+                SELECT b.bucket, SUM(b.serp_count), COALESCE(SUM(r.appearances), 0),
+                       SUM(r.position_sum) * 1.0 / NULLIF(SUM(r.appearances), 0)
+                FROM visibility_buckets b
+                LEFT JOIN visibility_refs r
+                  ON r.granularity = b.granularity AND r.bucket = b.bucket
+                 AND r.keyword = b.keyword AND r.country_code = b.country_code
+                 AND r.ref_parameter = ?
+                WHERE {' AND '.join(conditions)}
+                GROUP BY b.bucket
+                ORDER BY b.bucket
+            ''', [ref] + params).fetchall()
+    
+    def prune_raw_ads(self, cutoff, archive_path=None, batch_size=1000, dry_run=False):
+        """
+        删除（或先归档再删除）抓取时间早于 cutoff 的原始广告记录及其跟踪参数
+        
+        统计汇总表由删除触发器同步更新；可见度汇总表和ref登记表保留完整历史，不受影响。
+        最近出现时间早于 cutoff 的广告指纹和SERP指纹一并删除；仍在出现的广告指纹所引用的记录会保留，
+        变化检测需要通过它找到未变化广告的ref
+        
+        Args:
+            cutoff: 保留此时间及之后抓取的数据
+            archive_path: 归档数据库路径，指定时先将要删除的广告和参数复制到归档库
+            batch_size: 每个事务处理的广告数
+            dry_run: 只统计要清理的行数，不修改数据库
+        
+        Returns:
+            {'ads': 广告数, 'params': 参数行数, 'fingerprints': 指纹数}
+        """
+        stats = {'ads': 0, 'params': 0, 'fingerprints': 0}
+        
+        with self._lock:
+            conn = self._get_connection()
+            
+            if dry_run:
+                stats['ads'] = conn.execute(
+                    f'SELECT COUNT(*) FROM ads_data WHERE {self._PRUNE_CONDITION}', (cutoff,)
+                ).fetchone()[0]
+                stats['params'] = conn.execute(f'''
+                    SELECT COUNT(*) FROM ad_params
+                    WHERE ad_id IN (SELECT id FROM ads_data WHERE {self._PRUNE_CONDITION})
+                ''', (cutoff,)).fetchone()[0]
+                stats['fingerprints'] = conn.execute(
+                    'SELECT COUNT(*) FROM ad_fingerprints WHERE last_seen < ?', (cutoff,)
+                ).fetchone()[0]
+                return stats
+            
+            if archive_path:
+                self._attach_archive(conn, archive_path)
+            
+            try:
+                with conn:
+                    stats['fingerprints'] = conn.execute(
+                        'DELETE FROM ad_fingerprints WHERE last_seen < ?', (cutoff,)
+                    ).rowcount
+                    conn.execute('DELETE FROM serp_fingerprints WHERE last_seen < ?', (cutoff,))
+                
+                last_id = 0
+                while True:
+                    ids = [row[0] for row in conn.execute(f'''
+                        SELECT id FROM ads_data
+                        WHERE {self._PRUNE_CONDITION} AND id > ?2
+                        ORDER BY id
+                        LIMIT ?3
+                    ''', (cutoff, last_id, batch_size))]
+                    if not ids:
+                        break
+                    last_id = ids[-1]
+                    
+                    placeholders = ','.join('?' * len(ids))
+                    with conn:
+                        if archive_path:
+                            columns = ', '.join(self._table_columns(conn, 'main', 'ads_data'))
+                            conn.execute(f'''
+                                INSERT OR IGNORE INTO archive.ads_data ({columns})
+                                SELECT {columns} FROM main.ads_data WHERE id IN ({placeholders})
+                            ''', ids)
+                            conn.execute(f'''
+                                INSERT OR IGNORE INTO archive.ad_params (ad_id, name, value)
+                                SELECT ad_id, name, value FROM main.ad_params WHERE ad_id IN ({placeholders})
+                            ''', ids)
+                        stats['params'] += conn.execute(
+                            f'DELETE FROM main.ad_params WHERE ad_id IN ({placeholders})', ids
+                        ).rowcount
+                        stats['ads'] += conn.execute(
+                            f'DELETE FROM main.ads_data WHERE id IN ({placeholders})', ids
+                        ).rowcount
+            finally:
+                if archive_path:
+                    conn.execute('DETACH DATABASE archive')
+        
+        return stats
+    
+    def _table_columns(self, conn, schema, table):
+        """返回表的列名列表"""
+        return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+    
+    def _attach_archive(self, conn, archive_path):
+        """挂载归档数据库，按主库的表结构创建（或补齐）ads_data 和 ad_params"""
+        conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        
+        for table in ('ads_data', 'ad_params'):
+            table_sql = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()[0]
+            conn.execute(table_sql.replace(
+                f'CREATE TABLE {table}', f'CREATE TABLE IF NOT EXISTS archive.{table}', 1
+            ))
+            
+            # 归档库由旧版本创建时补齐后来新增的字段
+            archive_columns = set(self._table_columns(conn, 'archive', table))
+            for column in conn.execute(f'PRAGMA main.table_info({table})').fetchall():
+                if column[1] not in archive_columns:
+                    conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column[1]} {column[2]}')
+        conn.commit()
+    
+    def enqueue_email(self, subject, html_content, recipients, send_after=None):
+        """
+        将邮件加入发件队列（不连接SMTP服务器，立即返回）
+        
+        Args:
+            subject: 邮件主题
+            html_content: 邮件HTML内容
+            recipients: 收件人列表（重复的收件人只发送一次）
+            send_after: 最早发送时间，默认立即发送
+        
+        Returns:
+            队列中的邮件id
+        """
+        now = datetime.now()
+        send_after = send_after or now
+        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                message_id = conn.execute('''
+                    INSERT INTO email_outbox (subject, html_content, created_at)
+                    VALUES (?, ?, ?)
+                ''', (subject, html_content, now)).lastrowid
+                conn.executemany('''
+                    INSERT OR IGNORE INTO email_outbox_recipients (message_id, recipient, next_attempt_at)
+                    VALUES (?, ?, ?)
+                ''', [(message_id, recipient, send_after) for recipient in recipients])
+            return message_id
+    
+    def claim_outbox_emails(self, limit, now, lease_until):
+        """
+        取出到期的待发送收件人，发送次数加一，并在 lease_until 之前不再被其他发送进程取出
+        
+        Returns:
+            (队列行id, 邮件id, 收件人, 已尝试次数, 取出令牌) 元组列表，
+            记录结果时需要传回取出令牌（见 finish_outbox_emails()）
+        """
+        token = uuid.uuid4().hex
+        
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                conn.execute('''
+                    UPDATE email_outbox_recipients
+                    SET claim_token = ?, attempts = attempts + 1, next_attempt_at = ?
+                    WHERE id IN (
+                        SELECT id FROM email_outbox_recipients
+                        WHERE status = 'pending' AND next_attempt_at <= ?
+                        ORDER BY next_attempt_at, id
+                        LIMIT ?
+                    )
+                ''', (token, lease_until, now, limit))
+            return conn.execute('''
+                SELECT id, message_id, recipient, attempts, claim_token FROM email_outbox_recipients
+                WHERE claim_token = ?
+                ORDER BY message_id, id
+            ''', (token,)).fetchall()
+    
+    def get_outbox_message(self, message_id):
+        """获取队列中邮件的 (主题, HTML内容)"""
+        with self._lock:
+            return self._get_connection().execute(
+                'SELECT subject, html_content FROM email_outbox WHERE id = ?', (message_id,)
+            ).fetchone()
+    
+    def finish_outbox_emails(self, results):
+        """
+        记录发送结果
+        
+        只更新仍由同一次取出持有的行：租约到期后该行可能已被其他发送进程重新取出（取出令牌已变化），
+        此时不覆盖新的发送状态
+        
+        Args:
+            results: (队列行id, 取出令牌, 状态, 下次发送时间, 错误信息) 元组列表，
+                     状态为 'sent'、'failed' 或 'pending'（等待下次重试）
+        
+        Returns:
+            取出令牌已失效、结果未记录的队列行id列表
+        """
+        if not results:
+            return []
+        
+        now = datetime.now()
+        stale = []
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                for outbox_id, claim_token, status, next_attempt_at, error in results:
+                    updated = conn.execute('''
+                        UPDATE email_outbox_recipients
+                        SET status = ?2, next_attempt_at = COALESCE(?3, next_attempt_at), last_error = ?4,
+                            sent_at = CASE WHEN ?2 = 'sent' THEN ?5 END, claim_token = NULL
+                        WHERE id = ?1 AND claim_token = ?6
+                    ''', (outbox_id, status, next_attempt_at, error, now, claim_token)).rowcount
+                    if not updated:
+                        stale.append(outbox_id)
+        return stale
+    
+    def get_outbox_counts(self):
+        """按状态统计发件队列中的收件人数，返回 {状态: 数量}"""
+        with self._lock:
+            rows = self._get_connection().execute('''
+                SELECT status, COUNT(*) FROM email_outbox_recipients GROUP BY status
+            ''').fetchall()
+        return dict(rows)
+    
+    def purge_outbox(self, before):
+        """
+        删除 before 之前加入队列、且所有收件人都已发送完成（成功或最终失败）的邮件
+        
+        Returns:
+            删除的邮件数
+        """
+        done = '''
+            SELECT id FROM email_outbox
+            WHERE created_at < ?1
+              AND NOT EXISTS (
+                  SELECT 1 FROM email_outbox_recipients r
+                  WHERE r.message_id = email_outbox.id AND r.status = 'pending'
+              )
+        '''
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                conn.execute(f'DELETE FROM email_outbox_recipients WHERE message_id IN ({done})', (before,))
+                return conn.execute(f'DELETE FROM email_outbox WHERE id IN ({done})', (before,)).rowcount
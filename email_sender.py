@@ -4,15 +4,14 @@
 从数据库中提取最近8天的广告信息，按ref去重后发送邮件报告
 """
 
-import smtplib
-import sqlite3
-import os
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.utils import formataddr
-from config import EMAIL_CONFIG, DATABASE_NAME
+from config import EMAIL_CONFIG
 from database import AdDatabase
+from mail_delivery import MailDelivery, PreparedMessage
+from report_renderer import country_name, render_daily_report, render_recent_report
+
+# 报告邮件的发件人名称
+SENDER_NAME = 'Google广告监控系统'
 
 
 class EmailSender:
@@ -26,25 +25,18 @@ class EmailSender:
         """获取最近N天的广告数据，按ref去重"""
         return self.get_ads_data_by_date_range(days=days)
     
-    def get_ads_data_by_date_range(self, days=8, start_date=None, end_date=None):
+    def get_ads_data_by_date_range(self, days=8, start_date=None, end_date=None, new_only=False):
         """
         根据日期范围获取广告数据，按ref去重
         
+        数据来自ref登记表（refs），不再对 ads_data 做 GROUP BY 聚合
+        
         Args:
             days: 最近N天的数据（当start_date和end_date都为None时使用）
             start_date: 开始日期（datetime对象）
             end_date: 结束日期（datetime对象）
+            new_only: 为True时只返回在该范围内首次出现的ref
         """
-        # 使用绝对路径确保cron运行时也能找到正确的数据库
-        if os.path.isabs(DATABASE_NAME):
-            db_path = DATABASE_NAME
-        else:
-            project_root = os.path.dirname(os.path.abspath(__file__))
-            db_path = os.path.join(project_root, DATABASE_NAME)
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
         # 确定查询的时间范围
         if start_date and end_date:
             # 使用指定的日期范围
@@ -59,358 +51,37 @@ class EmailSender:
             query_start = datetime.now() - timedelta(days=days)
             query_end = datetime.now()
         
-        # 查询指定时间范围的数据，按ref分组，取每个ref的最早记录
-        cursor.execute('''
-            SELECT 
-                ref_parameter,
-                keyword,
-                MIN(scrape_time) as first_discovered,
-                real_target_url,
-                ad_title,
-                country_code,
-                ch_parameter,
-                utm_campaign_parameter
-            FROM ads_data 
-            WHERE scrape_time >= ? AND scrape_time <= ?
-            AND ref_parameter IS NOT NULL 
-            AND ref_parameter != ''
-            GROUP BY ref_parameter
-            ORDER BY first_discovered DESC
-        ''', (query_start, query_end))
-        
-        results = cursor.fetchall()
-        conn.close()
+        if new_only:
+            results = self.db.get_new_refs(query_start, query_end)
+        else:
+            results = self.db.get_active_refs(query_start, query_end)
         
-        return results
+        # 邮件模板使用前8列: ref, 关键词, 首次发现时间, 真实链接, 标题, 国家, ch, utm_campaign
+        return [row[:8] for row in results]
     
     def get_today_ads_data(self):
         """获取过去24小时内新发现的广告数据"""
         now = datetime.now()
         twenty_four_hours_ago = now - timedelta(hours=24)
         
-        return self.get_ads_data_by_date_range(start_date=twenty_four_hours_ago, end_date=now)
+        return self.get_ads_data_by_date_range(
+            start_date=twenty_four_hours_ago, end_date=now, new_only=True
+        )
     
     def format_email_content(self, ads_data):
-        """格式化邮件内容"""
-        if not ads_data:
-            return self._create_empty_report()
-        
-        # 统计信息
-        total_refs = len(ads_data)
-        date_range = f"{datetime.now().strftime('%Y-%m-%d')} (最近8天)"
-        
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; }}
-        .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
-        .summary {{ background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin-bottom: 20px; }}
-        .section {{ margin-bottom: 30px; }}
-        .section h2 {{ color: #1976d2; border-bottom: 2px solid #1976d2; padding-bottom: 10px; }}
-        .ref-list {{ background-color: #f5f5f5; padding: 15px; border-radius: 5px; }}
-        .ref-item {{ display: inline-block; margin: 5px; padding: 8px 12px; background-color: #2196f3; color: white; border-radius: 3px; font-size: 12px; }}
-        table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
-        th {{ background-color: #f2f2f2; font-weight: bold; }}
-        tr:hover {{ background-color: #f5f5f5; }}
-        .url-link {{ max-width: 300px; word-break: break-all; }}
-        .timestamp {{ color: #666; font-size: 12px; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>🎯 Google广告监控报告</h1>
-        <p>报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p>数据范围: {date_range}</p>
-    </div>
-    
-    <div class="summary">
-        <h3>📊 统计摘要</h3>
-        <p><strong>发现的唯一Ref参数数量:</strong> {total_refs} 个</p>
-        <p><strong>监控关键词:</strong> bingx, bingx exchange</p>
-        <p><strong>监控国家:</strong> 印度, 德国, 中国台湾, 俄罗斯, 西班牙</p>
-    </div>
-
-    <div class="section">
-        <h2>📋 第一部分：去重后的Ref参数列表</h2>
-        <div class="ref-list">
-"""
-        
-        # 第一部分：只展示去重后的ref
-        for row in ads_data:
-            ref_param = row[0]
-            html_content += f'            <span class="ref-item">{ref_param}</span>\n'
-        
-        html_content += """        </div>
-    </div>
-
-    <div class="section">
-        <h2>📝 第二部分：详细信息</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Ref参数</th>
-                    <th>搜索关键词</th>
-                    <th>首次发现时间</th>
-                    <th>真实链接</th>
-                    <th>广告标题</th>
-                    <th>国家</th>
-                </tr>
-            </thead>
-            <tbody>
-"""
-        
-        # 第二部分：详细信息表格
-        for row in ads_data:
-            ref_param, keyword, first_discovered, real_url, title, country, ch_param, utm_campaign = row
-            
-            # 格式化时间
-            try:
-                discovered_time = datetime.fromisoformat(first_discovered.replace('Z', '+00:00'))
-                formatted_time = discovered_time.strftime('%Y-%m-%d %H:%M')
-            except:
-                formatted_time = first_discovered
-            
-            # 处理可能的空值
-            real_url = real_url or '无'
-            title = title or '无标题'
-            country_name = self._get_country_name(country)
-            
-            html_content += f"""                <tr>
-                    <td><code>{ref_param}</code></td>
-                    <td><strong>{keyword}</strong></td>
-                    <td class="timestamp">{formatted_time}</td>
-                    <td class="url-link">
-                        <a href="{real_url}" target="_blank" title="{real_url}">链接</a>
-                    </td>
-                    <td>{title}</td>
-                    <td>{country_name}</td>
-                </tr>
-"""
-        
-        html_content += """            </tbody>
-        </table>
-    </div>
-
-    <div style="margin-top: 30px; padding: 20px; background-color: #f8f9fa; border-radius: 5px; color: #666; font-size: 12px;">
-        <p>💡 说明：</p>
-        <ul>
-            <li>本报告包含最近8天内发现的所有唯一Ref参数</li>
-            <li>每个Ref参数只显示首次发现的记录</li>
-            <li>点击真实链接可直接访问目标网站</li>
-            <li>此邮件由Google广告监控系统自动生成</li>
-        </ul>
-    </div>
-
-</body>
-</html>
-"""
-        
-        return html_content
+        """格式化邮件内容（最近8天报告，ads_data 可以是列表或数据库游标）"""
+        return render_recent_report(ads_data)
     
     def format_daily_email_content(self, ads_data, report_date):
         """格式化每日邮件内容 - 专门用于过去24小时新发现的ref参数"""
-        if not ads_data:
-            return self._create_empty_daily_report(report_date)
-        
-        # 统计信息
-        total_refs = len(ads_data)
-        current_time = datetime.now()
-        twenty_four_hours_ago = current_time - timedelta(hours=24)
-        
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; }}
-        .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
-        .summary {{ background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin-bottom: 20px; }}
-        .section {{ margin-bottom: 30px; }}
-        .section h2 {{ color: #28a745; border-bottom: 2px solid #28a745; padding-bottom: 10px; }}
-        .ref-list {{ background-color: #f5f5f5; padding: 15px; border-radius: 5px; }}
-        .ref-item {{ display: inline-block; margin: 5px; padding: 8px 12px; background-color: #28a745; color: white; border-radius: 3px; font-size: 12px; }}
-        table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
-        th {{ background-color: #f2f2f2; font-weight: bold; }}
-        tr:hover {{ background-color: #f5f5f5; }}
-        .url-link {{ max-width: 300px; word-break: break-all; }}
-        .timestamp {{ color: #666; font-size: 12px; }}
-        .daily-badge {{ background-color: #28a745; color: white; padding: 4px 8px; border-radius: 12px; font-size: 12px; font-weight: bold; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>📅 每日Google广告监控报告</h1>
-        <p>报告日期: <strong>{report_date}</strong></p>
-        <p>报告生成时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p><span class="daily-badge">过去24小时新发现</span></p>
-    </div>
-    
-    <div class="summary">
-        <h3>📊 24小时统计摘要</h3>
-        <p><strong>过去24小时新发现的唯一Ref参数数量:</strong> {total_refs} 个</p>
-        <p><strong>监控关键词:</strong> bingx, bingx exchange</p>
-        <p><strong>监控国家:</strong> 印度, 德国, 中国台湾, 俄罗斯, 西班牙</p>
-        <p><strong>数据时间范围:</strong> {twenty_four_hours_ago.strftime('%Y-%m-%d %H:%M')} ~ {current_time.strftime('%Y-%m-%d %H:%M')}</p>
-    </div>
-
-    <div class="section">
-        <h2>📋 第一部分：过去24小时新发现的Ref参数列表</h2>
-        <div class="ref-list">
-"""
-        
-        # 第一部分：只展示当日新发现的ref
-        for row in ads_data:
-            ref_param = row[0]
-            html_content += f'            <span class="ref-item">{ref_param}</span>\n'
-        
-        html_content += """        </div>
-    </div>
-
-    <div class="section">
-        <h2>📝 第二部分：详细信息</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Ref参数</th>
-                    <th>搜索关键词</th>
-                    <th>首次发现时间</th>
-                    <th>真实链接</th>
-                    <th>广告标题</th>
-                    <th>国家</th>
-                </tr>
-            </thead>
-            <tbody>
-"""
-        
-        # 第二部分：详细信息表格
-        for row in ads_data:
-            ref_param, keyword, first_discovered, real_url, title, country, ch_param, utm_campaign = row
-            
-            # 格式化时间
-            try:
-                discovered_time = datetime.fromisoformat(first_discovered.replace('Z', '+00:00'))
-                formatted_time = discovered_time.strftime('%Y-%m-%d %H:%M')
-            except:
-                formatted_time = first_discovered
-            
-            # 处理可能的空值
-            real_url = real_url or '无'
-            title = title or '无标题'
-            country_name = self._get_country_name(country)
-            
-            html_content += f"""                <tr>
-                    <td><code>{ref_param}</code></td>
-                    <td><strong>{keyword}</strong></td>
-                    <td class="timestamp">{formatted_time}</td>
-                    <td class="url-link">
-                        <a href="{real_url}" target="_blank" title="{real_url}">链接</a>
-                    </td>
-                    <td>{title}</td>
-                    <td>{country_name}</td>
-                </tr>
-"""
-        
-        html_content += """            </tbody>
-        </table>
-    </div>
-
-    <div style="margin-top: 30px; padding: 20px; background-color: #e8f5e8; border-radius: 5px; color: #666; font-size: 12px;">
-        <p>💡 每日报告说明：</p>
-        <ul>
-            <li>本报告只包含过去24小时内新发现的唯一Ref参数，无任何遗漏</li>
-            <li>数据时间范围：过去24小时滚动窗口</li>
-            <li>每个Ref参数显示首次发现的记录信息</li>
-            <li>点击"链接"可直接访问目标网站</li>
-            <li>此邮件由Google广告监控系统每日18:00自动生成</li>
-        </ul>
-    </div>
-
-</body>
-</html>
-"""
-        
-        return html_content
-    
-    def _create_empty_daily_report(self, report_date):
-        """创建空的每日报告"""
-        current_time = datetime.now()
-        twenty_four_hours_ago = current_time - timedelta(hours=24)
-        
-        return f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; }}
-        .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; }}
-        .empty {{ text-align: center; padding: 40px; color: #666; }}
-        .daily-badge {{ background-color: #6c757d; color: white; padding: 4px 8px; border-radius: 12px; font-size: 12px; font-weight: bold; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>📅 每日Google广告监控报告</h1>
-        <p>报告日期: <strong>{report_date}</strong></p>
-        <p>报告生成时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p><span class="daily-badge">过去24小时新发现</span></p>
-    </div>
-    
-    <div class="empty">
-        <h2>📭 过去24小时无新发现</h2>
-        <p>过去24小时内({twenty_four_hours_ago.strftime('%Y-%m-%d %H:%M')} ~ {current_time.strftime('%Y-%m-%d %H:%M')})未发现包含Ref参数的新广告数据</p>
-        <p>监控系统正常运行中，将继续监控...</p>
-    </div>
-</body>
-</html>
-"""
-    
-    def _create_empty_report(self):
-        """创建空报告"""
-        return f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; }}
-        .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; }}
-        .empty {{ text-align: center; padding: 40px; color: #666; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>🎯 Google广告监控报告</h1>
-        <p>报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-    </div>
-    
-    <div class="empty">
-        <h2>📭 暂无数据</h2>
-        <p>最近8天内未发现包含Ref参数的广告数据</p>
-    </div>
-</body>
-</html>
-"""
+        return render_daily_report(ads_data, report_date)
     
     def _get_country_name(self, code):
         """获取国家中文名称"""
-        country_map = {
-            'in': '印度',
-            'de': '德国', 
-            'tw': '中国台湾',
-            'ru': '俄罗斯',
-            'es': '西班牙'
-        }
-        return country_map.get(code, code)
+        return country_name(code)
     
     def send_email(self, subject=None, recipients=None):
-        """发送邮件"""
+        """发送邮件（最近8天的报告，周报和测试邮件也使用此报告）"""
         try:
             print("📊 正在获取广告数据...")
             # 获取数据
@@ -429,90 +100,10 @@ class EmailSender:
             if not recipients:
                 recipients = self.email_config.get('daily_recipients', self.email_config['recipients'])
             
-            print(f"📧 正在准备发送邮件...")
-            print(f"   SMTP服务器: {self.email_config['smtp_server']}:{self.email_config['smtp_port']}")
-            print(f"   发件人: {self.email_config['sender']}")
-            print(f"   收件人: {', '.join(recipients)}")
-            
-            # 创建邮件
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = formataddr(('Google广告监控系统', self.email_config['sender']))
-            msg['To'] = ', '.join(recipients)
-            
-            # 添加HTML内容
-            html_part = MIMEText(html_content, 'html', 'utf-8')
-            msg.attach(html_part)
-            
-            print("📤 正在发送邮件...")
-            success_count = 0
-            failed_recipients = []
-            
-            # 为每个收件人建立单独的SMTP连接（避免QQ邮箱多收件人问题）
-            for i, recipient in enumerate(recipients, 1):
-                print(f"   发送给 {recipient} ({i}/{len(recipients)})")
-                server = None
-                try:
-                    # 为每个收件人创建新的连接
-                    server = smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port'])
-                    server.set_debuglevel(0)
-                    server.starttls()
-                    server.login(self.email_config['username'], self.email_config['password'])
-                    
-                    # 为单个收件人创建邮件副本
-                    single_msg = MIMEMultipart('alternative')
-                    single_msg['Subject'] = subject
-                    single_msg['From'] = formataddr(('Google广告监控系统', self.email_config['sender']))
-                    single_msg['To'] = recipient  # 单个收件人
-                    single_msg.attach(html_part)
-                    
-                    # 发送邮件
-                    result = server.send_message(single_msg, to_addrs=[recipient])
-                    
-                    # 检查发送结果
-                    if isinstance(result, dict) and len(result) == 0:
-                        success_count += 1
-                        print(f"     ✅ 发送成功")
-                    else:
-                        failed_recipients.append(recipient)
-                        print(f"     ⚠️ 发送可能失败，结果: {result}")
-                        
-                except smtplib.SMTPRecipientsRefused as e:
-                    failed_recipients.append(recipient)
-                    print(f"     ❌ 收件人被拒绝: {str(e)}")
-                except smtplib.SMTPDataError as e:
-                    failed_recipients.append(recipient)
-                    print(f"     ❌ 数据错误: {str(e)}")
-                except Exception as e:
-                    failed_recipients.append(recipient)
-                    print(f"     ❌ 发送失败: {str(e)}")
-                finally:
-                    # 关闭当前连接
-                    if server:
-                        try:
-                            server.quit()
-                        except smtplib.SMTPResponseException as e:
-                            # 忽略QQ邮箱QUIT异常
-                            if e.smtp_code != -1:
-                                print(f"     ⚠️ QUIT异常: {str(e)}")
-                        except Exception:
-                            pass
-                        finally:
-                            try:
-                                server.close()
-                            except:
-                                pass
-                
-            if success_count > 0:
-                print(f"✅ 邮件发送完成 ({success_count}/{len(recipients)} 成功)")
-                print(f"   成功收件人数: {success_count}")
-                print(f"   Ref参数数量: {len(ads_data)}")
-                if failed_recipients:
-                    print(f"   ⚠️ 发送失败的收件人: {', '.join(failed_recipients)}")
-                return True
-            else:
-                print("❌ 所有收件人发送失败")
-                return False
+            return self._deliver_report(
+                subject, html_content, recipients,
+                summary=[f"Ref参数数量: {len(ads_data)}"]
+            )
             
         except Exception as e:
             print(f"❌ 邮件发送失败: {str(e)}")
@@ -520,6 +111,75 @@ class EmailSender:
             traceback.print_exc()
             return False
     
+    def queue_email(self, subject=None, recipients=None):
+        """
+        生成最近8天的报告并加入发件队列，不等待SMTP发送（由 python main.py --mode mailer 发送）
+        
+        Returns:
+            队列中的邮件id
+        """
+        ads_data = self.get_recent_ads_data()
+        html_content = self.format_email_content(ads_data)
+        
+        if not subject:
+            subject = f"Google广告监控报告 - 发现{len(ads_data)}个唯一Ref参数 ({datetime.now().strftime('%Y-%m-%d')})"
+        if not recipients:
+            recipients = self.email_config.get('daily_recipients', self.email_config['recipients'])
+        
+        message_id = self.db.enqueue_email(subject, html_content, recipients)
+        print(f"📮 报告邮件已加入发件队列 (id={message_id}, {len(ads_data)} 个唯一Ref参数, 收件人: {', '.join(recipients)})")
+        return message_id
+    
+    def _deliver_report(self, subject, html_content, recipients, summary=(), label='邮件'):
+        """
+        发送渲染好的报告（8天报告、日报和周报共用）
+        
+        邮件正文和MIME结构只序列化一次，每个收件人只拼接各自的信头（避免QQ邮箱多收件人问题），
+        再复用少量已登录的SMTP会话并行投递，每个收件人单独重试
+        
+        Args:
+            subject: 邮件主题
+            html_content: 报告HTML
+            recipients: 收件人列表
+            summary: 发送成功后输出的附加说明
+            label: 输出信息中的邮件名称，如 '每日邮件'
+        
+        Returns:
+            是否至少有一个收件人发送成功
+        """
+        print(f"📧 正在准备发送{label}...")
+        print(f"   SMTP服务器: {self.email_config['smtp_server']}:{self.email_config['smtp_port']}")
+        print(f"   发件人: {self.email_config['sender']}")
+        print(f"   收件人: {', '.join(recipients)}")
+        
+        message = PreparedMessage(
+            subject, html_content, self.email_config['sender'], sender_name=SENDER_NAME
+        )
+        
+        def progress(recipient, error):
+            if error is None:
+                print(f"   ✅ {recipient} 发送成功")
+            else:
+                print(f"   ❌ {recipient} {error}")
+        
+        print(f"📤 正在发送{label} ({message.size / 1024:.1f} KB)...")
+        with MailDelivery(self.email_config) as delivery:
+            sent, failed = delivery.send_messages(
+                [(recipient, message) for recipient in recipients], progress=progress
+            )
+            print(f"   SMTP会话: 共登录 {delivery.pool.connects} 次")
+        
+        if not sent:
+            print("❌ 所有收件人发送失败")
+            return False
+        
+        print(f"✅ {label}发送完成 ({len(sent)}/{len(recipients)} 成功)")
+        for line in summary:
+            print(f"   {line}")
+        if failed:
+            print(f"   ⚠️ 发送失败的收件人: {', '.join(failed)}")
+        return True
+    
     def send_test_email(self):
         """发送测试邮件"""
         test_recipients = self.email_config['recipients']  # 使用测试收件人列表
@@ -546,73 +206,10 @@ class EmailSender:
             print("📝 正在生成每日邮件内容...")
             html_content = self.format_daily_email_content(ads_data, current_date)
             
-            print(f"📧 正在准备发送每日邮件...")
-            print(f"   收件人: {', '.join(daily_recipients)}")
-            
-            # 创建邮件
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            from email.utils import formataddr
-            import smtplib
-            
-            success_count = 0
-            failed_recipients = []
-            
-            # 为每个收件人建立单独的SMTP连接
-            for i, recipient in enumerate(daily_recipients, 1):
-                print(f"   发送给 {recipient} ({i}/{len(daily_recipients)})")
-                server = None
-                try:
-                    # 创建邮件
-                    msg = MIMEMultipart('alternative')
-                    msg['Subject'] = subject
-                    msg['From'] = formataddr(('Google广告监控系统', self.email_config['sender']))
-                    msg['To'] = recipient
-                    
-                    # 添加HTML内容
-                    html_part = MIMEText(html_content, 'html', 'utf-8')
-                    msg.attach(html_part)
-                    
-                    # 创建SMTP连接
-                    server = smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port'])
-                    server.set_debuglevel(0)
-                    server.starttls()
-                    server.login(self.email_config['username'], self.email_config['password'])
-                    
-                    # 发送邮件
-                    result = server.send_message(msg, to_addrs=[recipient])
-                    
-                    if isinstance(result, dict) and len(result) == 0:
-                        success_count += 1
-                        print(f"     ✅ 发送成功")
-                    else:
-                        failed_recipients.append(recipient)
-                        print(f"     ⚠️ 发送可能失败，结果: {result}")
-                        
-                except Exception as e:
-                    failed_recipients.append(recipient)
-                    print(f"     ❌ 发送失败: {str(e)}")
-                finally:
-                    if server:
-                        try:
-                            server.quit()
-                        except:
-                            pass
-                        finally:
-                            try:
-                                server.close()
-                            except:
-                                pass
-            
-            if success_count > 0:
-                print(f"✅ 每日邮件发送完成 ({success_count}/{len(daily_recipients)} 成功)")
-                print(f"   过去24小时发现Ref参数数量: {ref_count}")
-                if failed_recipients:
-                    print(f"   ⚠️ 发送失败的收件人: {', '.join(failed_recipients)}")
-                return True
-            else:
-                print("❌ 所有收件人发送失败")
-                return False
+            return self._deliver_report(
+                subject, html_content, daily_recipients,
+                summary=[f"过去24小时发现Ref参数数量: {ref_count}"], label='每日邮件'
+            )
                 
         except Exception as e:
             print(f"❌ 每日邮件发送失败: {str(e)}")
@@ -0,0 +1,383 @@
+"""
+广告数据流式导出
+按 fetchmany 分块读取 ads_data 并逐块写出，内存占用与表大小无关。
+支持按日期范围、关键词、国家和ref过滤，输出 CSV、JSON Lines（可 gzip 压缩）或 Parquet/Arrow IPC（需安装 pyarrow）
+
+增量导出按消费方记录已导出的最大 ads_data.id（export_checkpoints 表），每次只导出新增的行，
+写为导出目录下的一个新文件
+"""
+
+import csv
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import config
+from database import AdDatabase, connect_database
+
+# 每次从数据库读取的行数（config.py 中未定义时使用默认值）
+EXPORT_CHUNK_SIZE = getattr(config, 'EXPORT_CHUNK_SIZE', 5000)
+# 增量导出文件的根目录，每个消费方一个子目录
+EXPORT_DIR = getattr(config, 'EXPORT_DIR', 'exports')
+
+# 导出的字段：(ads_data 列名, CSV表头)
+EXPORT_COLUMNS = (
+    ('keyword', '关键词'),
+    ('country_code', '国家代码'),
+    ('ad_title', '广告标题'),
+    ('ad_url', '广告URL'),
+    ('target_url', '目标URL'),
+    ('real_target_url', '真实目标URL'),
+    ('ref_parameter', 'Ref参数'),
+    ('ch_parameter', 'Ch参数'),
+    ('utm_campaign_parameter', 'UTM Campaign参数'),
+    ('ad_description', '广告描述'),
+    ('position', '位置'),
+    ('scrape_time', '抓取时间'),
+)
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet', 'arrow')
+
+# 各格式的文件扩展名
+_FORMAT_EXTENSIONS = {
+    'csv': '.csv',
+    'jsonl': '.jsonl',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+
+def _parse_date(value, name):
+    """解析 YYYY-MM-DD 格式的日期参数"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"{name} 日期格式应为 YYYY-MM-DD: {value}")
+
+
+def build_export_query(start_date=None, end_date=None, keyword=None, country_code=None, ref=None,
+                       columns=None, order_by='scrape_time DESC, keyword, country_code, position',
+                       after_id=None, max_id=None):
+    """
+    构建导出查询
+
+    Args:
+        start_date: 起始日期 YYYY-MM-DD（含）
+        end_date: 结束日期 YYYY-MM-DD（含当天）
+        keyword, country_code, ref: 按关键词、国家代码、ref参数精确过滤
+        columns: 查询的列，默认为 EXPORT_COLUMNS 中的列
+        order_by: 排序方式
+        after_id, max_id: 只导出 after_id < id <= max_id 的行（增量导出）
+
+    Returns:
+        (sql, params)
+    """
+    conditions = []
+    params = []
+
+    if after_id is not None:
+        conditions.append('id > ?')
+        params.append(after_id)
+    if max_id is not None:
+        conditions.append('id <= ?')
+        params.append(max_id)
+
+    if start_date:
+        conditions.append('scrape_time >= ?')
+        params.append(_parse_date(start_date, '起始'))
+    if end_date:
+        conditions.append('scrape_time < ?')
+        params.append(_parse_date(end_date, '结束') + timedelta(days=1))
+    # 关键词/国家条件前加一元 +，不使用 (keyword, country_code) 索引，而是沿 scrape_time 索引按顺序读取，
+    # 避免对全部匹配行整体排序（排序的临时B树会随结果集增大）
+    if keyword:
+        conditions.append('+keyword = ?')
+        params.append(keyword)
+    if country_code:
+        conditions.append('+country_code = ?')
+        params.append(country_code)
+    if ref:
+        conditions.append('ref_parameter = ?')
+        params.append(ref)
+
+    columns = columns or [column for column, _ in EXPORT_COLUMNS]
+    sql = f"SELECT {', '.join(columns)} FROM ads_data"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if order_by:
+        sql += f' ORDER BY {order_by}'
+    return sql, params
+
+
+def iter_chunks(cursor, chunk_size=None):
+    """按 fetchmany 分块迭代查询结果"""
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+class CSVChunkWriter:
+    """CSV 写出器（utf-8-sig 编码，Excel 可直接打开）"""
+
+    def __init__(self, filename, compress=False, header=True, append=False):
+        mode = 'at' if append else 'wt'
+        if compress:
+            self._file = gzip.open(filename, mode, encoding='utf-8-sig', newline='')
+        else:
+            self._file = open(filename, mode, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        if header:
+            self._writer.writerow([title for _, title in EXPORT_COLUMNS])
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLinesChunkWriter:
+    """JSON Lines 写出器，每行一个以列名为键的对象"""
+
+    def __init__(self, filename, compress=False, append=False):
+        mode = 'at' if append else 'wt'
+        if compress:
+            self._file = gzip.open(filename, mode, encoding='utf-8')
+        else:
+            self._file = open(filename, mode, encoding='utf-8')
+        self._columns = [column for column, _ in EXPORT_COLUMNS]
+
+    def write(self, rows):
+        self._file.writelines(
+            json.dumps(dict(zip(self._columns, row)), ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowChunkWriter:
+    """
+    Parquet / Arrow IPC 写出器，每个数据块写为一个 row group / record batch
+
+    pyarrow 只在使用这两种格式时才导入
+    """
+
+    def __init__(self, filename, fmt='parquet', compress=False):
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError(f"导出 {fmt} 格式需要安装 pyarrow: pip install pyarrow")
+
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            (column, pyarrow.int64() if column == 'position' else pyarrow.string())
+            for column, _ in EXPORT_COLUMNS
+        ])
+        self._sink = None
+
+        if fmt == 'parquet':
+            import pyarrow.parquet
+
+            # Parquet 自带按列压缩，--gzip 时使用 gzip 编码，否则使用默认的 snappy
+            self._writer = pyarrow.parquet.ParquetWriter(
+                filename, self._schema, compression='gzip' if compress else 'snappy'
+            )
+        else:
+            import pyarrow.ipc
+
+            # Arrow IPC 文件不支持 gzip 编码，--gzip 时整个文件经 gzip 流压缩
+            if compress:
+                self._sink = pyarrow.CompressedOutputStream(filename, 'gzip')
+            self._writer = pyarrow.ipc.new_file(self._sink or filename, self._schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        batch = self._pa.record_batch(
+            [self._pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+            schema=self._schema
+        )
+        if hasattr(self._writer, 'write_batch'):
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(self._pa.Table.from_batches([batch]))
+
+    def close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+
+def open_chunk_writer(filename, fmt='csv', compress=False, append=False):
+    """按格式创建写出器；append 只支持 CSV 和 JSON Lines（追加时不重复写CSV表头）"""
+    if fmt == 'csv':
+        return CSVChunkWriter(filename, compress=compress, header=not append, append=append)
+    if fmt == 'jsonl':
+        return JSONLinesChunkWriter(filename, compress=compress, append=append)
+    if fmt in ('parquet', 'arrow'):
+        if append:
+            raise ValueError(f"{fmt} 格式不支持追加写入")
+        return ArrowChunkWriter(filename, fmt=fmt, compress=compress)
+
+    raise ValueError(f"不支持的导出格式: {fmt}")
+
+
+def normalize_export_filename(filename, fmt='csv', compress=False):
+    """补全导出文件的扩展名（如 ads_data -> ads_data.csv.gz）"""
+    extension = _FORMAT_EXTENSIONS[fmt]
+    if compress and fmt in ('csv', 'jsonl', 'arrow'):
+        extension += '.gz'
+
+    if filename.endswith(extension):
+        return filename
+    if compress and filename.endswith(_FORMAT_EXTENSIONS[fmt]):
+        return filename + '.gz'
+    return filename + extension
+
+
+def export_ads(filename, fmt='csv', compress=False, chunk_size=None, db_path=None, **filters):
+    """
+    流式导出广告数据
+
+    Args:
+        filename: 输出文件名（自动补全扩展名）
+        fmt: 'csv'、'jsonl'、'parquet' 或 'arrow'
+        compress: 是否压缩输出（CSV/JSONL/Arrow 为 gzip 文件，Parquet 为 gzip 列编码）
+        chunk_size: 每次读取的行数，默认 EXPORT_CHUNK_SIZE
+        db_path: 数据库路径，默认使用 get_database_path()
+        **filters: start_date, end_date, keyword, country_code, ref
+
+    Returns:
+        (导出文件名, 导出行数)，没有符合条件的数据时文件名为None
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+    filename = normalize_export_filename(filename, fmt, compress)
+    sql, params = build_export_query(**filters)
+
+    conn = connect_database(db_path)
+    writer = None
+    exported = 0
+    try:
+        cursor = conn.execute(sql, params)
+        for rows in iter_chunks(cursor, chunk_size):
+            # 读到第一块数据后再创建文件，没有数据时不留下空文件
+            if writer is None:
+                writer = open_chunk_writer(filename, fmt, compress)
+            writer.write(rows)
+            exported += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.close()
+
+    return (filename if exported else None), exported
+
+
+def _connect_migrated(db_path=None):
+    """
+    连接数据库；先由 AdDatabase 执行版本迁移（export_checkpoints 表由迁移创建），
+    导出任务在从未运行过抓取的新数据库上也能使用检查点
+    """
+    AdDatabase(db_path).close()
+    return connect_database(db_path)
+
+
+def get_export_checkpoints(db_path=None):
+    """获取所有消费方的检查点：(consumer, last_id, last_exported_at, last_file, exported_rows, run_count)"""
+    conn = _connect_migrated(db_path)
+    try:
+        return conn.execute('''
+            SELECT consumer, last_id, last_exported_at, last_file, exported_rows, run_count
+            FROM export_checkpoints ORDER BY consumer
+        ''').fetchall()
+    finally:
+        conn.close()
+
+
+def export_incremental(consumer, export_dir=None, fmt='csv', compress=False, chunk_size=None,
+                       db_path=None, **filters):
+    """
+    增量导出：只导出该消费方上次导出之后新增的广告数据（按 ads_data.id）
+
+    每次运行写出一个新文件（先写 .part 临时文件，完成后改名），已有文件不会被修改；
+    文件写完后才更新检查点，中途失败时下次会重新导出这部分数据（至少一次）。
+    只跟踪新增的行，离线重新提取对已有行的更新不会再次导出
+
+    Args:
+        consumer: 消费方名称，每个消费方单独记录检查点
+        export_dir: 导出根目录，默认 EXPORT_DIR，文件写在其下的 consumer 子目录中
+        fmt: 'csv' 或 'jsonl'
+        compress: 是否 gzip 压缩
+        **filters: start_date, end_date, keyword, country_code, ref（过滤掉的行同样计入检查点）
+
+    Returns:
+        (导出文件名, 导出行数, 新的检查点id)，没有新数据时文件名为None
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"增量导出只支持 csv 和 jsonl 格式: {fmt}")
+    if not re.fullmatch(r'[\w.-]+', consumer):
+        raise ValueError(f"消费方名称只能包含字母、数字、下划线、点和短横线: {consumer}")
+
+    conn = _connect_migrated(db_path)
+    try:
+        row = conn.execute(
+            'SELECT last_id FROM export_checkpoints WHERE consumer = ?', (consumer,)
+        ).fetchone()
+        last_id = row[0] if row else 0
+
+        # 本次导出的上界在开始时确定，导出期间新插入的行留到下次
+        max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM ads_data').fetchone()[0]
+        if max_id <= last_id:
+            return None, 0, last_id
+
+        consumer_dir = os.path.join(export_dir or EXPORT_DIR, consumer)
+        os.makedirs(consumer_dir, exist_ok=True)
+        filename = normalize_export_filename(
+            os.path.join(consumer_dir, f"ads_{last_id + 1:010d}-{max_id:010d}"), fmt, compress
+        )
+        temp_filename = filename + '.part'
+
+        sql, params = build_export_query(after_id=last_id, max_id=max_id, order_by='id', **filters)
+        writer = None
+        exported = 0
+        try:
+            cursor = conn.execute(sql, params)
+            for rows in iter_chunks(cursor, chunk_size):
+                if writer is None:
+                    writer = open_chunk_writer(temp_filename, fmt, compress)
+                writer.write(rows)
+                exported += len(rows)
+        except Exception:
+            if writer is not None:
+                writer.close()
+                os.remove(temp_filename)
+            raise
+
+        if writer is not None:
+            writer.close()
+            os.replace(temp_filename, filename)
+
+        with conn:
+            conn.execute('''
+                INSERT INTO export_checkpoints
+                (consumer, last_id, last_exported_at, last_file, exported_rows, run_count)
+                VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT(consumer) DO UPDATE SET
+                    last_id = excluded.last_id,
+                    last_exported_at = excluded.last_exported_at,
+                    last_file = COALESCE(excluded.last_file, last_file),
+                    exported_rows = exported_rows + excluded.exported_rows,
+                    run_count = run_count + 1
+            ''', (consumer, max_id, datetime.now(), filename if exported else None, exported))
+
+        return (filename if exported else None), exported, max_id
+    finally:
+        conn.close()
@@ -0,0 +1,212 @@
+"""
+广告提取使用的HTML解析后端
+- bs4: BeautifulSoup + html.parser，参考实现
+- lxml: 基于 libxml2 的C解析器，速度快得多（默认）
+
+两个后端提供相同的操作接口，GoogleAdExtractor 只通过这些接口访问文档，
+切换后端不影响提取规则；两者对畸形嵌套（<a> 中嵌套 <a>、<p> 中的 <div>、表格/列表外的 <td>/<li>）
+的纠错方式不同，提取规则按广告链接限定查找范围，不依赖纠错后的容器结构。
+test_parser_parity.py 用于验证两者在存档HTML和生成的畸形嵌套页面上的结果一致
+"""
+
+import re
+
+from bs4 import BeautifulSoup, Tag
+
+import config
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# 解析后端配置（config.py 中未定义时使用默认值），未安装 lxml 时自动使用 bs4
+AD_PARSER_BACKEND = getattr(config, 'AD_PARSER_BACKEND', 'lxml')
+
+# 支持的简单CSS选择器：tag、.class、[attr="value"] 及其组合（如 div[role="heading"]）
+_SIMPLE_SELECTOR_RE = re.compile(
+    r'^(?P<tag>[a-zA-Z][a-zA-Z0-9]*)?'
+    r'(?:\.(?P<cls>[\w-]+))?'
+    r'(?:\[(?P<attr>[\w-]+)="(?P<value>[^"]*)"\])?$'
+)
+
+
+def compile_selector(selector):
+    """将简单CSS选择器解析为 (tag, class, attr, value) 元组，未指定的部分为None"""
+    match = _SIMPLE_SELECTOR_RE.match(selector.strip())
+    if not match or not any(match.groupdict().values()):
+        raise ValueError(f"不支持的CSS选择器: {selector}")
+
+    tag = match.group('tag')
+    return (tag.lower() if tag else None, match.group('cls'), match.group('attr'), match.group('value'))
+
+
+class SelectorSet:
+    """
+    预编译的一组简单CSS选择器
+
+    按标签名和class建立索引，遍历元素时只检查可能匹配的选择器，
+    用于一次遍历同时匹配多个选择器
+    """
+
+    def __init__(self, selectors):
+        self.selectors = tuple(selectors)
+        self._by_tag = {}
+        self._by_class = {}
+        self._by_attr = []
+
+        for index, selector in enumerate(self.selectors):
+            tag, cls, attr, value = compile_selector(selector)
+            entry = (index, tag, cls, attr, value)
+            # 每个选择器只放入一个索引：优先 class，其次属性，最后标签名
+            if cls:
+                self._by_class.setdefault(cls, []).append(entry)
+            elif attr:
+                self._by_attr.append(entry)
+            else:
+                self._by_tag.setdefault(tag, []).append(entry)
+
+    def __len__(self):
+        return len(self.selectors)
+
+    def match(self, tag, classes, get_attribute):
+        """
+        返回与元素匹配的选择器下标列表
+
+        Args:
+            tag: 元素标签名
+            classes: 元素的 class 列表
+            get_attribute: 读取元素属性的函数，如 element.get
+        """
+        matched = [entry[0] for entry in self._by_tag.get(tag, ())]
+
+        if classes and self._by_class:
+            for cls in classes:
+                for index, sel_tag, _, attr, value in self._by_class.get(cls, ()):
+                    if (not sel_tag or sel_tag == tag) and (not attr or get_attribute(attr) == value):
+                        matched.append(index)
+
+        for index, sel_tag, _, attr, value in self._by_attr:
+            if (not sel_tag or sel_tag == tag) and get_attribute(attr) == value:
+                matched.append(index)
+
+        return matched
+
+
+class BS4Backend:
+    """BeautifulSoup 解析后端（参考实现）"""
+
+    name = 'bs4'
+
+    def parse(self, html_content):
+        return BeautifulSoup(html_content, 'html.parser')
+
+    def find_ad_links(self, document):
+        """查找所有带有 data-rw 属性的a标签"""
+        return document.find_all('a', {'data-rw': True})
+
+    def get_attribute(self, element, name):
+        return element.get(name, '')
+
+    def iter_matches(self, element, selector_set, marks=None):
+        """
+        按文档顺序遍历与选择器组匹配的后代元素，返回 (元素, 匹配的选择器下标列表)
+
+        marks 为元素id集合时，遍历到这些元素也会返回（匹配列表可能为空），用于确定匹配元素与它们的先后顺序
+        """
+        match = selector_set.match
+        for node in element.descendants:
+            if isinstance(node, Tag):
+                matched = match(node.name, node.get('class'), node.get)
+                if matched or (marks and id(node) in marks):
+                    yield node, matched
+
+    def get_text(self, element):
+        return element.get_text()
+
+    def get_parent(self, element):
+        return element.parent
+
+    def get_tag(self, element):
+        return element.name
+
+
+class LxmlBackend:
+    """lxml 解析后端"""
+
+    name = 'lxml'
+
+    # 与 BeautifulSoup 的 get_text() 一致：不包含注释、脚本、样式和模板中的文本
+    _TEXT_XPATH = 'descendant::text()[not(parent::script) and not(parent::style) and not(parent::template)]'
+
+    def __init__(self):
+        if etree is None:
+            raise ImportError("lxml 解析后端需要安装 lxml")
+
+        self._find_ad_links = etree.XPath('//a[@data-rw]')
+        self._text = etree.XPath(self._TEXT_XPATH)
+
+    def parse(self, html_content):
+        # 使用 etree.HTML 而不是 lxml.html，省去每个元素的Python类查找；
+        # etree.HTML 使用线程各自的默认解析器，并发抓取的线程可以同时解析
+        try:
+            return etree.HTML(html_content)
+        except ValueError:
+            # 带有XML编码声明的字符串需要先转为字节再解析
+            return etree.HTML(html_content.encode('utf-8'))
+
+    def find_ad_links(self, document):
+        """查找所有带有 data-rw 属性的a标签"""
+        if document is None:
+            # 只有空白内容的页面解析结果为None
+            return []
+        return self._find_ad_links(document)
+
+    def get_attribute(self, element, name):
+        return element.get(name, '')
+
+    def iter_matches(self, element, selector_set, marks=None):
+        """
+        按文档顺序遍历与选择器组匹配的后代元素，返回 (元素, 匹配的选择器下标列表)
+
+        marks 为元素id集合时，遍历到这些元素也会返回（匹配列表可能为空），用于确定匹配元素与它们的先后顺序；
+        调用方需持有这些元素的引用，lxml 才会返回同一个代理对象
+        """
+        match = selector_set.match
+        for node in element.iterdescendants():
+            tag = node.tag
+            # 跳过注释和处理指令
+            if isinstance(tag, str):
+                classes = node.get('class')
+                matched = match(tag, classes.split() if classes else None, node.get)
+                if matched or (marks and id(node) in marks):
+                    yield node, matched
+
+    def get_text(self, element):
+        return ''.join(self._text(element))
+
+    def get_parent(self, element):
+        return element.getparent()
+
+    def get_tag(self, element):
+        return element.tag
+
+
+PARSER_BACKENDS = {
+    'bs4': BS4Backend,
+    'lxml': LxmlBackend,
+}
+
+
+def get_parser_backend(name=None):
+    """按名称创建解析后端，默认使用 AD_PARSER_BACKEND"""
+    name = name or AD_PARSER_BACKEND
+
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"不支持的HTML解析后端: {name}")
+
+    if name == 'lxml' and etree is None:
+        print("⚠️ 未安装 lxml，广告解析使用 bs4 后端")
+        name = 'bs4'
+
+    return PARSER_BACKENDS[name]()
@@ -0,0 +1,269 @@
+"""
+SERP HTML 存档
+支持两种存储后端:
+- file: 每次抓取保存为 HTML_DIR 下的一个未压缩 .html 文件（旧方式）
+- sqlite: 压缩后按内容哈希（sha256）存入独立的存档数据库，相同页面只存一份
+
+ads_data.html_file_path 中保存的是存储引用：sqlite 后端为 "sqlite:<哈希>"，
+file 后端及旧数据为文件路径，统一通过 load_html() 读取
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+import config
+from config import HTML_DIR
+from database import connect_database, get_database_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# HTML存储配置（config.py 中未定义时使用默认值）
+# 'sqlite': 压缩存档数据库；'file': 每个页面一个HTML文件
+HTML_STORAGE_BACKEND = getattr(config, 'HTML_STORAGE_BACKEND', 'sqlite')
+# 存档数据库路径，默认与广告数据库放在同一目录
+HTML_ARCHIVE_PATH = getattr(config, 'HTML_ARCHIVE_PATH', None)
+# 压缩算法：'zstd'（需安装 zstandard）或 'gzip'，未安装 zstandard 时自动使用 gzip
+HTML_ARCHIVE_CODEC = getattr(config, 'HTML_ARCHIVE_CODEC', 'zstd' if zstandard else 'gzip')
+# 压缩级别，zstd 为 1-22，gzip 为 1-9
+HTML_ARCHIVE_LEVEL = getattr(config, 'HTML_ARCHIVE_LEVEL', 6)
+
+# 存档引用前缀
+SQLITE_REF_PREFIX = 'sqlite:'
+
+
+def get_archive_path():
+    """获取HTML存档数据库的绝对路径"""
+    if HTML_ARCHIVE_PATH:
+        if os.path.isabs(HTML_ARCHIVE_PATH):
+            return HTML_ARCHIVE_PATH
+        project_root = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(project_root, HTML_ARCHIVE_PATH)
+
+    return os.path.join(os.path.dirname(get_database_path()), 'html_archive.db')
+
+
+def compress_html(data, codec=None, level=None):
+    """压缩HTML字节内容，返回 (codec, 压缩后的字节)"""
+    codec = codec or HTML_ARCHIVE_CODEC
+    level = level or HTML_ARCHIVE_LEVEL
+
+    if codec == 'zstd':
+        if zstandard is None:
+            # 未安装 zstandard 时退回 gzip，codec 随数据一起保存，读取时不受影响
+            codec = 'gzip'
+        else:
+            return codec, zstandard.ZstdCompressor(level=level).compress(data)
+
+    if codec == 'gzip':
+        return codec, gzip.compress(data, compresslevel=min(level, 9))
+
+    raise ValueError(f"不支持的HTML压缩算法: {codec}")
+
+
+def decompress_html(codec, data):
+    """按保存时的 codec 解压，返回字节内容"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("读取 zstd 压缩的HTML需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'none':
+        return data
+
+    raise ValueError(f"不支持的HTML压缩算法: {codec}")
+
+
+class FileHTMLStorage:
+    """每个页面保存为一个HTML文件（旧方式）"""
+
+    def __init__(self, html_dir=None):
+        self.html_dir = html_dir or HTML_DIR
+        os.makedirs(self.html_dir, exist_ok=True)
+
+    def save(self, html_content, keyword, country_code, scrape_time):
+        """保存HTML并返回文件路径"""
+        # 创建文件名，使用时间戳避免冲突
+        timestamp = scrape_time.strftime("%Y%m%d_%H%M%S")
+        safe_keyword = "".join(c for c in keyword if c.isalnum() or c in (' ', '-', '_')).strip()
+        safe_keyword = safe_keyword.replace(' ', '_')
+
+        filename = f"{timestamp}_{country_code}_{safe_keyword}.html"
+        file_path = os.path.join(self.html_dir, filename)
+
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        return file_path
+
+    def load(self, ref):
+        """按文件路径读取HTML"""
+        with open(ref, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class SQLiteHTMLStorage:
+    """压缩后按内容哈希存入SQLite存档数据库，内容相同的页面只保存一份"""
+
+    def __init__(self, archive_path=None, codec=None, level=None):
+        """
+        Args:
+            archive_path: 存档数据库路径，默认使用 get_archive_path()
+            codec: 压缩算法，默认使用 HTML_ARCHIVE_CODEC
+            level: 压缩级别，默认使用 HTML_ARCHIVE_LEVEL
+        """
+        self.archive_path = archive_path or get_archive_path()
+        self.codec = codec or HTML_ARCHIVE_CODEC
+        self.level = level or HTML_ARCHIVE_LEVEL
+
+        # 与 AdDatabase 相同：复用一个长连接，并发抓取的线程通过锁串行访问
+        self._conn = connect_database(self.archive_path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        self._init_table()
+
+    def _init_table(self):
+        """创建存档表"""
+        with self._lock, self._conn as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS html_pages (
+                    content_hash TEXT PRIMARY KEY,
+                    codec TEXT NOT NULL,
+                    raw_size INTEGER NOT NULL,
+                    compressed_size INTEGER NOT NULL,
+                    content BLOB NOT NULL,
+                    first_saved TIMESTAMP NOT NULL,
+                    last_saved TIMESTAMP NOT NULL,
+                    save_count INTEGER DEFAULT 1
+                )
+            ''')
+
+    def save(self, html_content, keyword=None, country_code=None, scrape_time=None):
+        """保存HTML并返回存档引用 "sqlite:<哈希>"，已存在的内容只更新保存时间和次数"""
+        data = html_content.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        saved_at = scrape_time or datetime.now()
+
+        with self._lock:
+            exists = self._conn.execute(
+                'SELECT 1 FROM html_pages WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+
+        if exists:
+            with self._lock, self._conn as conn:
+                conn.execute('''
+                    UPDATE html_pages SET last_saved = ?, save_count = save_count + 1
+                    WHERE content_hash = ?
+                ''', (saved_at, content_hash))
+            return SQLITE_REF_PREFIX + content_hash
+
+        # 压缩在锁外进行，避免阻塞其他线程写入
+        codec, compressed = compress_html(data, self.codec, self.level)
+
+        with self._lock, self._conn as conn:
+            conn.execute('''
+                INSERT INTO html_pages
+                (content_hash, codec, raw_size, compressed_size, content, first_saved, last_saved)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET
+                    last_saved = excluded.last_saved,
+                    save_count = save_count + 1
+            ''', (content_hash, codec, len(data), len(compressed), compressed, saved_at, saved_at))
+
+        return SQLITE_REF_PREFIX + content_hash
+
+    def load(self, ref):
+        """按存档引用读取HTML，不存在时返回None"""
+        content_hash = ref[len(SQLITE_REF_PREFIX):] if ref.startswith(SQLITE_REF_PREFIX) else ref
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT codec, content FROM html_pages WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        codec, content = row
+        return decompress_html(codec, content).decode('utf-8')
+
+    def list_refs(self):
+        """获取存档中所有页面的存档引用"""
+        with self._lock:
+            rows = self._conn.execute('SELECT content_hash FROM html_pages').fetchall()
+        return [SQLITE_REF_PREFIX + row[0] for row in rows]
+
+    def get_stats(self):
+        """获取存档统计：页面数、保存次数、原始大小和压缩后大小（字节）"""
+        with self._lock:
+            pages, saves, raw_size, compressed_size = self._conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(save_count), 0),
+                       COALESCE(SUM(raw_size), 0), COALESCE(SUM(compressed_size), 0)
+                FROM html_pages
+            ''').fetchone()
+
+        return {
+            'pages': pages,
+            'saves': saves,
+            'raw_size': raw_size,
+            'compressed_size': compressed_size
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+def get_html_storage(backend=None):
+    """按配置创建HTML存储后端"""
+    backend = backend or HTML_STORAGE_BACKEND
+
+    if backend == 'sqlite':
+        return SQLiteHTMLStorage()
+    if backend == 'file':
+        return FileHTMLStorage()
+
+    raise ValueError(f"不支持的HTML存储后端: {backend}")
+
+
+def is_archive_ref(ref):
+    """判断存储引用是否指向存档数据库"""
+    return bool(ref) and ref.startswith(SQLITE_REF_PREFIX)
+
+
+def load_html(ref, archive=None):
+    """
+    读取任意存储引用对应的HTML
+
+    Args:
+        ref: ads_data.html_file_path 中保存的存储引用（存档引用或文件路径）
+        archive: 已打开的 SQLiteHTMLStorage，批量读取时传入以复用连接
+
+    Returns:
+        HTML字符串，找不到时返回None
+    """
+    if not ref:
+        return None
+
+    if is_archive_ref(ref):
+        if archive is not None:
+            return archive.load(ref)
+        storage = SQLiteHTMLStorage()
+        try:
+            return storage.load(ref)
+        finally:
+            storage.close()
+
+    if not os.path.exists(ref):
+        return None
+    with open(ref, 'r', encoding='utf-8') as f:
+        return f.read()
@@ -0,0 +1,270 @@
+"""
+SMTP邮件投递
+在少量复用的已登录SMTP会话上并行发送多封邮件：每个会话只做一次 STARTTLS 和登录，
+连接出错时才重新建立；每个收件人单独投递，临时错误按配置重试，不影响其他收件人。
+发给多个收件人的同一份报告用 PreparedMessage 只序列化一次
+"""
+
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP, compat32
+from email.utils import formataddr, formatdate, make_msgid
+
+import config
+from config import EMAIL_CONFIG
+
+# 邮件投递配置（config.py 中未定义时使用默认值）
+# 同时保持的SMTP会话数（QQ邮箱频繁登录会被限流，不宜过大）
+EMAIL_POOL_SIZE = getattr(config, 'EMAIL_POOL_SIZE', 2)
+# 每个收件人在临时错误（断线、4xx响应等）后的最大重试次数
+EMAIL_MAX_RETRIES = getattr(config, 'EMAIL_MAX_RETRIES', 2)
+# 重试前的等待时间（秒），第n次重试等待 n 倍
+EMAIL_RETRY_DELAY = getattr(config, 'EMAIL_RETRY_DELAY', 2.0)
+# SMTP连接超时（秒）
+EMAIL_SMTP_TIMEOUT = getattr(config, 'EMAIL_SMTP_TIMEOUT', 30)
+
+# MailDelivery.send_message() 返回的永久错误（收件人被拒绝、5xx响应）的前缀，这类错误重试也不会成功
+PERMANENT_ERROR_PREFIXES = ('收件人被拒绝', '发送失败')
+
+
+def is_permanent_error(error):
+    """判断 send_message() 返回的错误信息是否为永久错误"""
+    return error.startswith(PERMANENT_ERROR_PREFIXES)
+
+
+def _close_quietly(server):
+    """关闭SMTP连接，忽略QUIT时的异常（QQ邮箱QUIT时经常直接断开）"""
+    try:
+        server.quit()
+    except Exception:
+        pass
+    finally:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+class PreparedMessage:
+    """
+    只序列化一次的HTML邮件
+
+    正文和MIME结构在创建时转换为字节，发送给每个收件人时只在前面加上各自的 To 和 Message-ID 信头，
+    构建开销与收件人数无关
+    """
+
+    def __init__(self, subject, html_content, sender, sender_name=None):
+        self.sender = sender
+        self._domain = sender.rpartition('@')[2] or None
+
+        message = MIMEMultipart('alternative')
+        message['Subject'] = subject
+        message['From'] = formataddr((sender_name, sender)) if sender_name else sender
+        message['Date'] = formatdate(localtime=True)
+        message.attach(MIMEText(html_content, 'html', 'utf-8'))
+        # 与 smtplib.send_message 相同的信头编码，换行符使用SMTP要求的CRLF
+        self._payload = message.as_bytes(policy=compat32.clone(linesep='\r\n'))
+
+    @property
+    def size(self):
+        """序列化后的邮件大小（字节，不含收件人信头）"""
+        return len(self._payload)
+
+    def as_bytes(self, recipient):
+        """返回发给指定收件人的完整邮件"""
+        return (
+            SMTP.fold_binary('To', recipient)
+            + SMTP.fold_binary('Message-ID', make_msgid(domain=self._domain))
+            + self._payload
+        )
+
+
+class SMTPConnectionPool:
+    """
+    已登录SMTP会话的连接池
+
+    连接按需创建，最多 size 个；归还的连接留在池中供下一封邮件复用，
+    发送出错的连接直接丢弃，下次取用时重新连接并登录
+    """
+
+    def __init__(self, email_config=None, size=None):
+        self.email_config = email_config or EMAIL_CONFIG
+        self.size = max(int(size or EMAIL_POOL_SIZE), 1)
+
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+        self.connects = 0
+
+    def _connect(self):
+        """建立新的SMTP会话：EHLO、STARTTLS（可在 EMAIL_CONFIG 中用 starttls 关闭）、登录"""
+        server = smtplib.SMTP(
+            self.email_config['smtp_server'], self.email_config['smtp_port'],
+            timeout=EMAIL_SMTP_TIMEOUT
+        )
+        try:
+            server.ehlo()
+            if self.email_config.get('starttls', True):
+                server.starttls()
+                server.ehlo()
+            if self.email_config.get('username'):
+                server.login(self.email_config['username'], self.email_config['password'])
+        except Exception:
+            _close_quietly(server)
+            raise
+
+        with self._condition:
+            self.connects += 1
+        return server
+
+    def acquire(self):
+        """取出一个空闲会话，没有空闲会话且未达到上限时新建，否则等待其他线程归还"""
+        with self._condition:
+            while not self._idle and self._created >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, server):
+        """归还可继续使用的会话"""
+        with self._condition:
+            self._idle.append(server)
+            self._condition.notify()
+
+    def discard(self, server):
+        """丢弃出错的会话，下次取用时重新连接"""
+        _close_quietly(server)
+        with self._condition:
+            self._created -= 1
+            self._condition.notify()
+
+    def close(self):
+        """关闭所有空闲会话"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for server in idle:
+            _close_quietly(server)
+
+
+class MailDelivery:
+    """
+    邮件投递器
+
+    用法:
+        with MailDelivery() as delivery:
+            sent, failed = delivery.send_messages([(recipient, message), ...])
+    """
+
+    def __init__(self, email_config=None, pool_size=None, max_retries=None, retry_delay=None):
+        self.email_config = email_config or EMAIL_CONFIG
+        self.pool = SMTPConnectionPool(self.email_config, pool_size)
+        self.max_retries = EMAIL_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_delay = EMAIL_RETRY_DELAY if retry_delay is None else retry_delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    def send_message(self, recipient, message):
+        """
+        投递一封邮件给单个收件人，临时错误时换一个会话重试
+
+        Args:
+            recipient: 收件人地址
+            message: PreparedMessage 或 email.message.Message 对象
+
+        Returns:
+            None表示发送成功，否则为错误信息
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * attempt)
+
+            try:
+                server = self.pool.acquire()
+            except Exception as e:
+                error = f"连接SMTP服务器失败: {str(e)}"
+                continue
+
+            try:
+                if isinstance(message, PreparedMessage):
+                    refused = server.sendmail(message.sender, [recipient], message.as_bytes(recipient))
+                else:
+                    refused = server.send_message(message, to_addrs=[recipient])
+            except smtplib.SMTPRecipientsRefused as e:
+                # 收件人被拒绝是永久错误，会话仍然可用，不再重试
+                self.pool.release(server)
+                return f"收件人被拒绝: {str(e)}"
+            except smtplib.SMTPResponseException as e:
+                if 400 <= e.smtp_code < 500:
+                    # 临时错误（如限流），会话状态不确定，丢弃后重试
+                    self.pool.discard(server)
+                    error = f"临时错误: {str(e)}"
+                    continue
+                self.pool.release(server)
+                return f"发送失败: {str(e)}"
+            except (smtplib.SMTPException, OSError) as e:
+                # 断线、超时等，重新连接后重试
+                self.pool.discard(server)
+                error = f"连接错误: {str(e)}"
+                continue
+
+            self.pool.release(server)
+            if refused:
+                return f"收件人被拒绝: {refused}"
+            return None
+
+        return error
+
+    def send_messages(self, messages, progress=None):
+        """
+        并行投递多封邮件，同时进行的发送数不超过连接池大小
+
+        Args:
+            messages: (收件人, 邮件) 元组列表
+            progress: 每个收件人发送完成后调用 progress(收件人, 错误信息或None)（可选）
+
+        Returns:
+            (发送成功的收件人列表, {发送失败的收件人: 错误信息})，成功列表按输入顺序
+        """
+        messages = list(messages)
+        if not messages:
+            return [], {}
+
+        # progress 回调串行调用，回调中的输出不会交错
+        progress_lock = threading.Lock()
+
+        def deliver(item):
+            recipient, message = item
+            error = self.send_message(recipient, message)
+            if progress:
+                with progress_lock:
+                    progress(recipient, error)
+            return recipient, error
+
+        with ThreadPoolExecutor(max_workers=min(self.pool.size, len(messages))) as executor:
+            results = list(executor.map(deliver, messages))
+
+        sent = [recipient for recipient, error in results if error is None]
+        failed = {recipient: error for recipient, error in results if error is not None}
+        return sent, failed
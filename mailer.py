@@ -0,0 +1,127 @@
+"""
+邮件发件队列的发送进程
+抓取结束后只把报告写入数据库中的发件队列（AdDatabase.enqueue_email()），不等待SMTP；
+python main.py --mode mailer 取出到期的邮件发送，临时错误按指数退避重试，进程中断时未完成的邮件在租约到期后重新发送
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import config
+from config import EMAIL_CONFIG
+from database import AdDatabase
+from email_sender import SENDER_NAME
+from mail_delivery import MailDelivery, PreparedMessage, is_permanent_error
+
+# 发件队列配置（config.py 中未定义时使用默认值）
+# 每个收件人最多发送次数，超过后标记为失败
+EMAIL_OUTBOX_MAX_ATTEMPTS = getattr(config, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+# 第n次发送失败后等待 EMAIL_OUTBOX_RETRY_DELAY * 2^(n-1) 秒再重试，最多等待 EMAIL_OUTBOX_MAX_RETRY_DELAY 秒
+EMAIL_OUTBOX_RETRY_DELAY = getattr(config, 'EMAIL_OUTBOX_RETRY_DELAY', 60)
+EMAIL_OUTBOX_MAX_RETRY_DELAY = getattr(config, 'EMAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+# 每次从队列取出的收件人数
+EMAIL_OUTBOX_BATCH_SIZE = getattr(config, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+# 取出后的租约时间（秒），发送进程中断时到期后由下一次运行重新发送
+EMAIL_OUTBOX_LEASE = getattr(config, 'EMAIL_OUTBOX_LEASE', 600)
+# 发送完成的邮件在队列中保留的天数
+EMAIL_OUTBOX_RETENTION_DAYS = getattr(config, 'EMAIL_OUTBOX_RETENTION_DAYS', 7)
+
+
+def retry_delay(attempts):
+    """第 attempts 次发送失败后到下次重试的等待时间（秒）"""
+    return min(EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+
+def _deliver_claimed(db, delivery, claimed, prepared, stats):
+    """
+    发送一批取出的收件人并记录结果，同一封邮件的收件人并行发送
+
+    发送用时超过租约时，收件人可能已被其他发送进程重新取出，这些行的结果不会记录（计入 stats['stale']）
+    """
+    by_message = {}
+    for outbox_id, message_id, recipient, attempts, claim_token in claimed:
+        by_message.setdefault(message_id, []).append((outbox_id, recipient, attempts, claim_token))
+
+    results = []
+    outcomes = {}
+    for message_id, rows in by_message.items():
+        if message_id not in prepared:
+            subject, html_content = db.get_outbox_message(message_id)
+            prepared[message_id] = PreparedMessage(
+                subject, html_content, EMAIL_CONFIG['sender'], sender_name=SENDER_NAME
+            )
+        message = prepared[message_id]
+
+        _, failed = delivery.send_messages([(recipient, message) for _, recipient, _, _ in rows])
+
+        now = datetime.now()
+        for outbox_id, recipient, attempts, claim_token in rows:
+            error = failed.get(recipient)
+            if error is None:
+                results.append((outbox_id, claim_token, 'sent', None, None))
+                outcomes[outbox_id] = ('sent', f"   ✅ #{message_id} {recipient} 发送成功")
+            elif is_permanent_error(error) or attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+                results.append((outbox_id, claim_token, 'failed', None, error))
+                outcomes[outbox_id] = ('failed', f"   ❌ #{message_id} {recipient} {error}（第 {attempts} 次，不再重试）")
+            else:
+                next_attempt_at = now + timedelta(seconds=retry_delay(attempts))
+                results.append((outbox_id, claim_token, 'pending', next_attempt_at, error))
+                outcomes[outbox_id] = ('retry', f"   ⏳ #{message_id} {recipient} {error}（第 {attempts} 次，"
+                                                f"{next_attempt_at.strftime('%H:%M:%S')} 重试）")
+
+    stale = set(db.finish_outbox_emails(results))
+    for outbox_id, (outcome, line) in outcomes.items():
+        if outbox_id in stale:
+            stats['stale'] += 1
+            print(f"{line}\n   ⚠️ 队列行 #{outbox_id} 的租约已过期并被重新取出，本次结果未记录")
+        else:
+            stats[outcome] += 1
+            print(line)
+
+
+def run_mailer(limit=None):
+    """
+    发送发件队列中所有到期的邮件
+
+    Args:
+        limit: 最多发送的收件人数，默认发送所有到期的邮件
+
+    Returns:
+        {'sent': 成功数, 'retry': 等待重试数, 'failed': 最终失败数,
+         'stale': 租约过期未记录结果数, 'purged': 清理的邮件数}
+    """
+    db = AdDatabase()
+    stats = {'sent': 0, 'retry': 0, 'failed': 0, 'stale': 0, 'purged': 0}
+    prepared = {}
+
+    print("📮 开始发送发件队列中的邮件")
+    start_time = time.perf_counter()
+
+    with MailDelivery() as delivery:
+        processed = 0
+        while limit is None or processed < limit:
+            batch_size = EMAIL_OUTBOX_BATCH_SIZE if limit is None else min(EMAIL_OUTBOX_BATCH_SIZE, limit - processed)
+            now = datetime.now()
+            claimed = db.claim_outbox_emails(
+                batch_size, now, now + timedelta(seconds=EMAIL_OUTBOX_LEASE)
+            )
+            if not claimed:
+                break
+            # 退避时间内的收件人不会被取出，达到最大次数后不再重试，循环在队列中没有到期邮件时结束
+            _deliver_claimed(db, delivery, claimed, prepared, stats)
+            processed += len(claimed)
+
+    stats['purged'] = db.purge_outbox(datetime.now() - timedelta(days=EMAIL_OUTBOX_RETENTION_DAYS))
+    counts = db.get_outbox_counts()
+    db.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"📊 发送完成: 成功 {stats['sent']}，等待重试 {stats['retry']}，失败 {stats['failed']}，用时 {elapsed:.1f} 秒")
+    print(f"   队列中待发送: {counts.get('pending', 0)}，累计失败: {counts.get('failed', 0)}")
+    if stats['stale']:
+        print(f"   ⚠️ {stats['stale']} 个收件人的租约在发送期间过期，结果以重新取出的发送进程为准"
+              f"（可调大 EMAIL_OUTBOX_LEASE）")
+    if stats['purged']:
+        print(f"   已清理 {stats['purged']} 封超过 {EMAIL_OUTBOX_RETENTION_DAYS} 天的已完成邮件")
+
+    return stats
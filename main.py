@@ -8,12 +8,18 @@ import sys
 import argparse
 import traceback
 from datetime import datetime
+import config
 from scraper import GoogleSERPScraper
 from database import AdDatabase
 from email_sender import EmailSender
 from config import KEYWORDS_LIST, COUNTRY_LIST, EMAIL_CONFIG
 from logger import project_logger
 
+# 抓取完成后是否把报告邮件加入发件队列（由 --mode mailer 发送，config.py 中未定义时使用默认值）
+POST_SCRAPE_EMAIL = getattr(config, 'POST_SCRAPE_EMAIL', False)
+# 抓取结果邮件的收件人
+POST_SCRAPE_EMAIL_RECIPIENTS = getattr(config, 'POST_SCRAPE_EMAIL_RECIPIENTS', ["272363364@qq.com"])
+
 
 def main():
     """主程序入口"""
@@ -21,9 +27,9 @@ def main():
     
     parser.add_argument(
         '--mode', 
-        choices=['single', 'batch', 'stats'], 
+        choices=['single', 'batch', 'batch-async', 'stats', 'reextract', 'compact', 'mailer'], 
         default='batch',
-        help='运行模式: single(单次抓取), batch(批量抓取), stats(显示统计)'
+        help='运行模式: single(单次抓取), batch(批量抓取), batch-async(异步批量抓取), stats(显示统计), reextract(对存档HTML重新提取广告), compact(清理超过保留期的原始广告记录), mailer(发送发件队列中的邮件)'
     )
     
     parser.add_argument(
@@ -38,6 +44,36 @@ def main():
         help='目标国家代码 (single模式必需)'
     )
     
+    parser.add_argument(
+        '--workers', 
+        type=int,
+        help='批量抓取时的最大并发数 (batch默认BATCH_MAX_WORKERS, batch-async默认ASYNC_MAX_IN_FLIGHT, reextract为进程数)'
+    )
+    
+    parser.add_argument(
+        '--limit', 
+        type=int,
+        help='reextract模式最多处理的页面数，mailer模式最多发送的收件人数'
+    )
+    
+    parser.add_argument(
+        '--dry-run', 
+        action='store_true',
+        help='reextract/compact模式只统计差异或要清理的行数，不写数据库'
+    )
+    
+    parser.add_argument(
+        '--retention-days', 
+        type=int,
+        help='compact模式原始广告记录的保留天数 (默认RAW_DATA_RETENTION_DAYS)'
+    )
+    
+    parser.add_argument(
+        '--archive', 
+        type=str,
+        help='compact模式先将要清理的记录复制到此归档数据库 (默认RAW_DATA_ARCHIVE)'
+    )
+    
     parser.add_argument(
         '--list-config', 
         action='store_true',
@@ -47,7 +83,51 @@ def main():
     parser.add_argument(
         '--export', 
         type=str,
-        help='导出数据到CSV文件 (提供文件名)'
+        help='导出数据到文件 (提供文件名，格式由 --format 指定)'
+    )
+    
+    parser.add_argument(
+        '--export-incremental', 
+        type=str,
+        metavar='CONSUMER',
+        help='增量导出：只导出该消费方上次导出之后新增的数据 (提供消费方名称)'
+    )
+    
+    parser.add_argument(
+        '--export-dir', 
+        type=str,
+        help='增量导出的根目录 (默认EXPORT_DIR)，文件写在其下的消费方子目录中'
+    )
+    
+    parser.add_argument(
+        '--format', 
+        choices=['csv', 'jsonl', 'parquet', 'arrow'],
+        default='csv',
+        help='导出格式: csv(默认), jsonl, parquet, arrow (parquet/arrow 需要安装 pyarrow，增量导出只支持 csv/jsonl)'
+    )
+    
+    parser.add_argument(
+        '--gzip', 
+        action='store_true',
+        help='导出时使用 gzip 压缩'
+    )
+    
+    parser.add_argument(
+        '--start-date', 
+        type=str,
+        help='导出的起始日期 YYYY-MM-DD（含）'
+    )
+    
+    parser.add_argument(
+        '--end-date', 
+        type=str,
+        help='导出的结束日期 YYYY-MM-DD（含）'
+    )
+    
+    parser.add_argument(
+        '--ref', 
+        type=str,
+        help='只导出指定 ref 参数的广告'
     )
     
     args = parser.parse_args()
@@ -64,7 +144,66 @@ def main():
     
     # 导出数据
     if args.export:
-        export_data(args.export)
+        export_data(
+            args.export,
+            fmt=args.format,
+            compress=args.gzip,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            keyword=args.keyword,
+            country_code=args.country,
+            ref=args.ref
+        )
+        return
+    
+    # 增量导出
+    if args.export_incremental:
+        export_incremental_data(
+            args.export_incremental,
+            export_dir=args.export_dir,
+            fmt=args.format,
+            compress=args.gzip,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            keyword=args.keyword,
+            country_code=args.country,
+            ref=args.ref
+        )
+        return
+    
+    # 对存档HTML重新提取广告
+    if args.mode == 'reextract':
+        from reextract import reextract_archive
+        
+        reextract_archive(processes=args.workers, limit=args.limit, dry_run=args.dry_run)
+        return
+    
+    # 清理超过保留期的原始广告记录
+    if args.mode == 'compact':
+        from compaction import compact_raw_data
+        
+        compact_raw_data(retention_days=args.retention_days, archive_path=args.archive, dry_run=args.dry_run)
+        return
+    
+    # 发送发件队列中的邮件
+    if args.mode == 'mailer':
+        from mailer import run_mailer
+        
+        run_mailer(limit=args.limit)
+        return
+    
+    # 异步批量抓取
+    if args.mode == 'batch-async':
+        from async_scraper import AsyncGoogleSERPScraper
+        
+        print("🚀 异步批量抓取模式")
+        print(f"将抓取 {len(KEYWORDS_LIST)} 个关键词 × {len(COUNTRY_LIST)} 个国家 = {len(KEYWORDS_LIST) * len(COUNTRY_LIST)} 个组合")
+        
+        scraper = AsyncGoogleSERPScraper()
+        scraper.scrape_all_combinations_batch_async(max_in_flight=args.workers)
+        
+        if POST_SCRAPE_EMAIL:
+            queue_scrape_result_email()
         return
     
     # 创建抓取器
@@ -79,8 +218,9 @@ def main():
         
         scraper.scrape_single(args.keyword, args.country)
         
-        # 单次抓取完成后也发送邮件
-       # send_scrape_result_email(scraper)
+        # 单次抓取完成后也发送邮件（加入发件队列，不等待SMTP）
+        if POST_SCRAPE_EMAIL:
+            queue_scrape_result_email()
         
     elif args.mode == 'batch':
         print("🚀 批量抓取模式")
@@ -92,10 +232,11 @@ def main():
       #      print("已取消")
       #ß      return
         
-        scraper.scrape_all_combinations()
+        scraper.scrape_all_combinations(max_workers=args.workers)
         
-        # 抓取完成后自动发送邮件
-       # send_scrape_result_email(scraper)
+        # 抓取完成后自动发送邮件（加入发件队列，不等待SMTP）
+        if POST_SCRAPE_EMAIL:
+            queue_scrape_result_email()
 
 
 def show_config():
@@ -113,7 +254,7 @@ def show_config():
 
 
 def show_stats():
-    """显示统计信息"""
+    """显示统计信息（读取触发器维护的汇总表，不扫描广告数据）"""
     db = AdDatabase()
     stats = db.get_scrape_stats()
     
@@ -127,120 +268,116 @@ def show_stats():
     # 显示按关键词分组的统计
     print("\n📈 按关键词统计:")
     show_keyword_stats(db)
+    
+    # 显示按国家分组的统计
+    print("\n🌍 按国家统计:")
+    show_country_stats(db)
+    
+    # 显示最近24小时的统计
+    print("\n🕐 最近24小时统计:")
+    show_hourly_stats(db)
+    
+    db.close()
 
 
 def show_keyword_stats(db):
     """显示按关键词分组的统计"""
-    import sqlite3
-    
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT keyword, COUNT(*) as ads_count, 
-               COUNT(DISTINCT country_code) as countries_count
-        FROM ads_data 
-        GROUP BY keyword
-        ORDER BY ads_count DESC
-    ''')
-    
-    results = cursor.fetchall()
+    results = db.get_keyword_stats()
     
     if results:
-        for keyword, ads_count, countries_count in results:
-            print(f"  {keyword}: {ads_count} 个广告 (覆盖 {countries_count} 个国家)")
+        for keyword, ads_count, countries_count, scrape_count, success_count, last_scrape in results:
+            print(f"  {keyword}: {ads_count} 个广告 (覆盖 {countries_count} 个国家，抓取 {scrape_count} 次，成功 {success_count} 次)")
     else:
         print("  暂无数据")
+
+
+def show_country_stats(db):
+    """显示按国家分组的统计"""
+    results = db.get_country_stats()
     
-    conn.close()
+    if results:
+        for country_code, ads_count, keywords_count, scrape_count, success_count, last_scrape in results:
+            print(f"  {country_code}: {ads_count} 个广告 ({keywords_count} 个关键词有广告，抓取 {scrape_count} 次，成功 {success_count} 次)")
+    else:
+        print("  暂无数据")
 
 
-def export_data(filename):
-    """导出数据到CSV文件"""
-    import csv
-    import sqlite3
-    from database import AdDatabase
+def show_hourly_stats(db, hours=24):
+    """显示最近若干小时的统计"""
+    results = db.get_hourly_stats(hours)
     
-    db = AdDatabase()
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
+    if results:
+        for hour, scrape_count, success_count, ads_count in results:
+            print(f"  {hour}:00  抓取 {scrape_count} 次，成功 {success_count} 次，新增广告 {ads_count} 个")
+    else:
+        print("  暂无数据")
+
+
+def export_data(filename, fmt='csv', compress=False, **filters):
+    """
+    流式导出数据（分块读取，内存占用与数据量无关）
     
-    cursor.execute('''
-        SELECT keyword, country_code, ad_title, ad_url, target_url, 
-               real_target_url, ref_parameter, ch_parameter, utm_campaign_parameter,
-               ad_description, position, scrape_time
-        FROM ads_data
-        ORDER BY scrape_time DESC, keyword, country_code, position
-    ''')
+    Args:
+        filename: 输出文件名
+        fmt: 导出格式 csv/jsonl/parquet/arrow
+        compress: 是否 gzip 压缩
+        **filters: start_date, end_date, keyword, country_code, ref
+    """
+    from exporter import export_ads
     
-    results = cursor.fetchall()
+    try:
+        exported_file, exported = export_ads(filename, fmt=fmt, compress=compress, **filters)
+    except Exception as e:
+        print(f"❌ 导出失败: {str(e)}")
+        return
     
-    if not results:
-        print("❌ 数据库中没有数据可导出")
+    if not exported:
+        print("❌ 数据库中没有符合条件的数据可导出")
         return
     
-    # 确保文件名有.csv扩展名
-    if not filename.endswith('.csv'):
-        filename += '.csv'
+    print(f"✅ 数据已导出到 {exported_file}")
+    print(f"   共导出 {exported} 条记录")
+
+
+def export_incremental_data(consumer, export_dir=None, fmt='csv', compress=False, **filters):
+    """增量导出：只导出消费方上次导出之后新增的数据，写为一个新文件"""
+    from exporter import export_incremental
     
     try:
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.writer(csvfile)
-            
-            # 写入表头
-            writer.writerow([
-                '关键词', '国家代码', '广告标题', '广告URL', 
-                '目标URL', '真实目标URL', 'Ref参数', 'Ch参数', 'UTM Campaign参数',
-                '广告描述', '位置', '抓取时间'
-            ])
-            
-            # 写入数据
-            writer.writerows(results)
-        
-        print(f"✅ 数据已导出到 {filename}")
-        print(f"   共导出 {len(results)} 条记录")
-        
+        exported_file, exported, last_id = export_incremental(
+            consumer, export_dir=export_dir, fmt=fmt, compress=compress, **filters
+        )
     except Exception as e:
-        print(f"❌ 导出失败: {str(e)}")
+        print(f"❌ 增量导出失败: {str(e)}")
+        return
+    
+    if not exported_file:
+        print(f"ℹ️ 消费方 {consumer} 没有新数据需要导出 (检查点 id={last_id})")
+        return
     
-    conn.close()
+    print(f"✅ 增量数据已导出到 {exported_file}")
+    print(f"   共导出 {exported} 条记录，检查点更新为 id={last_id}")
 
 
-def send_scrape_result_email(scraper):
-    """发送抓取结果邮件到272363364@qq.com"""
+def queue_scrape_result_email():
+    """
+    把抓取结果邮件加入发件队列
+    
+    只生成报告并写入数据库，立即返回；由 python main.py --mode mailer（cron/run_mailer.sh）发送，
+    SMTP延迟和失败重试不会拖慢抓取任务
+    """
     logger = project_logger.get_logger('main_email', 'main_email.log')
     
     try:
-        logger.info("🚀 开始发送抓取结果邮件")
-        
-        # 创建邮件发送器
-        email_sender = EmailSender()
-        
-        # 获取统计信息
-        stats = scraper.db.get_scrape_stats()
-        
-        # 构建邮件主题
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         subject = f"[抓取完成] Google广告数据抓取结果 - {current_time}"
         
-        # 发送邮件给272363364@qq.com
-        recipients = ["272363364@qq.com"]
-        
-        success = email_sender.send_email(
-            subject=subject,
-            recipients=recipients
-        )
+        message_id = EmailSender().queue_email(subject=subject, recipients=POST_SCRAPE_EMAIL_RECIPIENTS)
+        logger.info(f"📮 抓取结果邮件已加入发件队列 (id={message_id}): {', '.join(POST_SCRAPE_EMAIL_RECIPIENTS)}")
         
-        if success:
-            logger.info(f"✅ 抓取结果邮件发送成功: {', '.join(recipients)}")
-            print(f"📧 抓取结果邮件已发送到: {', '.join(recipients)}")
-        else:
-            logger.error("❌ 抓取结果邮件发送失败")
-            print("❌ 抓取结果邮件发送失败")
-            
     except Exception as e:
-        logger.error(f"❌ 发送抓取结果邮件异常: {str(e)}")
-        print(f"❌ 发送抓取结果邮件失败: {str(e)}")
+        logger.error(f"❌ 抓取结果邮件加入发件队列失败: {str(e)}")
+        print(f"❌ 抓取结果邮件加入发件队列失败: {str(e)}")
 
 
 if __name__ == "__main__":
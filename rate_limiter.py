@@ -0,0 +1,105 @@
+"""
+令牌桶限速器
+批量抓取时替代固定的 time.sleep，支持全局限速或按国家分别限速
+"""
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate, capacity=1):
+        """
+        Args:
+            rate: 每秒补充的令牌数（<=0 表示不限速）
+            capacity: 桶容量，即允许的突发请求数
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """按流逝时间补充令牌"""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """获取一个令牌，没有令牌时阻塞等待，返回实际等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            wait_time = self._try_take()
+            if wait_time == 0:
+                return waited
+            time.sleep(wait_time)
+            waited += wait_time
+
+    def _try_take(self):
+        """尝试立即取走一个令牌，成功返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire_async(self):
+        """acquire 的协程版本，等待时不阻塞事件循环"""
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            wait_time = self._try_take()
+            if wait_time == 0:
+                return waited
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+
+
+class RateLimiter:
+    """按作用域管理令牌桶的限速器"""
+
+    def __init__(self, rate, capacity=1, scope='global'):
+        """
+        Args:
+            rate: 每个令牌桶每秒允许的请求数
+            capacity: 每个令牌桶的突发容量
+            scope: 'global'(所有请求共用一个桶) 或 'country'(每个国家一个桶)
+        """
+        if scope not in ('global', 'country'):
+            raise ValueError(f"不支持的限速作用域: {scope}")
+
+        self.rate = rate
+        self.capacity = capacity
+        self.scope = scope
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, key):
+        """获取（必要时创建）对应作用域的令牌桶"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+            return bucket
+
+    def acquire(self, country_code=None):
+        """为一次请求获取令牌，返回等待的秒数"""
+        key = country_code if self.scope == 'country' else None
+        return self._get_bucket(key).acquire()
+
+    async def acquire_async(self, country_code=None):
+        """acquire 的协程版本"""
+        key = country_code if self.scope == 'country' else None
+        return await self._get_bucket(key).acquire_async()
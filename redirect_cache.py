@@ -0,0 +1,194 @@
+"""
+广告跳转解析缓存
+将广告点击URL（去除 gclid/sig/ai 等易变参数后）映射到已解析的落地页及其跟踪参数（JSON），
+持久化在广告数据库中，支持 TTL 过期和按最近访问时间（LRU）淘汰
+"""
+
+import json
+import threading
+import time
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+import config
+from database import connect_database
+from url_params import extract_url_params, legacy_param_fields
+
+# 跳转缓存配置（config.py 中未定义时使用默认值）
+REDIRECT_CACHE_ENABLED = getattr(config, 'REDIRECT_CACHE_ENABLED', True)
+# 缓存有效期（秒）
+REDIRECT_CACHE_TTL = getattr(config, 'REDIRECT_CACHE_TTL', 24 * 3600)
+# 缓存条目上限，超过后淘汰最久未访问的条目
+REDIRECT_CACHE_MAX_ENTRIES = getattr(config, 'REDIRECT_CACHE_MAX_ENTRIES', 50000)
+# 生成缓存键时忽略的易变参数（每次展示都会变化）
+REDIRECT_CACHE_VOLATILE_PARAMS = getattr(
+    config, 'REDIRECT_CACHE_VOLATILE_PARAMS',
+    ('gclid', 'gbraid', 'wbraid', 'dclid', 'sig', 'ai', 'ved', 'ei')
+)
+
+
+def normalize_ad_url(ad_url):
+    """去除易变参数并对参数排序，得到稳定的广告URL缓存键"""
+    parsed = urlparse(ad_url)
+    volatile = set(REDIRECT_CACHE_VOLATILE_PARAMS)
+    params = sorted(
+        (name, value)
+        for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if name not in volatile
+    )
+    return f"{parsed.netloc.lower()}{parsed.path}?{urlencode(params)}"
+
+
+class RedirectCache:
+    """基于SQLite的广告跳转解析缓存"""
+
+    def __init__(self, db_path, ttl=None, max_entries=None):
+        """
+        Args:
+            db_path: 数据库文件路径（与 ads_data 同库）
+            ttl: 缓存有效期（秒），默认使用 REDIRECT_CACHE_TTL
+            max_entries: 缓存条目上限，默认使用 REDIRECT_CACHE_MAX_ENTRIES
+        """
+        self.db_path = db_path
+        self.ttl = ttl or REDIRECT_CACHE_TTL
+        self.max_entries = max_entries or REDIRECT_CACHE_MAX_ENTRIES
+
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+        # 与 AdDatabase 相同：复用一个长连接，多个解析线程通过锁串行访问
+        self._conn = connect_database(self.db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        self._init_table()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def _init_table(self):
+        """创建缓存表"""
+        with self._lock, self._conn as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS redirect_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    landing_domain TEXT,
+                    final_url TEXT NOT NULL,
+                    ref_parameter TEXT,
+                    ch_parameter TEXT,
+                    utm_campaign_parameter TEXT,
+                    url_params TEXT,
+                    resolved_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hit_count INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_redirect_cache_last_access
+                ON redirect_cache(last_access)
+            ''')
+
+            # 旧版本创建的缓存表没有 url_params 字段
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(redirect_cache)')]
+            if 'url_params' not in columns:
+                conn.execute('ALTER TABLE redirect_cache ADD COLUMN url_params TEXT')
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, ad_url):
+        """查询缓存，命中返回与 _get_real_target_url 相同结构的字典，否则返回None"""
+        cache_key = normalize_ad_url(ad_url)
+        now = time.time()
+
+        try:
+            with self._lock, self._conn as conn:
+                row = conn.execute('''
+                    SELECT final_url, url_params, resolved_at
+                    FROM redirect_cache WHERE cache_key = ?
+                ''', (cache_key,)).fetchone()
+
+                if row is None:
+                    self._count(False)
+                    return None
+
+                final_url, url_params_json, resolved_at = row
+
+                # 过期条目直接删除
+                if now - resolved_at > self.ttl:
+                    conn.execute('DELETE FROM redirect_cache WHERE cache_key = ?', (cache_key,))
+                    self._count(False)
+                    return None
+
+                conn.execute('''
+                    UPDATE redirect_cache SET last_access = ?, hit_count = hit_count + 1
+                    WHERE cache_key = ?
+                ''', (now, cache_key))
+        except Exception as e:
+            print(f"读取跳转缓存时出错: {e}")
+            self._count(False)
+            return None
+
+        self._count(True)
+        # 旧版本写入的条目没有参数JSON，从落地页URL重新提取
+        url_params = json.loads(url_params_json) if url_params_json else extract_url_params(final_url)
+        return {
+            'final_url': final_url,
+            'url_params': url_params,
+            **legacy_param_fields(url_params)
+        }
+
+    def put(self, ad_url, result):
+        """写入一条解析结果，并在超过容量时淘汰最久未访问的条目"""
+        cache_key = normalize_ad_url(ad_url)
+        now = time.time()
+
+        try:
+            with self._lock, self._conn as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO redirect_cache
+                    (cache_key, landing_domain, final_url, ref_parameter, ch_parameter,
+                     utm_campaign_parameter, url_params, resolved_at, last_access, hit_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ''', (
+                    cache_key,
+                    urlparse(result['final_url']).netloc.lower(),
+                    result['final_url'],
+                    result.get('ref_parameter'),
+                    result.get('ch_parameter'),
+                    result.get('utm_campaign_parameter'),
+                    json.dumps(result.get('url_params') or {}, ensure_ascii=False, sort_keys=True),
+                    now,
+                    now
+                ))
+
+                overflow = conn.execute('SELECT COUNT(*) FROM redirect_cache').fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    conn.execute('''
+                        DELETE FROM redirect_cache WHERE cache_key IN (
+                            SELECT cache_key FROM redirect_cache ORDER BY last_access LIMIT ?
+                        )
+                    ''', (overflow,))
+        except Exception as e:
+            print(f"写入跳转缓存时出错: {e}")
+
+    def reset_stats(self):
+        """清零命中统计（每次批量抓取开始时调用）"""
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        """获取命中统计"""
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total * 100 if total else 0.0
+            }
@@ -0,0 +1,234 @@
+"""
+离线重新提取
+修改 GoogleAdExtractor 的识别规则后，用多进程对已存档的SERP HTML重新提取广告（不访问网络），
+与 ads_data 中通过 html_file_path 关联的记录逐条对比，更新变化的字段并补充新识别出的广告
+"""
+
+import multiprocessing
+import os
+import time
+
+import config
+from ad_extractor import GoogleAdExtractor
+from change_detection import CHANGE_DETECTION, ad_fingerprint
+from database import AdDatabase
+from html_storage import SQLiteHTMLStorage, is_archive_ref, load_html
+from redirect_cache import normalize_ad_url
+
+# 重新提取配置（config.py 中未定义时使用默认值）
+# 工作进程数，默认使用全部CPU核心
+REEXTRACT_PROCESSES = getattr(config, 'REEXTRACT_PROCESSES', None)
+# 每累计多少个页面的修正结果写一次数据库
+REEXTRACT_COMMIT_EVERY = getattr(config, 'REEXTRACT_COMMIT_EVERY', 200)
+
+# 对比时检查的字段：ads_data 列名 -> 提取结果中的键
+REEXTRACT_FIELDS = (
+    ('target_url', 'target_url'),
+    ('ad_title', 'title'),
+    ('ad_description', 'description'),
+    ('position', 'position'),
+)
+
+# 工作进程内复用的提取器和存档连接，由 _init_worker 创建
+_worker_extractor = None
+_worker_archive = None
+
+
+def _init_worker():
+    """工作进程初始化：每个进程创建一次提取器和存档连接"""
+    global _worker_extractor, _worker_archive
+    _worker_extractor = GoogleAdExtractor(max_workers=1)
+    _worker_archive = None
+
+
+def _extract_page(html_ref):
+    """
+    在工作进程中读取一个页面并提取广告
+
+    Returns:
+        (html_ref, 广告列表, 错误信息)，读取或解析失败时广告列表为None
+    """
+    global _worker_archive
+
+    try:
+        if is_archive_ref(html_ref) and _worker_archive is None:
+            _worker_archive = SQLiteHTMLStorage()
+
+        html_content = load_html(html_ref, _worker_archive)
+        if html_content is None:
+            return html_ref, None, '找不到HTML'
+
+        return html_ref, _worker_extractor.extract_ads(html_content, get_real_urls=False), None
+    except Exception as e:
+        return html_ref, None, str(e)
+
+
+def diff_page(rows, ads, html_ref):
+    """
+    对比一个页面的提取结果和数据库记录
+
+    同一份HTML（内容相同）可能被多次抓取引用，按 (keyword, country_code, scrape_time) 分组分别对比
+
+    Args:
+        rows: get_ads_by_html_reference() 返回的记录
+        ads: 重新提取的广告列表
+        html_ref: HTML存储引用
+
+    Returns:
+        (updates, inserts, stale)，stale 为数据库中有但重新提取后不存在的广告数
+    """
+    # 同一页面中重复出现的广告链接只保留第一个，与 UNIQUE 约束一致
+    ads_by_url = {}
+    for ad in ads:
+        ads_by_url.setdefault(ad['ad_url'], ad)
+
+    groups = {}
+    for row in rows:
+        ad_id, keyword, country_code, scrape_time = row[:4]
+        groups.setdefault((keyword, country_code, scrape_time), {})[row[4]] = row
+
+    updates = []
+    inserts = []
+    stale = 0
+
+    for (keyword, country_code, scrape_time), rows_by_url in groups.items():
+        for ad_url, row in rows_by_url.items():
+            ad = ads_by_url.get(ad_url)
+            if ad is None:
+                stale += 1
+                continue
+
+            current = dict(zip(('target_url', 'ad_title', 'ad_description', 'position'), row[5:]))
+            if any(current[column] != ad[key] for column, key in REEXTRACT_FIELDS):
+                updates.append((ad['target_url'], ad['title'], ad['description'], ad['position'], row[0]))
+
+        for ad_url, ad in ads_by_url.items():
+            if ad_url not in rows_by_url:
+                inserts.append((keyword, country_code, ad, scrape_time, html_ref))
+
+    return updates, inserts, stale
+
+
+def drop_unchanged_inserts(db, inserts):
+    """
+    去掉变化检测有意跳过的广告，并为保留的广告计算指纹
+
+    开启变化检测后，未变化的广告在再次抓取时只更新指纹表，不插入新行，
+    重新提取时这些广告在对应页面中没有记录，但不需要补充。
+    修正标题/描述的识别规则后，重新提取的广告指纹会与登记时不同，因此按规范化的广告链接匹配：
+    同一关键词/国家下该链接在此页面抓取之前已登记过指纹的，视为有意跳过
+    """
+    by_page = {}
+    for insert in inserts:
+        keyword, country_code = insert[:2]
+        by_page.setdefault((keyword, country_code), []).append(insert)
+
+    remaining = []
+    for (keyword, country_code), items in by_page.items():
+        first_seen = {}
+        for ad_url, seen in db.get_fingerprinted_ad_urls(keyword, country_code):
+            key = _normalized_url(ad_url)
+            first_seen[key] = min(first_seen.get(key, seen), seen)
+
+        for insert in items:
+            ad, scrape_time = insert[2], insert[3]
+            seen = first_seen.get(_normalized_url(ad.get('ad_url', '')))
+            if seen is not None and seen < scrape_time:
+                continue
+            ad['fingerprint'] = ad_fingerprint(ad)
+            remaining.append(insert)
+    return remaining
+
+
+def _normalized_url(ad_url):
+    """去掉 gclid 等易变参数后的广告链接，无法解析时原样返回"""
+    try:
+        return normalize_ad_url(ad_url)
+    except ValueError:
+        return ad_url
+
+
+def reextract_archive(processes=None, limit=None, dry_run=False):
+    """
+    对所有已存档的HTML重新提取广告并写回修正结果
+
+    Args:
+        processes: 工作进程数，默认使用 REEXTRACT_PROCESSES（未设置时为CPU核心数）
+        limit: 最多处理的页面数，用于试运行
+        dry_run: 只统计差异，不写数据库
+
+    Returns:
+        统计信息字典
+    """
+    processes = processes or REEXTRACT_PROCESSES or os.cpu_count() or 1
+
+    db = AdDatabase()
+    html_refs = db.get_html_references()
+    if limit:
+        html_refs = html_refs[:limit]
+
+    total_pages = len(html_refs)
+    print(f"🚀 开始重新提取，共 {total_pages} 个页面，{processes} 个进程")
+    if dry_run:
+        print("🔍 dry-run 模式，只统计差异，不写数据库")
+    print("-" * 60)
+
+    stats = {'pages': 0, 'failed': 0, 'ads': 0, 'updated': 0, 'inserted': 0, 'stale': 0}
+    pending_updates = []
+    pending_inserts = []
+    pending_pages = 0
+
+    def flush():
+        nonlocal pending_updates, pending_inserts, pending_pages
+        if dry_run:
+            stats['updated'] += len(pending_updates)
+            stats['inserted'] += len(pending_inserts)
+        elif pending_updates or pending_inserts:
+            updated, inserted = db.apply_reextraction(pending_updates, pending_inserts)
+            stats['updated'] += updated
+            stats['inserted'] += inserted
+        pending_updates, pending_inserts, pending_pages = [], [], 0
+
+    start_time = time.perf_counter()
+    chunksize = max(1, min(32, total_pages // (processes * 4) or 1))
+
+    with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+        for index, (html_ref, ads, error) in enumerate(
+            pool.imap_unordered(_extract_page, html_refs, chunksize=chunksize), 1
+        ):
+            if ads is None:
+                stats['failed'] += 1
+                print(f"  ⚠️ {html_ref}: {error}")
+                continue
+
+            updates, inserts, stale = diff_page(db.get_ads_by_html_reference(html_ref), ads, html_ref)
+            if CHANGE_DETECTION and inserts:
+                inserts = drop_unchanged_inserts(db, inserts)
+            pending_updates.extend(updates)
+            pending_inserts.extend(inserts)
+            pending_pages += 1
+            stats['pages'] += 1
+            stats['ads'] += len(ads)
+            stats['stale'] += stale
+
+            if pending_pages >= REEXTRACT_COMMIT_EVERY:
+                flush()
+
+            if index % 500 == 0:
+                elapsed = time.perf_counter() - start_time
+                print(f"  [{index}/{total_pages}] {index / elapsed * 60:.0f} 页/分钟")
+
+    flush()
+    db.close()
+
+    elapsed = time.perf_counter() - start_time
+    stats['pages_per_minute'] = stats['pages'] / elapsed * 60 if elapsed else 0.0
+
+    print("\n" + "=" * 60)
+    print("🎉 重新提取完成!")
+    print(f"处理页面: {stats['pages']}/{total_pages}（失败 {stats['failed']}），用时 {elapsed:.1f} 秒，{stats['pages_per_minute']:.0f} 页/分钟")
+    print(f"提取广告: {stats['ads']}")
+    print(f"{'需要更新' if dry_run else '已更新'}: {stats['updated']} 条，{'需要补充' if dry_run else '已补充'}: {stats['inserted']} 条")
+    print(f"重新提取后不再识别为广告的记录: {stats['stale']} 条（保留不删除）")
+
+    return stats
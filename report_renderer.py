@@ -0,0 +1,362 @@
+"""
+邮件报告渲染
+报告由预编译的模板片段拼接而成：所有插入的值自动做HTML转义，行数据只遍历一次（可以直接传入数据库游标），
+ref列表和详细信息表格分别写入临时缓冲（超过 REPORT_SPOOL_SIZE 后转存到临时文件），
+渲染时间与行数成线性关系，大型周报也不会占用大量内存
+"""
+
+import io
+import shutil
+import string
+import tempfile
+from datetime import datetime, timedelta
+from html import escape
+
+import config
+
+# 每个报告区块在内存中缓冲的最大字符数（config.py 中未定义时使用默认值），超过后转存到临时文件
+REPORT_SPOOL_SIZE = getattr(config, 'REPORT_SPOOL_SIZE', 4 * 1024 * 1024)
+
+# 国家代码对应的中文名称
+COUNTRY_NAMES = {
+    'in': '印度',
+    'de': '德国',
+    'tw': '中国台湾',
+    'ru': '俄罗斯',
+    'es': '西班牙'
+}
+
+
+class Markup(str):
+    """已经是HTML的片段，渲染时不再转义"""
+
+
+class Template:
+    """
+    预编译的HTML模板
+
+    使用 $name 占位符（CSS中的大括号无需转义），渲染时所有值自动做HTML转义（包括引号），Markup 除外
+    """
+
+    def __init__(self, source):
+        self._template = string.Template(source)
+
+    def render(self, **values):
+        return self._template.substitute({
+            name: value if isinstance(value, Markup) else escape(str(value))
+            for name, value in values.items()
+        })
+
+
+def country_name(code):
+    """获取国家中文名称，未知代码原样返回"""
+    return COUNTRY_NAMES.get(code, code)
+
+
+def format_discovered_time(value):
+    """将首次发现时间格式化为 YYYY-MM-DD HH:MM，无法解析时原样返回"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M')
+    except Exception:
+        return value
+
+
+# 两种报告共用的片段
+_REF_ITEM = Template('            <span class="ref-item">$ref</span>\n')
+
+_TABLE_START = Template('''        </div>
+    </div>
+
+    <div class="section">
+        <h2>📝 第二部分：详细信息</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>Ref参数</th>
+                    <th>搜索关键词</th>
+                    <th>首次发现时间</th>
+                    <th>真实链接</th>
+                    <th>广告标题</th>
+                    <th>国家</th>
+                </tr>
+            </thead>
+            <tbody>
+''')
+
+_TABLE_ROW = Template('''                <tr>
+                    <td><code>$ref</code></td>
+                    <td><strong>$keyword</strong></td>
+                    <td class="timestamp">$discovered</td>
+                    <td class="url-link">
+                        <a href="$url" target="_blank" title="$url">链接</a>
+                    </td>
+                    <td>$title</td>
+                    <td>$country</td>
+                </tr>
+''')
+
+_TABLE_END = '''            </tbody>
+        </table>
+    </div>
+'''
+
+# 最近8天报告（周报、测试邮件）
+_RECENT_HEAD = Template('''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }
+        .summary { background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin-bottom: 20px; }
+        .section { margin-bottom: 30px; }
+        .section h2 { color: #1976d2; border-bottom: 2px solid #1976d2; padding-bottom: 10px; }
+        .ref-list { background-color: #f5f5f5; padding: 15px; border-radius: 5px; }
+        .ref-item { display: inline-block; margin: 5px; padding: 8px 12px; background-color: #2196f3; color: white; border-radius: 3px; font-size: 12px; }
+        table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+        th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+        th { background-color: #f2f2f2; font-weight: bold; }
+        tr:hover { background-color: #f5f5f5; }
+        .url-link { max-width: 300px; word-break: break-all; }
+        .timestamp { color: #666; font-size: 12px; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>🎯 Google广告监控报告</h1>
+        <p>报告生成时间: $generated_at</p>
+        <p>数据范围: $date_range</p>
+    </div>
+
+    <div class="summary">
+        <h3>📊 统计摘要</h3>
+        <p><strong>发现的唯一Ref参数数量:</strong> $total_refs 个</p>
+        <p><strong>监控关键词:</strong> bingx, bingx exchange</p>
+        <p><strong>监控国家:</strong> 印度, 德国, 中国台湾, 俄罗斯, 西班牙</p>
+    </div>
+
+    <div class="section">
+        <h2>📋 第一部分：去重后的Ref参数列表</h2>
+        <div class="ref-list">
+''')
+
+_RECENT_FOOTER = '''
+    <div style="margin-top: 30px; padding: 20px; background-color: #f8f9fa; border-radius: 5px; color: #666; font-size: 12px;">
+        <p>💡 说明：</p>
+        <ul>
+            <li>本报告包含最近8天内发现的所有唯一Ref参数</li>
+            <li>每个Ref参数只显示首次发现的记录</li>
+            <li>点击真实链接可直接访问目标网站</li>
+            <li>此邮件由Google广告监控系统自动生成</li>
+        </ul>
+    </div>
+
+</body>
+</html>
+'''
+
+_RECENT_EMPTY = Template('''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #f8f9fa; padding: 20px; border-radius: 5px; }
+        .empty { text-align: center; padding: 40px; color: #666; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>🎯 Google广告监控报告</h1>
+        <p>报告生成时间: $generated_at</p>
+    </div>
+
+    <div class="empty">
+        <h2>📭 暂无数据</h2>
+        <p>最近8天内未发现包含Ref参数的广告数据</p>
+    </div>
+</body>
+</html>
+''')
+
+# 每日报告（过去24小时新发现的ref）
+_DAILY_HEAD = Template('''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }
+        .summary { background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin-bottom: 20px; }
+        .section { margin-bottom: 30px; }
+        .section h2 { color: #28a745; border-bottom: 2px solid #28a745; padding-bottom: 10px; }
+        .ref-list { background-color: #f5f5f5; padding: 15px; border-radius: 5px; }
+        .ref-item { display: inline-block; margin: 5px; padding: 8px 12px; background-color: #28a745; color: white; border-radius: 3px; font-size: 12px; }
+        table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+        th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+        th { background-color: #f2f2f2; font-weight: bold; }
+        tr:hover { background-color: #f5f5f5; }
+        .url-link { max-width: 300px; word-break: break-all; }
+        .timestamp { color: #666; font-size: 12px; }
+        .daily-badge { background-color: #28a745; color: white; padding: 4px 8px; border-radius: 12px; font-size: 12px; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>📅 每日Google广告监控报告</h1>
+        <p>报告日期: <strong>$report_date</strong></p>
+        <p>报告生成时间: $generated_at</p>
+        <p><span class="daily-badge">过去24小时新发现</span></p>
+    </div>
+
+    <div class="summary">
+        <h3>📊 24小时统计摘要</h3>
+        <p><strong>过去24小时新发现的唯一Ref参数数量:</strong> $total_refs 个</p>
+        <p><strong>监控关键词:</strong> bingx, bingx exchange</p>
+        <p><strong>监控国家:</strong> 印度, 德国, 中国台湾, 俄罗斯, 西班牙</p>
+        <p><strong>数据时间范围:</strong> $window_start ~ $window_end</p>
+    </div>
+
+    <div class="section">
+        <h2>📋 第一部分：过去24小时新发现的Ref参数列表</h2>
+        <div class="ref-list">
+''')
+
+_DAILY_FOOTER = '''
+    <div style="margin-top: 30px; padding: 20px; background-color: #e8f5e8; border-radius: 5px; color: #666; font-size: 12px;">
+        <p>💡 每日报告说明：</p>
+        <ul>
+            <li>本报告只包含过去24小时内新发现的唯一Ref参数，无任何遗漏</li>
+            <li>数据时间范围：过去24小时滚动窗口</li>
+            <li>每个Ref参数显示首次发现的记录信息</li>
+            <li>点击"链接"可直接访问目标网站</li>
+            <li>此邮件由Google广告监控系统每日18:00自动生成</li>
+        </ul>
+    </div>
+
+</body>
+</html>
+'''
+
+_DAILY_EMPTY = Template('''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .header { background-color: #f8f9fa; padding: 20px; border-radius: 5px; }
+        .empty { text-align: center; padding: 40px; color: #666; }
+        .daily-badge { background-color: #6c757d; color: white; padding: 4px 8px; border-radius: 12px; font-size: 12px; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>📅 每日Google广告监控报告</h1>
+        <p>报告日期: <strong>$report_date</strong></p>
+        <p>报告生成时间: $generated_at</p>
+        <p><span class="daily-badge">过去24小时新发现</span></p>
+    </div>
+
+    <div class="empty">
+        <h2>📭 过去24小时无新发现</h2>
+        <p>过去24小时内($window_start ~ $window_end)未发现包含Ref参数的新广告数据</p>
+        <p>监控系统正常运行中，将继续监控...</p>
+    </div>
+</body>
+</html>
+''')
+
+
+def _spool():
+    return tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE, mode='w+', encoding='utf-8')
+
+
+def _render_ref_report(out, rows, head, footer, empty, values):
+    """
+    渲染ref报告：遍历一次行数据，ref列表和表格分别写入缓冲，最后按 头部、ref列表、表格、说明 的顺序写出
+
+    Returns:
+        报告中的ref数
+    """
+    with _spool() as ref_list, _spool() as table:
+        total_refs = 0
+        for row in rows:
+            ref_param, keyword, first_discovered, real_url, title, country = row[:6]
+            ref_list.write(_REF_ITEM.render(ref=ref_param))
+            table.write(_TABLE_ROW.render(
+                ref=ref_param,
+                keyword=keyword,
+                discovered=format_discovered_time(first_discovered),
+                url=real_url or '无',
+                title=title or '无标题',
+                country=country_name(country),
+            ))
+            total_refs += 1
+
+        if not total_refs:
+            out.write(empty.render(**values))
+            return 0
+
+        out.write(head.render(total_refs=total_refs, **values))
+        ref_list.seek(0)
+        shutil.copyfileobj(ref_list, out)
+        out.write(_TABLE_START.render())
+        table.seek(0)
+        shutil.copyfileobj(table, out)
+        out.write(_TABLE_END)
+        out.write(footer)
+        return total_refs
+
+
+def _render(render, out, *args):
+    """out 为None时渲染为字符串返回，否则写入 out 并返回ref数"""
+    if out is not None:
+        return render(out, *args)
+    buffer = io.StringIO()
+    render(buffer, *args)
+    return buffer.getvalue()
+
+
+def render_recent_report(rows, out=None, now=None):
+    """
+    渲染最近8天的ref报告（周报、测试邮件）
+
+    Args:
+        rows: (ref, 关键词, 首次发现时间, 真实链接, 标题, 国家, ...) 行的可迭代对象，可以是数据库游标
+        out: 写入的文本文件对象，为None时返回HTML字符串
+        now: 报告生成时间，默认当前时间
+    """
+    now = now or datetime.now()
+    values = {
+        'generated_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'date_range': f"{now.strftime('%Y-%m-%d')} (最近8天)",
+    }
+    return _render(
+        _render_ref_report, out, rows, _RECENT_HEAD, _RECENT_FOOTER, _RECENT_EMPTY, values
+    )
+
+
+def render_daily_report(rows, report_date, out=None, now=None):
+    """
+    渲染每日报告（过去24小时新发现的ref）
+
+    Args:
+        rows: 同 render_recent_report
+        report_date: 报告日期 YYYY-MM-DD
+        out: 写入的文本文件对象，为None时返回HTML字符串
+        now: 报告生成时间，默认当前时间
+    """
+    now = now or datetime.now()
+    values = {
+        'report_date': report_date,
+        'generated_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'window_start': (now - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M'),
+        'window_end': now.strftime('%Y-%m-%d %H:%M'),
+    }
+    return _render(
+        _render_ref_report, out, rows, _DAILY_HEAD, _DAILY_FOOTER, _DAILY_EMPTY, values
+    )
@@ -1,11 +1,33 @@
 import requests
 import time
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+import config
 from config import *
 from database import AdDatabase
 from ad_extractor import GoogleAdExtractor
+from rate_limiter import RateLimiter
+from redirect_cache import RedirectCache, REDIRECT_CACHE_ENABLED
+from html_storage import get_html_storage
+from change_detection import CHANGE_DETECTION, ad_fingerprint, serp_fingerprint
+
+# 批量抓取并发配置（config.py 中未定义时使用默认值）
+BATCH_MAX_WORKERS = getattr(config, 'BATCH_MAX_WORKERS', 4)
+# 每个令牌桶每秒允许的请求数，0.5 即每 2 秒一次，与原来的固定等待一致
+BATCH_RATE_LIMIT = getattr(config, 'BATCH_RATE_LIMIT', 0.5)
+BATCH_RATE_BURST = getattr(config, 'BATCH_RATE_BURST', 1)
+# 'country': 每个国家单独限速；'global': 所有请求共用一个限速器
+BATCH_RATE_SCOPE = getattr(config, 'BATCH_RATE_SCOPE', 'country')
+
+# 是否在每批抓取结束时更新广告可见度汇总表（按小时/天/周统计每个ref的出现次数和平均位置）
+VISIBILITY_ROLLUPS = getattr(config, 'VISIBILITY_ROLLUPS', True)
+
+# Bright Data API 地址，测试时可指向本地桩服务 (scripts/stub_serp_server.py)
+BRIGHTDATA_API_URL = getattr(config, 'BRIGHTDATA_API_URL', 'https://api.brightdata.com/request')
 
 
 class GoogleSERPScraper:
@@ -15,65 +37,175 @@ class GoogleSERPScraper:
         self.api_key = API_KEY
         self.zone = ZONE
         self.db = AdDatabase()
-        self.ad_extractor = GoogleAdExtractor()
+        self.redirect_cache = RedirectCache(self.db.db_path) if REDIRECT_CACHE_ENABLED else None
+        self.ad_extractor = GoogleAdExtractor(redirect_cache=self.redirect_cache)
         self.session = requests.Session()
         
-        # 确保HTML目录存在
-        os.makedirs(HTML_DIR, exist_ok=True)
+        # 连接池大小与最大并发数匹配，避免并发请求时反复建连
+        adapter = HTTPAdapter(pool_maxsize=max(BATCH_MAX_WORKERS, 1))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # HTML存储后端（默认压缩存档，见 html_storage.py）
+        self.html_storage = get_html_storage()
+        
+        # 本批抓取中各SERP的广告出现情况，批量结束时写入可见度汇总表
+        self._visibility_observations = []
+        self._visibility_lock = threading.Lock()
     
-    def scrape_keyword_country(self, keyword, country_code):
-        """抓取特定关键词在特定国家的SERP数据"""
-        print(f"开始抓取关键词 '{keyword}' 在 {country_code} 的数据...")
+    def scrape_keyword_country(self, keyword, country_code, log=print):
+        """
+        抓取特定关键词在特定国家的SERP数据
+        
+        Args:
+            log: 输出进度信息的函数，默认直接打印；并发批量抓取时传入任务自己的缓冲区，
+                 任务结束后整段输出，不同组合的输出不会交错
+        """
+        log(f"开始抓取关键词 '{keyword}' 在 {country_code} 的数据...")
         
         scrape_time = datetime.now()
         
         try:
             # 获取SERP数据
-            html_content = self._fetch_serp_data(keyword, country_code)
-            
-            if not html_content:
-                self.db.insert_scrape_log(
-                    keyword, country_code, "failed", 
-                    error_message="无法获取SERP数据"
-                )
-                return False
+            html_content = self._fetch_serp_data(keyword, country_code, log=log)
             
-            # 保存HTML文件
-            html_file_path = self._save_html_file(
-                html_content, keyword, country_code, scrape_time
+            return self._process_serp_html(
+                keyword, country_code, html_content, scrape_time, log=log
             )
-            
-            # 提取广告数据
-            ads_data = self.ad_extractor.extract_ads(html_content)
-            
-            # 保存广告数据到数据库
-            ads_saved = 0
-            for ad_data in ads_data:
-                if self.db.insert_ad_data(
-                    keyword, country_code, ad_data, scrape_time, html_file_path
-                ):
-                    ads_saved += 1
-            
-            # 记录抓取日志
-            self.db.insert_scrape_log(
-                keyword, country_code, "success", ads_found=ads_saved
-            )
-            
-            print(f"✅ 成功抓取 {ads_saved} 个广告")
-            return True
-            
+        
         except Exception as e:
-            error_msg = f"抓取失败: {str(e)}"
-            print(f"❌ {error_msg}")
+            self._record_scrape_failure(keyword, country_code, e, log=log)
+            return False
+    
+    def _process_serp_html(self, keyword, country_code, html_content, scrape_time, log=print):
+        """保存SERP页面、提取广告并写入数据库（同步与异步抓取共用），log 同 scrape_keyword_country()"""
+        if not html_content:
             self.db.insert_scrape_log(
-                keyword, country_code, "failed", error_message=error_msg
+                keyword, country_code, "failed", 
+                error_message="无法获取SERP数据"
             )
             return False
+        
+        # 保存HTML文件
+        html_file_path = self._save_html_file(
+            html_content, keyword, country_code, scrape_time, log=log
+        )
+        
+        # 提取广告数据（开启变化检测时先不解析跳转，只解析新增或变化的广告）
+        extract_stats = {}
+        ads_data = self.ad_extractor.extract_ads(
+            html_content, get_real_urls=False, stats=extract_stats
+        )
+        self._print_extract_stats(extract_stats, log=log)
+        
+        page_ads = ads_data
+        known = set()
+        page_fingerprint = None
+        if CHANGE_DETECTION:
+            ads_data, known = self._filter_unchanged_ads(keyword, country_code, page_ads, log=log)
+            page_fingerprint = serp_fingerprint([ad['fingerprint'] for ad in page_ads])
+        self.ad_extractor.resolve_real_urls(ads_data, log=log)
+        unchanged = len(page_ads) - len(ads_data)
+        
+        # 保存广告数据到数据库：同一页面的广告、未变化广告的指纹更新和SERP指纹在一个事务中写入，
+        # 写入失败时抛出异常、整体回滚（记为抓取失败），下次抓取不会误判为未变化
+        ads_saved = self.db.insert_ads_batch(
+            keyword, country_code, ads_data, scrape_time, html_file_path,
+            unchanged_fingerprints=known, page_fingerprint=page_fingerprint,
+            page_ad_count=len(page_ads)
+        )
+        
+        # 记录抓取日志
+        self.db.insert_scrape_log(
+            keyword, country_code, "success", ads_found=ads_saved + unchanged
+        )
+        
+        if VISIBILITY_ROLLUPS:
+            self._record_visibility(keyword, country_code, scrape_time, page_ads)
+        
+        if unchanged:
+            log(f"✅ 成功抓取 {ads_saved + unchanged} 个广告（新增或变化 {ads_saved} 个，未变化 {unchanged} 个）")
+        else:
+            log(f"✅ 成功抓取 {ads_saved} 个广告")
+        return True
     
-    def _fetch_serp_data(self, keyword, country_code):
-        """使用Bright Data API获取SERP数据"""
-        url = "https://api.brightdata.com/request"
+    def _filter_unchanged_ads(self, keyword, country_code, ads_data, log=print):
+        """
+        按广告指纹过滤出该关键词/国家下已出现过的广告
+        
+        未变化的广告不解析跳转、不插入新行，写入时只更新指纹表的最近出现时间和次数；
+        新增或变化的广告带上指纹返回，插入时一并登记
+        
+        Returns:
+            (需要解析并插入的广告列表, 未变化的广告指纹集合)
+        """
+        for ad in ads_data:
+            ad['fingerprint'] = ad_fingerprint(ad)
+        fingerprints = [ad['fingerprint'] for ad in ads_data]
         
+        # SERP指纹与上次相同时，所有广告都已登记过，不必逐个查询
+        page_fingerprint = serp_fingerprint(fingerprints)
+        if ads_data and self.db.get_serp_fingerprint(keyword, country_code) == page_fingerprint:
+            known = set(fingerprints)
+            log(f"  🔁 SERP广告与上次抓取相同，跳过 {len(ads_data)} 个广告的跳转解析")
+        else:
+            known = self.db.get_known_ad_fingerprints(keyword, country_code, fingerprints)
+            if known:
+                log(f"  🔁 {len(known)} 个广告未变化，跳过跳转解析")
+        
+        if VISIBILITY_ROLLUPS and known:
+            # 未变化的广告不解析跳转，可见度统计使用其首次插入记录中的ref
+            refs = self.db.get_ad_fingerprint_refs(keyword, country_code, known)
+            for ad in ads_data:
+                if ad['fingerprint'] in known:
+                    ad['ref_parameter'] = refs.get(ad['fingerprint'], '')
+        
+        return [ad for ad in ads_data if ad['fingerprint'] not in known], known
+    
+    def _record_visibility(self, keyword, country_code, scrape_time, ads_data):
+        """记录本次SERP中广告的出现情况（ref和位置），批量抓取结束时统一写入可见度汇总表"""
+        observation = (
+            keyword, country_code, scrape_time,
+            [(ad.get('ref_parameter'), ad.get('position', 0)) for ad in ads_data]
+        )
+        with self._visibility_lock:
+            self._visibility_observations.append(observation)
+    
+    def flush_visibility_rollups(self):
+        """将本批累积的广告出现情况写入可见度汇总表（每批抓取结束时调用）"""
+        with self._visibility_lock:
+            observations, self._visibility_observations = self._visibility_observations, []
+        
+        if not observations:
+            return
+        
+        try:
+            buckets = self.db.update_visibility_rollups(observations)
+            print(f"📈 可见度汇总已更新: {len(observations)} 个SERP，{buckets} 个时间桶")
+        except Exception as e:
+            print(f"⚠️ 更新可见度汇总失败: {str(e)}")
+    
+    def _print_extract_stats(self, stats, log=print):
+        """输出单个页面的广告提取用时、解析的HTML大小和内存峰值"""
+        message = (
+            f"  ⏱️ 广告提取用时 {stats['extract_ms']:.1f} ms，"
+            f"解析 {stats['parsed_size'] / 1024:.0f}/{stats['html_size'] / 1024:.0f} KB"
+            f"（{'广告区域' if stats['sliced'] else '完整页面'}）"
+        )
+        if 'peak_memory' in stats:
+            message += f"，内存峰值 {stats['peak_memory'] / 1024 / 1024:.1f} MB"
+        log(message)
+    
+    def _record_scrape_failure(self, keyword, country_code, error, log=print):
+        """记录抓取失败日志"""
+        error_msg = f"抓取失败: {str(error)}"
+        log(f"❌ {error_msg}")
+        self.db.insert_scrape_log(
+            keyword, country_code, "failed", error_message=error_msg
+        )
+    
+    def _build_serp_request(self, keyword, country_code):
+        """构建Bright Data API请求的URL、请求体和请求头"""
         search_url = f"https://www.google.com/search?q={quote(keyword)}"
         
         payload = {
@@ -90,10 +222,16 @@ class GoogleSERPScraper:
             "Content-Type": "application/json"
         }
         
+        return BRIGHTDATA_API_URL, payload, headers
+    
+    def _fetch_serp_data(self, keyword, country_code, log=print):
+        """使用Bright Data API获取SERP数据"""
+        url, payload, headers = self._build_serp_request(keyword, country_code)
+        
         # 重试机制
         for attempt in range(MAX_RETRIES):
             try:
-                print(f"  发送API请求 (尝试 {attempt + 1}/{MAX_RETRIES})...")
+                log(f"  发送API请求 (尝试 {attempt + 1}/{MAX_RETRIES})...")
                 
                 response = self.session.post(
                     url, 
@@ -109,21 +247,21 @@ class GoogleSERPScraper:
                     html_content = self._extract_html_from_response(result)
                     
                     if html_content:
-                        print(f"  ✅ API请求成功，获得HTML内容 ({len(html_content)} 字符)")
+                        log(f"  ✅ API请求成功，获得HTML内容 ({len(html_content)} 字符)")
                         return html_content
                     else:
-                        print(f"  ⚠️ API响应中未找到HTML内容")
+                        log(f"  ⚠️ API响应中未找到HTML内容")
                         
                 else:
-                    print(f"  ❌ API请求失败: HTTP {response.status_code}")
-                    print(f"  响应内容: {response.text[:500]}")
+                    log(f"  ❌ API请求失败: HTTP {response.status_code}")
+                    log(f"  响应内容: {response.text[:500]}")
                 
             except requests.exceptions.RequestException as e:
-                print(f"  ❌ 请求异常: {str(e)}")
+                log(f"  ❌ 请求异常: {str(e)}")
             
             # 如果不是最后一次尝试，等待一段时间后重试
             if attempt < MAX_RETRIES - 1:
-                print(f"  等待 5 秒后重试...")
+                log(f"  等待 5 秒后重试...")
                 time.sleep(5)
         
         return None
@@ -158,52 +296,74 @@ class GoogleSERPScraper:
         
         return None
     
-    def _save_html_file(self, html_content, keyword, country_code, scrape_time):
-        """保存HTML文件"""
-        # 创建文件名，使用时间戳避免冲突
-        timestamp = scrape_time.strftime("%Y%m%d_%H%M%S")
-        safe_keyword = "".join(c for c in keyword if c.isalnum() or c in (' ', '-', '_')).strip()
-        safe_keyword = safe_keyword.replace(' ', '_')
-        
-        filename = f"{timestamp}_{country_code}_{safe_keyword}.html"
-        file_path = os.path.join(HTML_DIR, filename)
-        
+    def _save_html_file(self, html_content, keyword, country_code, scrape_time, log=print):
+        """保存HTML，返回存储引用（存档引用或文件路径）"""
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            print(f"  💾 HTML文件已保存: {filename}")
-            return file_path
+            html_ref = self.html_storage.save(html_content, keyword, country_code, scrape_time)
+            log(f"  💾 HTML已保存: {os.path.basename(html_ref)}")
+            return html_ref
         except Exception as e:
-            print(f"  ⚠️ 保存HTML文件失败: {str(e)}")
+            log(f"  ⚠️ 保存HTML失败: {str(e)}")
             return None
     
-    def scrape_all_combinations(self):
-        """抓取所有关键词和国家的组合"""
-        total_combinations = len(KEYWORDS_LIST) * len(COUNTRY_LIST)
-        current = 0
+    def scrape_all_combinations(self, max_workers=None):
+        """
+        抓取所有关键词和国家的组合
+        
+        Args:
+            max_workers: 同时进行的最大抓取数，默认使用 BATCH_MAX_WORKERS
+        """
+        if max_workers is None:
+            max_workers = BATCH_MAX_WORKERS
+        max_workers = max(int(max_workers), 1)
+        
+        combinations = [
+            (keyword, country_code)
+            for keyword in KEYWORDS_LIST
+            for country_code in COUNTRY_LIST
+        ]
+        total_combinations = len(combinations)
         successful = 0
         
         print(f"🚀 开始批量抓取，共 {total_combinations} 个组合")
         print(f"关键词数量: {len(KEYWORDS_LIST)}")
         print(f"国家数量: {len(COUNTRY_LIST)}")
+        print(f"最大并发数: {max_workers}")
+        print(f"限速: 每秒 {BATCH_RATE_LIMIT} 次 (作用域: {BATCH_RATE_SCOPE})")
         print("-" * 60)
         
         start_time = datetime.now()
         
-        for keyword in KEYWORDS_LIST:
-            for country_code in COUNTRY_LIST:
-                current += 1
-                
-                print(f"\n[{current}/{total_combinations}] ", end="")
-                
-                success = self.scrape_keyword_country(keyword, country_code)
+        if self.redirect_cache:
+            self.redirect_cache.reset_stats()
+        
+        # 用令牌桶限速替代请求之间固定的 2 秒等待
+        rate_limiter = RateLimiter(BATCH_RATE_LIMIT, BATCH_RATE_BURST, BATCH_RATE_SCOPE)
+        
+        # 每个组合的输出先写入任务自己的列表，由下面的汇总循环整段打印，并发时不同组合的输出不会交错
+        def scrape_task(keyword, country_code):
+            rate_limiter.acquire(country_code)
+            lines = []
+            return self.scrape_keyword_country(keyword, country_code, log=lines.append), lines
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(scrape_task, keyword, country_code)
+                for keyword, country_code in combinations
+            ]
+            
+            # 按提交顺序汇总每个组合的结果和输出
+            for index, future in enumerate(futures, 1):
+                try:
+                    success, lines = future.result()
+                except Exception as e:
+                    print(f"\n[{index}/{total_combinations}] ❌ 抓取任务异常: {str(e)}")
+                    continue
+                print(f"\n[{index}/{total_combinations}] " + "\n".join(lines))
                 if success:
                     successful += 1
-                
-                # 在请求之间添加延迟，避免被限制
-                if current < total_combinations:
-                    print(f"  ⏳ 等待 2 秒...")
-                    time.sleep(2)
+        
+        self.flush_visibility_rollups()
         
         end_time = datetime.now()
         duration = end_time - start_time
@@ -211,7 +371,8 @@ class GoogleSERPScraper:
         print("\n" + "=" * 60)
         print(f"🎉 批量抓取完成!")
         print(f"总用时: {duration}")
-        print(f"成功率: {successful}/{total_combinations} ({successful/total_combinations*100:.1f}%)")
+        print(f"成功率: {successful}/{total_combinations} ({successful/max(total_combinations, 1)*100:.1f}%)")
+        self.show_redirect_cache_stats()
         
         # 显示统计信息
         self.show_stats()
@@ -224,6 +385,7 @@ class GoogleSERPScraper:
         print("-" * 40)
         
         success = self.scrape_keyword_country(keyword, country_code)
+        self.flush_visibility_rollups()
         
         if success:
             print(f"✅ 抓取完成")
@@ -232,6 +394,14 @@ class GoogleSERPScraper:
         
         self.show_stats()
     
+    def show_redirect_cache_stats(self):
+        """显示本次批量抓取的跳转缓存命中情况"""
+        if not self.redirect_cache:
+            return
+        
+        cache_stats = self.redirect_cache.get_stats()
+        print(f"跳转缓存: 命中 {cache_stats['hits']} 次, 未命中 {cache_stats['misses']} 次 (命中率 {cache_stats['hit_rate']:.1f}%)")
+    
     def show_stats(self):
         """显示抓取统计信息"""
         stats = self.db.get_scrape_stats()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+报表查询基准测试
+在临时数据库中生成模拟广告数据，检查日报/周报和 ref_stats 使用的ref登记表查询的执行计划（EXPLAIN QUERY PLAN），
+确认它们走索引而不是全表扫描，并输出查询耗时
+
+用法:
+    python scripts/bench_report_queries.py --rows 200000 --compare
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 添加父目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import AdDatabase
+
+# 被检查的报表查询：日报/周报和 ref_stats 都通过 AdDatabase 查询ref登记表
+REPORT_QUERIES = {
+    'AdDatabase.get_new_refs': AdDatabase._NEW_REFS_SQL,
+    'AdDatabase.get_active_refs': AdDatabase._ACTIVE_REFS_SQL,
+}
+
+# 改用ref登记表之前报表对 ads_data 做的聚合查询，仅用于 --compare 对比耗时
+LEGACY_REPORT_QUERY = '''
+    SELECT
+        ref_parameter,
+        keyword,
+        MIN(scrape_time) as first_discovered,
+        real_target_url,
+        ad_title,
+        country_code,
+        COUNT(*) as occurrence_count
+    FROM ads_data
+    WHERE scrape_time >= ? AND scrape_time <= ?
+    AND ref_parameter IS NOT NULL
+    AND ref_parameter != ''
+    GROUP BY ref_parameter
+    ORDER BY first_discovered DESC
+'''
+
+# 基准测试中按 8 天窗口查询
+REPORT_WINDOW_DAYS = 8
+
+
+def populate(db, rows, days):
+    """按每小时一次批量抓取的节奏生成模拟广告数据"""
+    keywords = ['bingx', 'bingx exchange', 'bingx app', 'bingx futures']
+    countries = ['in', 'de', 'tw', 'ru', 'es', 'fr', 'us', 'jp']
+    refs = [f"REF{i:04d}" for i in range(300)]
+
+    start = datetime.now() - timedelta(days=days)
+    scrapes = max(rows // 4, 1)
+    step = timedelta(days=days) / scrapes
+
+    inserted = 0
+    for i in range(scrapes):
+        scrape_time = start + step * i
+        keyword = random.choice(keywords)
+        country = random.choice(countries)
+        ads = []
+        for position in range(1, 5):
+            ref = random.choice(refs) if random.random() < 0.7 else ''
+            ads.append({
+                'ad_url': f"https://www.googleadservices.com/pagead/aclk?ai={i}-{position}",
+                'real_target_url': f"https://bingx.com/en/?ref={ref}" if ref else '',
+                'ref_parameter': ref,
+                'title': f"Ad {position} for {keyword}",
+                'description': 'Synthetic benchmark ad description',
+                'position': position,
+            })
+        inserted += db.insert_ads_batch(keyword, country, ads, scrape_time, None)
+
+    with db._lock:
+        db._get_connection().execute('ANALYZE')
+
+    return inserted
+
+
+def explain(conn, sql, params):
+    """返回查询计划的描述列表"""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def is_full_scan(plan):
+    """执行计划中出现对任何表的 SCAN 即视为全表（或全索引）扫描"""
+    return any(
+        detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT')
+        for detail in plan
+    )
+
+
+def time_query(conn, sql, params, repeat=5):
+    """返回多次执行中最快的一次耗时（毫秒）"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='报表查询执行计划与耗时基准测试')
+    parser.add_argument('--rows', type=int, default=200000, help='生成的广告数据行数')
+    parser.add_argument('--days', type=int, default=60, help='模拟数据覆盖的天数')
+    parser.add_argument('--compare', action='store_true', help='同时测试旧的 ads_data 聚合查询耗时作为对比')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = AdDatabase(db_path=os.path.join(tmp_dir, 'bench.db'))
+
+        print(f"📦 生成 {args.rows} 行模拟数据（{args.days} 天）...")
+        started = time.perf_counter()
+        inserted = populate(db, args.rows, args.days)
+        print(f"   插入 {inserted} 行，用时 {time.perf_counter() - started:.1f} 秒")
+
+        now = datetime.now()
+        params = (now - timedelta(days=REPORT_WINDOW_DAYS), now)
+        conn = db._get_connection()
+
+        full_scans = []
+        timings = {}
+        for name, sql in REPORT_QUERIES.items():
+            plan = explain(conn, sql, params)
+            timings[name] = time_query(conn, sql, params)
+
+            print(f"\n🔍 {name}")
+            for detail in plan:
+                print(f"   {detail}")
+            print(f"   耗时: {timings[name]:.2f} ms")
+
+            if is_full_scan(plan):
+                full_scans.append(name)
+
+        if args.compare:
+            elapsed = time_query(conn, LEGACY_REPORT_QUERY, params)
+            active = timings['AdDatabase.get_active_refs']
+            print("\n📉 与旧的 ads_data 聚合查询对比:")
+            print(f"   GROUP BY ref_parameter: {elapsed:.2f} ms (登记表 {active:.2f} ms, {elapsed / max(active, 0.001):.1f}x)")
+
+        db.close()
+
+    if full_scans:
+        print(f"\n❌ 以下查询仍在全表扫描: {', '.join(full_scans)}")
+        sys.exit(1)
+
+    print("\n✅ 所有报表查询均使用索引")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+HTML存档迁移工具
+将 HTML_DIR 中旧的未压缩 .html 文件导入压缩存档数据库（按内容哈希去重），
+并把 ads_data.html_file_path 中的文件路径替换为存档引用
+
+用法:
+    python scripts/migrate_html_archive.py --dry-run
+    python scripts/migrate_html_archive.py --delete
+"""
+
+import argparse
+import os
+import sys
+
+# 添加父目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import HTML_DIR
+from database import AdDatabase
+from html_storage import SQLiteHTMLStorage, is_archive_ref
+
+
+def format_size(size):
+    """格式化字节数"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='将HTML文件目录迁移到压缩存档数据库')
+    parser.add_argument('--html-dir', default=HTML_DIR, help='旧HTML文件目录')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不写入存档也不修改数据库')
+    parser.add_argument('--delete', action='store_true', help='迁移成功后删除原HTML文件')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.html_dir):
+        print(f"❌ {args.html_dir} 目录不存在")
+        return
+
+    html_files = sorted(f for f in os.listdir(args.html_dir) if f.endswith('.html'))
+    print(f"🚀 发现 {len(html_files)} 个HTML文件: {args.html_dir}")
+
+    db = AdDatabase()
+
+    # ads_data 中保存的旧路径可能是相对路径或绝对路径，按文件名对应
+    paths_by_name = {}
+    for ref in db.get_html_references():
+        if not is_archive_ref(ref):
+            paths_by_name.setdefault(os.path.basename(ref), []).append(ref)
+
+    linked = sum(1 for name in html_files if name in paths_by_name)
+    print(f"   其中 {linked} 个文件被 ads_data 引用")
+
+    if args.dry_run:
+        total_size = sum(os.path.getsize(os.path.join(args.html_dir, name)) for name in html_files)
+        print(f"   原始大小: {format_size(total_size)}")
+        print("🔍 dry-run 模式，未做任何修改")
+        db.close()
+        return
+
+    archive = SQLiteHTMLStorage()
+    mapping = {}
+    migrated = []
+    failed = 0
+
+    for index, name in enumerate(html_files, 1):
+        file_path = os.path.join(args.html_dir, name)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                html_content = f.read()
+            archive_ref = archive.save(html_content)
+        except Exception as e:
+            print(f"  ⚠️ 迁移 {name} 失败: {e}")
+            failed += 1
+            continue
+
+        for old_ref in paths_by_name.get(name, []):
+            mapping[old_ref] = archive_ref
+        migrated.append(file_path)
+
+        if index % 500 == 0:
+            print(f"   已导入 {index}/{len(html_files)}")
+
+    updated = db.update_html_references(mapping)
+
+    if args.delete:
+        for file_path in migrated:
+            os.remove(file_path)
+        print(f"🗑️ 已删除 {len(migrated)} 个原HTML文件")
+
+    stats = archive.get_stats()
+    archive.close()
+    db.close()
+
+    print("\n" + "=" * 60)
+    print(f"🎉 迁移完成: 导入 {len(migrated)} 个文件，失败 {failed} 个，更新 {updated} 行 ads_data")
+    print(f"   存档: {archive.archive_path}")
+    print(f"   去重后页面数: {stats['pages']}")
+    print(f"   原始大小: {format_size(stats['raw_size'])}，压缩后: {format_size(stats['compressed_size'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,26 +6,20 @@ Ref参数统计脚本
 
 import sys
 import os
-import sqlite3
 from datetime import datetime, timedelta
 
 # 添加父目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import DATABASE_NAME
+from database import AdDatabase
 from logger import project_logger
 
 class RefStatsAnalyzer:
     """Ref参数统计分析器"""
     
     def __init__(self):
-        # 将相对路径转换为绝对路径，确保无论从哪个目录运行都能找到数据库
-        if os.path.isabs(DATABASE_NAME):
-            self.db_path = DATABASE_NAME
-        else:
-            # 基于项目根目录计算数据库绝对路径
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            self.db_path = os.path.join(project_root, DATABASE_NAME)
+        # 与抓取程序使用同一个数据库和连接配置
+        self.db = AdDatabase()
         
         self.logger = project_logger.get_logger('ref_stats', 'ref_stats.log')
     
@@ -34,7 +28,7 @@ class RefStatsAnalyzer:
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         today_end = datetime.now()
         
-        return self._get_refs_by_date_range(today_start, today_end, "今日")
+        return self._get_refs_by_date_range(today_start, today_end, "今日", new_only=True)
     
     def get_past_8_days_refs(self):
         """获取过去8天的ref参数（8天前到现在）"""
@@ -50,31 +44,24 @@ class RefStatsAnalyzer:
         
         return self._get_refs_by_date_range(twenty_four_hours_ago, now, "过去24小时")
     
-    def _get_refs_by_date_range(self, start_date, end_date, period_name):
-        """根据日期范围获取ref参数统计"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _get_refs_by_date_range(self, start_date, end_date, period_name, new_only=False):
+        """
+        根据日期范围获取ref参数统计（查询ref登记表）
         
+        Args:
+            new_only: 为True时只统计在该范围内首次出现的ref，否则统计范围内出现过的ref
+        """
         try:
-            # 查询指定时间范围内的唯一ref参数，按首次发现时间排序
-            cursor.execute('''
-                SELECT 
-                    ref_parameter,
-                    keyword,
-                    MIN(scrape_time) as first_discovered,
-                    real_target_url,
-                    ad_title,
-                    country_code,
-                    COUNT(*) as occurrence_count
-                FROM ads_data 
-                WHERE scrape_time >= ? AND scrape_time <= ?
-                AND ref_parameter IS NOT NULL 
-                AND ref_parameter != ''
-                GROUP BY ref_parameter
-                ORDER BY first_discovered DESC
-            ''', (start_date, end_date))
+            if new_only:
+                rows = self.db.get_new_refs(start_date, end_date)
+            else:
+                rows = self.db.get_active_refs(start_date, end_date)
             
-            results = cursor.fetchall()
+            # 每行: ref, 关键词, 首次发现时间, 真实链接, 标题, 首次发现国家, 累计出现次数, 出现过的国家
+            results = [
+                (ref, keyword, first_seen, real_url, title, country, count, countries)
+                for ref, keyword, first_seen, real_url, title, country, _, _, count, countries in rows
+            ]
             
             # 构建统计信息
             stats = {
@@ -90,8 +77,6 @@ class RefStatsAnalyzer:
         except Exception as e:
             self.logger.error(f"查询{period_name}数据失败: {str(e)}")
             return None
-        finally:
-            conn.close()
     
     def format_country_name(self, code):
         """格式化国家名称"""
@@ -135,7 +120,7 @@ class RefStatsAnalyzer:
         print(f"\n📋 {period}发现的所有Ref参数:")
         print("-"*60)
         
-        for i, (ref_param, keyword, first_discovered, real_url, title, country, count) in enumerate(stats['refs_data'], 1):
+        for i, (ref_param, keyword, first_discovered, real_url, title, country, count, countries) in enumerate(stats['refs_data'], 1):
             # 格式化时间
             try:
                 discovered_time = datetime.fromisoformat(first_discovered.replace('Z', '+00:00'))
@@ -150,8 +135,10 @@ class RefStatsAnalyzer:
             print(f"     关键词: {keyword}")
             print(f"     首次发现: {time_str}")
             print(f"     国家: {country_name}")
+            if countries:
+                print(f"     出现国家: {', '.join(self.format_country_name(c) for c in countries.split(','))}")
             print(f"     标题: {title}")
-            print(f"     出现次数: {count}")
+            print(f"     累计出现次数: {count}")
             if real_url:
                 print(f"     链接: {real_url}")
             print()
@@ -181,7 +168,7 @@ class RefStatsAnalyzer:
                 f.write(f"# 唯一Ref参数数量: {stats['total_unique_refs']} 个\n")
                 f.write(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
                 
-                for ref_param, _, _, _, _, _, _ in stats['refs_data']:
+                for ref_param, *_ in stats['refs_data']:
                     f.write(f"{ref_param}\n")
             
             print(f"✅ {stats['period']}的Ref参数已导出到: {filename}")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+本地 Bright Data API 桩服务
+模拟 /request 接口返回包含广告的 Google SERP 页面，并模拟广告点击链接的跳转，
+用于在不消耗真实 API 额度的情况下测试同步/异步批量抓取
+
+用法:
+    python scripts/stub_serp_server.py --port 8800
+然后在 config.py 中设置:
+    BRIGHTDATA_API_URL = 'http://127.0.0.1:8800/request'
+"""
+
+import argparse
+import json
+import random
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+
+class StubSERPServer(ThreadingHTTPServer):
+    """允许大量排队连接的多线程HTTP服务"""
+
+    request_queue_size = 256
+
+
+class StubSERPHandler(BaseHTTPRequestHandler):
+    """桩服务请求处理器"""
+
+    # 由 main() 根据命令行参数设置
+    html_template = None
+    delay = 0.0
+    fail_rate = 0.0
+    ads_per_page = 4
+    redirect_delay = 0.0
+
+    def log_message(self, format, *args):
+        # 大量并发请求时不输出访问日志
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        """模拟 Bright Data /request 接口"""
+        if urlparse(self.path).path != '/request':
+            self._send(404, json.dumps({'error': 'not found'}))
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send(400, json.dumps({'error': 'invalid json'}))
+            return
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        if random.random() < self.fail_rate:
+            self._send(503, json.dumps({'error': 'stub failure'}))
+            return
+
+        search_url = payload.get('url', '')
+        keyword = parse_qs(urlparse(search_url).query).get('q', [''])[0]
+        country = payload.get('country', '')
+
+        self._send(200, json.dumps({'html': self._render_serp(keyword, country)}))
+
+    def do_GET(self):
+        """模拟广告点击链接跳转和落地页"""
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+
+        if parsed.path == '/aclk':
+            if self.redirect_delay:
+                time.sleep(self.redirect_delay)
+            ad_id = params.get('ad', ['0'])[0]
+            location = f"http://{self.headers.get('Host')}/landing?ref=STUB{ad_id}&ch=stub&utm_campaign=camp{ad_id}"
+            self._send(302, '', 'text/plain', {'Location': location})
+        elif parsed.path == '/landing':
+            self._send(200, '<html><body>landing</body></html>', 'text/html')
+        else:
+            self._send(404, 'not found', 'text/plain')
+
+    def _render_serp(self, keyword, country):
+        """生成包含 data-rw 广告链接的SERP页面"""
+        if self.html_template is not None:
+            return self.html_template
+
+        host = self.headers.get('Host')
+        ads = []
+        for i in range(1, self.ads_per_page + 1):
+            ad_url = (
+                f"http://{host}/aclk?sa=L&ai=AI{random.randint(0, 10**9)}"
+                f"&sig=SIG{random.randint(0, 10**9)}&gclid=G{random.randint(0, 10**9)}"
+                f"&ad={i}&q={quote(keyword)}&adurl="
+            )
+            ads.append(f'''
+      <div class="uEierd"><div><div class="v5yQqb">
+        <a data-rw="{escape(ad_url)}" href="{escape(ad_url)}">
+          <div role="heading" aria-level="3"><span>Stub Ad {i} - {escape(keyword)} ({country})</span></div>
+        </a>
+        <div class="VwiC3b">Stub description number {i} for {escape(keyword)} in {country}.</div>
+      </div></div></div>''')
+
+        return f'''<!DOCTYPE html>
+<html><head><title>{escape(keyword)} - Google Search</title>
+<style>body {{ font-family: arial; }}</style>
+<script>var padding = "{'x' * 2000}";</script>
+</head>
+<body><div id="tads">{''.join(ads)}
+</div><div id="search"><div class="g"><a href="https://example.com/"><h3>Organic result</h3></a></div></div></body></html>'''
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='Bright Data SERP API 本地桩服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8800, help='监听端口')
+    parser.add_argument('--html-file', help='固定返回的SERP HTML文件（默认生成模拟页面）')
+    parser.add_argument('--delay', type=float, default=0.0, help='每个API请求的模拟延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='API请求返回503的概率，用于测试重试')
+    parser.add_argument('--ads', type=int, default=4, help='模拟页面中的广告数量')
+    parser.add_argument('--redirect-delay', type=float, default=0.0, help='广告点击链接跳转的模拟延迟（秒）')
+    args = parser.parse_args()
+
+    if args.html_file:
+        with open(args.html_file, 'r', encoding='utf-8') as f:
+            StubSERPHandler.html_template = f.read()
+    StubSERPHandler.delay = args.delay
+    StubSERPHandler.fail_rate = args.fail_rate
+    StubSERPHandler.ads_per_page = args.ads
+    StubSERPHandler.redirect_delay = args.redirect_delay
+
+    server = StubSERPServer((args.host, args.port), StubSERPHandler)
+    print(f"🧪 SERP桩服务已启动: http://{args.host}:{args.port}/request")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
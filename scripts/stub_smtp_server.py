@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+本地SMTP桩服务
+接收邮件并打印摘要（可选保存为 .eml 文件），支持 AUTH LOGIN/PLAIN（接受任意账号），
+不支持 STARTTLS，用于在不连接真实邮箱的情况下测试邮件发送
+
+用法:
+    python scripts/stub_smtp_server.py --port 8025 --save-dir /tmp/mails
+然后在 config.py 的 EMAIL_CONFIG 中设置:
+    'smtp_server': '127.0.0.1', 'smtp_port': 8025, 'starttls': False
+"""
+
+import argparse
+import os
+import random
+import socketserver
+import threading
+import time
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """多线程SMTP服务"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """SMTP会话处理器，只实现邮件发送需要的命令"""
+
+    # 由 main() 根据命令行参数设置
+    save_dir = None
+    delay = 0.0
+    reject = ()
+    fail_rate = 0.0
+
+    # 全局统计，所有连接共用
+    lock = threading.Lock()
+    stats = {'connections': 0, 'logins': 0, 'messages': 0}
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('utf-8'))
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+            return dict(self.stats)
+
+    def handle(self):
+        self._count('connections')
+        self._reply('220 stub-smtp ready')
+        mail_from = None
+        rcpt_to = []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-stub-smtp\r\n250-AUTH LOGIN PLAIN\r\n250 8BITMIME\r\n')
+            elif verb == 'AUTH':
+                parts = command.split()
+                if len(parts) >= 2 and parts[1].upper() == 'LOGIN':
+                    # smtplib 会在 AUTH LOGIN 后附带用户名，只需再要一次密码
+                    if len(parts) < 3:
+                        self._reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self._reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self._count('logins')
+                self._reply('235 authenticated')
+            elif verb == 'MAIL':
+                mail_from = command[10:].strip()
+                rcpt_to = []
+                self._reply('250 ok')
+            elif verb == 'RCPT':
+                recipient = command[8:].strip().strip('<>')
+                if any(pattern in recipient for pattern in self.reject):
+                    self._reply('550 mailbox unavailable')
+                else:
+                    rcpt_to.append(recipient)
+                    self._reply('250 ok')
+            elif verb == 'DATA':
+                self._reply('354 end with <CRLF>.<CRLF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                if self.delay:
+                    time.sleep(self.delay)
+                if random.random() < self.fail_rate:
+                    self._reply('451 stub temporary failure')
+                    continue
+                self._receive(mail_from, rcpt_to, b''.join(data))
+                self._reply('250 queued')
+            elif verb == 'RSET':
+                mail_from, rcpt_to = None, []
+                self._reply('250 ok')
+            elif verb == 'NOOP':
+                self._reply('250 ok')
+            elif verb == 'QUIT':
+                self._reply('221 bye')
+                return
+            else:
+                self._reply('502 command not implemented')
+
+    def _receive(self, mail_from, rcpt_to, data):
+        stats = self._count('messages')
+        print(f"📨 #{stats['messages']} {mail_from} -> {', '.join(rcpt_to)} ({len(data)} 字节, "
+              f"连接 {stats['connections']} 次, 登录 {stats['logins']} 次)")
+        if self.save_dir:
+            path = os.path.join(self.save_dir, f"{stats['messages']:06d}.eml")
+            with open(path, 'wb') as f:
+                f.write(data)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='本地SMTP桩服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8025, help='监听端口')
+    parser.add_argument('--save-dir', help='将收到的邮件保存为 .eml 文件的目录')
+    parser.add_argument('--delay', type=float, default=0.0, help='每封邮件的模拟处理延迟（秒）')
+    parser.add_argument('--reject', action='append', default=[], help='拒绝包含此字符串的收件人（可多次指定）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='邮件返回451临时错误的概率，用于测试重试')
+    args = parser.parse_args()
+
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+    StubSMTPHandler.save_dir = args.save_dir
+    StubSMTPHandler.delay = args.delay
+    StubSMTPHandler.reject = tuple(args.reject)
+    StubSMTPHandler.fail_rate = args.fail_rate
+
+    server = StubSMTPServer((args.host, args.port), StubSMTPHandler)
+    print(f"🧪 SMTP桩服务已启动: {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
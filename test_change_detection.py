@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+变化检测测试
+在临时数据库中用固定的SERP页面模拟抓取（跳转解析结果预先写入跳转缓存，不访问网络），
+确认未变化的页面不重复插入、写入失败的页面在下次抓取时重新写入，
+以及修正识别规则后重新提取不会补回变化检测有意跳过的广告
+"""
+
+import os
+import tempfile
+
+import database
+import reextract
+from redirect_cache import RedirectCache
+from scraper import GoogleSERPScraper
+from test_parser_parity import SAMPLE_SERP
+from url_params import extract_url_params
+
+# 在 SAMPLE_SERP 的顶部广告区域末尾多一个广告的页面
+NEW_AD_SERP = SAMPLE_SERP.replace('\n</div>\n<div id="bottomads">', '''
+  <div class="uEierd"><div class="v5yQqb">
+    <a data-rw="https://www.googleadservices.com/pagead/aclk?sa=L&amp;ai=A5&amp;adurl=https%3A%2F%2Fnew.example%2F">
+      <div role="heading" aria-level="3"><span>New Example Ad</span></div>
+    </a>
+  </div></div>
+</div>
+<div id="bottomads">''', 1)
+
+
+def make_scraper(directory):
+    """
+    创建使用临时数据库的抓取器，SERP请求返回 scraper.serp（默认 SAMPLE_SERP），
+    页面中所有广告的跳转结果预先写入跳转缓存
+    """
+    database.DATABASE_NAME = os.path.join(directory, 'google_ads.db')
+    scraper = GoogleSERPScraper()
+    scraper.serp = SAMPLE_SERP
+    scraper._fetch_serp_data = lambda keyword, country_code, log=print: scraper.serp
+
+    scraper.redirect_cache = RedirectCache(scraper.db.db_path)
+    scraper.ad_extractor.redirect_cache = scraper.redirect_cache
+    for index, ad in enumerate(scraper.ad_extractor.extract_ads(NEW_AD_SERP, get_real_urls=False)):
+        landing = f"https://bingx.com/en/?ref=REF{index}&ch=test"
+        scraper.redirect_cache.put(ad['ad_url'], {
+            'final_url': landing, 'url_params': extract_url_params(landing)
+        })
+    return scraper
+
+
+def count(db, sql, *params):
+    return db._get_connection().execute(sql, params).fetchone()[0]
+
+
+def test_unchanged_page_is_not_inserted_again():
+    """同一页面抓取两次：广告只插入一次，指纹和ref登记表按两次出现累计"""
+    original = database.DATABASE_NAME
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            scraper = make_scraper(directory)
+            db = scraper.db
+
+            assert scraper.scrape_keyword_country('bingx', 'de')
+            ads = count(db, 'SELECT COUNT(*) FROM ads_data')
+            assert ads == 4
+
+            assert scraper.scrape_keyword_country('bingx', 'de')
+            assert count(db, 'SELECT COUNT(*) FROM ads_data') == ads
+            assert count(db, 'SELECT MIN(seen_count) FROM ad_fingerprints') == 2
+            assert count(db, "SELECT occurrence_count FROM refs WHERE ref_parameter = 'REF0'") == 2
+            assert count(db, "SELECT SUM(ads_found) FROM scrape_logs WHERE status = 'success'") == 2 * ads
+        finally:
+            database.DATABASE_NAME = original
+
+
+def test_failed_write_is_retried_on_next_scrape():
+    """写入失败时页面指纹和广告指纹一起回滚，下次抓取同一页面仍会插入广告"""
+    original = database.DATABASE_NAME
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            scraper = make_scraper(directory)
+            db = scraper.db
+            conn = db._get_connection()
+            conn.execute('''
+                CREATE TRIGGER fail_ads_insert BEFORE INSERT ON ads_data
+                BEGIN SELECT RAISE(ABORT, 'disk full'); END
+            ''')
+
+            assert not scraper.scrape_keyword_country('bingx', 'de')
+            assert count(db, 'SELECT COUNT(*) FROM ads_data') == 0
+            assert count(db, 'SELECT COUNT(*) FROM serp_fingerprints') == 0
+            assert count(db, 'SELECT COUNT(*) FROM ad_fingerprints') == 0
+            assert count(db, "SELECT COUNT(*) FROM scrape_logs WHERE status = 'failed'") == 1
+
+            conn.execute('DROP TRIGGER fail_ads_insert')
+            assert scraper.scrape_keyword_country('bingx', 'de')
+            assert count(db, 'SELECT COUNT(*) FROM ads_data') == 4
+        finally:
+            database.DATABASE_NAME = original
+
+
+def test_reextract_does_not_restore_skipped_ads():
+    """
+    第二次抓取只插入新增的广告；修正标题识别规则（指纹随之变化）后重新提取该页面，
+    只补充真正漏识别的广告，并为其登记指纹
+    """
+    original = database.DATABASE_NAME
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            scraper = make_scraper(directory)
+            db = scraper.db
+
+            assert scraper.scrape_keyword_country('bingx', 'de')
+            scraper.serp = NEW_AD_SERP
+            assert scraper.scrape_keyword_country('bingx', 'de')
+            assert count(db, 'SELECT COUNT(*) FROM ads_data') == 5
+
+            html_ref = count(db, 'SELECT html_file_path FROM ads_data ORDER BY id DESC LIMIT 1')
+            ads = scraper.ad_extractor.extract_ads(NEW_AD_SERP, get_real_urls=False)
+            for ad in ads:
+                ad['title'] = f"{ad['title']} (fixed)"
+            missed = dict(ads[0], ad_url='https://www.googleadservices.com/pagead/aclk?ai=A9', position=99)
+
+            updates, inserts, _ = reextract.diff_page(
+                db.get_ads_by_html_reference(html_ref), ads + [missed], html_ref
+            )
+            inserts = reextract.drop_unchanged_inserts(db, inserts)
+            assert [insert[2]['ad_url'] for insert in inserts] == [missed['ad_url']]
+
+            db.apply_reextraction(updates, inserts)
+            assert count(db, 'SELECT COUNT(*) FROM ads_data') == 6
+            assert db.get_known_ad_fingerprints('bingx', 'de', [missed['fingerprint']]) == {missed['fingerprint']}
+        finally:
+            database.DATABASE_NAME = original
+
+
+def main():
+    """主函数"""
+    test_unchanged_page_is_not_inserted_again()
+    test_failed_write_is_retried_on_next_scrape()
+    test_reextract_does_not_restore_skipped_ads()
+    print("\n✅ 变化检测测试通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+发件队列测试
+在临时数据库中确认多个发送进程同时取出时每个收件人只被取出一次、
+租约过期后旧进程的发送结果不会覆盖重新取出的进程，以及临时错误按退避时间重试
+（发送使用只返回预设结果的投递对象，不连接SMTP服务器）
+"""
+
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import mailer
+from database import AdDatabase
+
+
+class FakeDelivery:
+    """按收件人返回预设错误信息的投递对象（未设置的收件人发送成功）"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    def send_messages(self, messages, progress=None):
+        failed = {}
+        for recipient, _ in messages:
+            self.sent.append(recipient)
+            if recipient in self.errors:
+                failed[recipient] = self.errors[recipient]
+        return [recipient for recipient, _ in messages if recipient not in failed], failed
+
+
+def recipient_row(db, recipient):
+    return db._get_connection().execute('''
+        SELECT status, attempts, next_attempt_at, last_error FROM email_outbox_recipients
+        WHERE recipient = ?
+    ''', (recipient,)).fetchone()
+
+
+def new_stats():
+    return {'sent': 0, 'retry': 0, 'failed': 0, 'stale': 0, 'purged': 0}
+
+
+def test_concurrent_claimers_do_not_share_recipients():
+    """两个发送进程（各自的数据库连接）同时取出，每个收件人只被其中一个取出"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'outbox.db')
+        recipients = [f"user{index}@example.com" for index in range(40)]
+        with AdDatabase(db_path) as db:
+            db.enqueue_email('report', '<p>report</p>', recipients)
+
+        claimed = [[], []]
+        barrier = threading.Barrier(2)
+
+        def claim(worker):
+            with AdDatabase(db_path) as db:
+                barrier.wait()
+                while True:
+                    now = datetime.now()
+                    rows = db.claim_outbox_emails(3, now, now + timedelta(minutes=10))
+                    if not rows:
+                        break
+                    claimed[worker].extend(row[2] for row in rows)
+
+        threads = [threading.Thread(target=claim, args=(worker,)) for worker in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not set(claimed[0]) & set(claimed[1])
+        assert sorted(claimed[0] + claimed[1]) == sorted(recipients)
+
+
+def test_expired_lease_result_is_not_recorded():
+    """租约过期后被另一个进程重新取出：旧进程的结果不记录，重新取出的进程正常记录"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'outbox.db')
+        with AdDatabase(db_path) as first, AdDatabase(db_path) as second:
+            first.enqueue_email('report', '<p>report</p>', ['a@example.com'])
+
+            now = datetime.now()
+            stale_claim = first.claim_outbox_emails(10, now, now + timedelta(seconds=1))
+            later = now + timedelta(seconds=2)
+            fresh_claim = second.claim_outbox_emails(10, later, later + timedelta(minutes=10))
+            assert [row[0] for row in stale_claim] == [row[0] for row in fresh_claim]
+            assert recipient_row(first, 'a@example.com')[1] == 2
+
+            # 旧进程发送失败：结果不记录，也不清除新进程的取出令牌
+            stats = new_stats()
+            mailer._deliver_claimed(first, FakeDelivery({'a@example.com': '451 try later'}),
+                                    stale_claim, {}, stats)
+            assert stats['stale'] == 1 and stats['retry'] == 0
+            status, _, _, last_error = recipient_row(first, 'a@example.com')
+            assert status == 'pending' and last_error is None
+
+            stats = new_stats()
+            mailer._deliver_claimed(second, FakeDelivery(), fresh_claim, {}, stats)
+            assert stats['sent'] == 1 and stats['stale'] == 0
+            assert recipient_row(second, 'a@example.com')[0] == 'sent'
+
+            # 已记录结果后旧令牌同样无效
+            outbox_id, _, _, _, token = stale_claim[0]
+            assert first.finish_outbox_emails([(outbox_id, token, 'pending', later, 'late')]) == [outbox_id]
+            assert recipient_row(first, 'a@example.com')[0] == 'sent'
+
+
+def test_temporary_errors_are_retried_with_backoff():
+    """临时错误按退避时间重试，永久错误和达到最大次数后不再重试"""
+    with tempfile.TemporaryDirectory() as directory:
+        with AdDatabase(os.path.join(directory, 'outbox.db')) as db:
+            db.enqueue_email('report', '<p>report</p>', [
+                'ok@example.com', 'later@example.com', 'rejected@example.com', 'ok@example.com'
+            ])
+            delivery = FakeDelivery({
+                'later@example.com': '451 mailbox busy',
+                'rejected@example.com': '收件人被拒绝: 550 no such user',
+            })
+
+            now = datetime.now()
+            claimed = db.claim_outbox_emails(10, now, now + timedelta(minutes=10))
+            stats = new_stats()
+            mailer._deliver_claimed(db, delivery, claimed, {}, stats)
+            assert sorted(delivery.sent) == ['later@example.com', 'ok@example.com', 'rejected@example.com']
+            assert (stats['sent'], stats['retry'], stats['failed']) == (1, 1, 1)
+            assert recipient_row(db, 'rejected@example.com')[0] == 'failed'
+
+            status, attempts, next_attempt_at, _ = recipient_row(db, 'later@example.com')
+            assert status == 'pending' and attempts == 1
+            retry_at = datetime.fromisoformat(str(next_attempt_at))
+            assert retry_at >= now + timedelta(seconds=mailer.retry_delay(1))
+
+            # 退避时间内不会被取出，到期后重新取出
+            assert db.claim_outbox_emails(10, now, now + timedelta(minutes=10)) == []
+            for attempt in range(2, mailer.EMAIL_OUTBOX_MAX_ATTEMPTS + 1):
+                claimed = db.claim_outbox_emails(10, retry_at, retry_at + timedelta(minutes=10))
+                assert [row[2] for row in claimed] == ['later@example.com']
+                assert claimed[0][3] == attempt
+                mailer._deliver_claimed(db, delivery, claimed, {}, stats)
+                retry_at = datetime.fromisoformat(str(recipient_row(db, 'later@example.com')[2]))
+
+            status, attempts, _, last_error = recipient_row(db, 'later@example.com')
+            assert status == 'failed' and attempts == mailer.EMAIL_OUTBOX_MAX_ATTEMPTS
+            assert last_error == '451 mailbox busy'
+            assert db.get_outbox_counts() == {'sent': 1, 'failed': 2}
+
+
+def main():
+    """主函数"""
+    test_concurrent_claimers_do_not_share_recipients()
+    test_expired_lease_result_is_not_recorded()
+    test_temporary_errors_are_retried_with_backoff()
+    print("\n✅ 发件队列测试通过")
+
+
+if __name__ == "__main__":
+    main()
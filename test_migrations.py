@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+数据库迁移测试
+在临时数据库中确认新建的数据库升级到最新版本并创建所有表和触发器、
+迁移失败时该版本整体回滚并抛出异常，以及之后从中断的版本继续升级时回填历史数据
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+from database import AdDatabase, connect_database
+
+LATEST_VERSION = 10
+TABLES = {
+    'ads_data', 'scrape_logs', 'refs', 'ref_countries', 'ad_params', 'ad_fingerprints',
+    'serp_fingerprints', 'stats_totals', 'keyword_country_stats', 'hourly_stats',
+    'visibility_buckets', 'visibility_refs', 'report_data_version', 'report_snapshots',
+    'email_outbox', 'email_outbox_recipients', 'export_checkpoints',
+}
+STATS_TRIGGERS = {
+    'trg_scrape_logs_stats_insert', 'trg_scrape_logs_stats_delete',
+    'trg_ads_data_stats_insert', 'trg_ads_data_stats_delete',
+}
+TRIGGERS = STATS_TRIGGERS | {
+    'trg_ads_data_refs', 'trg_refs_report_version_insert', 'trg_refs_report_version_update',
+}
+
+
+class FailingStatsMigration(AdDatabase):
+    """版本6的迁移执行完所有语句后失败"""
+
+    def _migrate_v6_stats_rollups(self, cursor):
+        super()._migrate_v6_stats_rollups(cursor)
+        raise RuntimeError('migration interrupted')
+
+
+def schema(db_path):
+    """返回 (user_version, 表名集合, 触发器名集合)"""
+    conn = connect_database(db_path)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        objects = conn.execute('SELECT type, name FROM sqlite_master').fetchall()
+    finally:
+        conn.close()
+    return (
+        version,
+        {name for kind, name in objects if kind == 'table'},
+        {name for kind, name in objects if kind == 'trigger'},
+    )
+
+
+def test_fresh_database_reaches_latest_version():
+    """新建的数据库升级到最新版本，所有表和触发器都已创建；再次打开不重复迁移"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'migrate.db')
+        AdDatabase(db_path).close()
+        version, tables, triggers = schema(db_path)
+        assert version == LATEST_VERSION
+        assert TABLES <= tables
+        assert TRIGGERS <= triggers
+
+        AdDatabase(db_path).close()
+        assert schema(db_path) == (version, tables, triggers)
+
+
+def test_failed_migration_rolls_back_and_resumes():
+    """迁移失败时该版本的表、触发器和版本号一起回滚并抛出异常；下次启动从该版本继续并回填历史数据"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'migrate.db')
+        try:
+            FailingStatsMigration(db_path)
+        except RuntimeError as e:
+            assert str(e) == 'migration interrupted'
+        else:
+            raise AssertionError('迁移失败时应抛出异常')
+
+        version, tables, triggers = schema(db_path)
+        assert version == 5
+        assert not tables & {'stats_totals', 'keyword_country_stats', 'hourly_stats'}
+        assert not triggers & STATS_TRIGGERS
+
+        # 升级前已有的数据
+        conn = connect_database(db_path)
+        with conn:
+            scrape_time = datetime(2026, 3, 2, 9, 30)
+            conn.executemany('''
+                INSERT INTO ads_data (keyword, country_code, ad_url, ref_parameter, scrape_time)
+                VALUES ('bingx', 'de', ?, ?, ?)
+            ''', [(f"https://example.com/ad{index}", f"REF{index}", scrape_time) for index in range(3)])
+            conn.executemany('''
+                INSERT INTO scrape_logs (keyword, country_code, status, scrape_time) VALUES ('bingx', 'de', ?, ?)
+            ''', [('success', scrape_time), ('failed', scrape_time)])
+        conn.close()
+
+        with AdDatabase(db_path) as db:
+            assert schema(db_path)[0] == LATEST_VERSION
+            stats = db.get_scrape_stats()
+            assert (stats['total_scrapes'], stats['successful_scrapes'], stats['total_ads']) == (2, 1, 3)
+
+            db.insert_scrape_log('bingx', 'de', 'success', ads_found=1)
+            db.insert_ads_batch('bingx', 'de', [{'ad_url': 'https://example.com/ad9', 'ref_parameter': 'REF9'}],
+                                datetime.now(), 'html/ad9.html')
+            stats = db.get_scrape_stats()
+            assert (stats['total_scrapes'], stats['successful_scrapes'], stats['total_ads']) == (3, 2, 4)
+            assert db._get_connection().execute('SELECT COUNT(*) FROM refs').fetchone()[0] == 4
+
+
+def main():
+    """主函数"""
+    test_fresh_database_reaches_latest_version()
+    test_failed_migration_rolls_back_and_resumes()
+    print("\n✅ 数据库迁移测试通过")
+
+
+if __name__ == "__main__":
+    main()
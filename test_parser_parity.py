@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+HTML解析后端一致性测试
+用 bs4（参考实现）和 lxml 后端分别提取存档HTML中的广告（不访问网络），
+确认两者得到完全相同的广告数据；
+包括生成的畸形嵌套页面（lxml 对这类标记的纠错方式与 html.parser 不同）
+"""
+
+import os
+import random
+
+from ad_extractor import GoogleAdExtractor
+from config import HTML_DIR
+from html_storage import SQLiteHTMLStorage, get_archive_path
+
+# 覆盖注释、脚本、样式、实体和多级父容器查找的示例页面，存档为空时也能验证基本一致性
+SAMPLE_SERP = '''<!DOCTYPE html>
+<html><head><title>bingx - Google Search</title>
+<style>.VwiC3b { color: #4d5156; }</style>
+<script>var ads = "<a data-rw='fake'>";</script>
+</head><body>
+<div id="tads">
+  <div class="uEierd"><div class="v5yQqb">
+    <a data-rw="https://www.googleadservices.com/pagead/aclk?sa=L&amp;ai=A1&amp;adurl=https%3A%2F%2Fbingx.com%2Fen%2F%3Fref%3DABC">
+      <div role="heading" aria-level="3"><span>BingX&nbsp;Exchange <!-- promo -->Official</span></div>
+    </a>
+    <div class="VwiC3b yXK7lf">Trade crypto &amp; futures <b>with low fees</b>.<script>track()</script></div>
+  </div></div>
+  <div class="uEierd"><div><div>
+    <a data-rw="https://www.googleadservices.com/pagead/aclk?sa=L&amp;ai=A2&amp;url=https://example.com/landing">
+      <span>Hi</span>
+    </a>
+    <div><span class="CCgQ5 extra">Example Landing Title</span></div>
+    <div class="s3v9rd">Another description that is long enough.</div>
+  </div></div></div>
+  <div><a data-rw="https://www.googleadservices.com/pagead/aclk?sa=L&amp;ai=A3">Plain link text ad</a></div>
+</div>
+<div id="bottomads"><p><a data-rw="https://www.googleadservices.com/pagead/aclk?ai=A4&amp;q=https://bottom.example/">
+  <h3>Bottom <template>hidden</template>ad</h3></a></p></div>
+</body></html>'''
+
+
+# 畸形嵌套的广告块：<a> 中嵌套 <a>、<p> 中的 <div>、表格/列表外的 <td>/<li>，
+# html.parser 与 libxml2 对这类标记的纠错方式不同
+MALFORMED_AD_BLOCKS = (
+    '''<div class="uEierd"><a href="/promo"><a data-rw="{url}">
+      <div role="heading" aria-level="3"><span>{title}</span></div></a></a>
+    <div class="VwiC3b">{description}</div></div>''',
+    '''<p><a data-rw="{url}"><div role="heading" aria-level="3"><span>{title}</span></div></a>
+    <div class="VwiC3b">{description}</div></p>''',
+    '''<div><td><a data-rw="{url}"><span>{title}</span></a></td>
+    <div class="s3v9rd">{description}</div></div>''',
+    '''<li><div class="uEierd"><a data-rw="{url}">
+      <div role="heading" aria-level="3"><span>{title}</span></div></a>
+    <div class="VwiC3b">{description}</div></li>''',
+    '''<div class="uEierd"><div class="v5yQqb"><a data-rw="{url}">
+      <div role="heading" aria-level="3"><span>{title}</span></div></a>
+    <div class="VwiC3b">{description}</div></div></div>''',
+)
+
+
+def malformed_corpus(count=200, seed=0):
+    """生成包含畸形嵌套广告块的页面，返回 (名称, HTML) 列表（固定随机种子，结果可重现）"""
+    rng = random.Random(seed)
+    corpus = []
+    for page in range(count):
+        blocks = []
+        for index in range(rng.randint(2, 5)):
+            blocks.append(rng.choice(MALFORMED_AD_BLOCKS).format(
+                url=f"https://www.googleadservices.com/pagead/aclk?ai=P{page}A{index}"
+                    f"&amp;adurl=https%3A%2F%2Fexample{index}.com%2F%3Fref%3DR{page}x{index}",
+                title=f"Example Ad {page}-{index}",
+                description=f"Description for example ad {page}-{index} with enough text.",
+            ))
+        html_content = (
+            '<!DOCTYPE html><html><head><title>bingx - Google Search</title></head><body>'
+            f'<div id="tads">{"".join(blocks)}</div></body></html>'
+        )
+        corpus.append((f"malformed-{page}", html_content))
+    return corpus
+
+
+def compare_backends(reference, candidate, corpus):
+    """返回两个提取器结果不一致的页面 [(名称, 参考结果, 对比结果), ...]"""
+    mismatches = []
+    for name, html_content in corpus:
+        expected = reference.extract_ads(html_content, get_real_urls=False)
+        actual = candidate.extract_ads(html_content, get_real_urls=False)
+        if expected != actual:
+            mismatches.append((name, expected, actual))
+    return mismatches
+
+
+def load_corpus(limit=None):
+    """读取存档数据库和HTML目录中的页面，返回 (名称, HTML) 列表"""
+    corpus = [('sample', SAMPLE_SERP)]
+
+    if os.path.exists(get_archive_path()):
+        archive = SQLiteHTMLStorage()
+        try:
+            for ref in archive.list_refs()[:limit]:
+                corpus.append((ref, archive.load(ref)))
+        finally:
+            archive.close()
+
+    if os.path.isdir(HTML_DIR):
+        for name in sorted(os.listdir(HTML_DIR))[:limit]:
+            if name.endswith('.html'):
+                with open(os.path.join(HTML_DIR, name), 'r', encoding='utf-8') as f:
+                    corpus.append((name, f.read()))
+
+    return corpus
+
+
+def test_parser_parity(limit=None):
+    """测试 lxml 后端与 bs4 后端提取结果一致"""
+    reference = GoogleAdExtractor(max_workers=1, parser_backend='bs4')
+    candidate = GoogleAdExtractor(max_workers=1, parser_backend='lxml')
+
+    corpus = load_corpus(limit)
+    mismatches = compare_backends(reference, candidate, corpus)
+
+    print(f"🔍 对比 {len(corpus)} 个页面，不一致 {len(mismatches)} 个")
+    for name, expected, actual in mismatches[:5]:
+        print(f"\n❌ {name}")
+        for index in range(max(len(expected), len(actual))):
+            left = expected[index] if index < len(expected) else None
+            right = actual[index] if index < len(actual) else None
+            if left != right:
+                print(f"   bs4:  {left}")
+                print(f"   lxml: {right}")
+
+    assert not mismatches, f"{len(mismatches)} 个页面的提取结果不一致"
+
+
+def test_parser_parity_on_malformed_markup():
+    """测试 lxml 后端在畸形嵌套页面上与 bs4 后端提取结果一致，且不会取到其他广告的描述"""
+    reference = GoogleAdExtractor(max_workers=1, parser_backend='bs4')
+    candidate = GoogleAdExtractor(max_workers=1, parser_backend='lxml')
+    corpus = malformed_corpus()
+
+    mismatches = compare_backends(reference, candidate, corpus)
+    print(f"🔍 对比 {len(corpus)} 个畸形嵌套页面，不一致 {len(mismatches)} 个")
+    assert mismatches == [], f"{len(mismatches)} 个畸形页面的提取结果不一致: {mismatches[0][0]}"
+
+    for name, html_content in corpus:
+        for ad in reference.extract_ads(html_content, get_real_urls=False):
+            ad_number = ad['title'].rsplit(' ', 1)[-1]
+            assert not ad['description'] or f" {ad_number} " in ad['description'], (name, ad)
+
+
+def main():
+    """主函数"""
+    test_parser_parity()
+    print("\n✅ lxml 后端与 bs4 后端提取结果一致")
+    test_parser_parity_on_malformed_markup()
+    print("\n✅ 畸形嵌套页面上 lxml 后端与 bs4 后端提取结果一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+统计汇总表测试
+在临时数据库中插入和删除广告与抓取日志，确认触发器维护的汇总表（stats_totals、keyword_country_stats、
+hourly_stats）和可见度汇总表（visibility_buckets）与原始数据直接计数的结果一致，
+以及最近24小时统计只包含时间范围内的小时
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from database import AdDatabase
+
+BASE_TIME = datetime(2026, 3, 2, 9, 40)
+TARGETS = [('bingx', 'de'), ('bingx', 'us'), ('okx', 'de')]
+
+
+def insert_scrape_log(db, keyword, country_code, status, scrape_time):
+    """插入指定时间的抓取日志（insert_scrape_log() 固定使用当前时间）"""
+    conn = db._get_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO scrape_logs (keyword, country_code, status, ads_found, scrape_time)
+            VALUES (?, ?, ?, 0, ?)
+        ''', (keyword, country_code, status, scrape_time))
+
+
+def populate(db):
+    """按小时抓取若干次，返回可见度汇总使用的 observations"""
+    observations = []
+    for step in range(10):
+        scrape_time = BASE_TIME + timedelta(hours=7 * step)
+        for index, (keyword, country_code) in enumerate(TARGETS):
+            if (step + index) % 4 == 0:
+                insert_scrape_log(db, keyword, country_code, 'failed', scrape_time)
+                continue
+            ads = [
+                {
+                    'ad_url': f"https://www.googleadservices.com/pagead/aclk?ai={step}-{index}-{position}",
+                    'ref_parameter': f"REF{(step + position) % 5}",
+                    'title': f"Ad {position}",
+                    'position': position,
+                }
+                for position in range(1, (step + index) % 3 + 2)
+            ]
+            db.insert_ads_batch(keyword, country_code, ads, scrape_time, f"html/{step}-{index}.html")
+            insert_scrape_log(db, keyword, country_code, 'success', scrape_time)
+            observations.append((
+                keyword, country_code, scrape_time,
+                [(ad['ref_parameter'], ad['position']) for ad in ads]
+            ))
+    return observations
+
+
+def query(db, sql):
+    return sorted(db._get_connection().execute(sql).fetchall())
+
+
+def assert_rollups_match_raw_counts(db):
+    assert query(db, '''
+        SELECT total_scrapes, successful_scrapes, total_ads FROM stats_totals
+    ''') == query(db, '''
+        SELECT (SELECT COUNT(*) FROM scrape_logs),
+               (SELECT COUNT(*) FROM scrape_logs WHERE status = 'success'),
+               (SELECT COUNT(*) FROM ads_data)
+    ''')
+    assert query(db, '''
+        SELECT keyword, country_code, scrape_count, success_count, ads_count
+        FROM keyword_country_stats WHERE scrape_count > 0 OR ads_count > 0
+    ''') == query(db, '''
+        SELECT keyword, country_code, SUM(scrapes), SUM(successes), SUM(ads) FROM (
+            SELECT keyword, country_code, 1 AS scrapes, status = 'success' AS successes, 0 AS ads
+            FROM scrape_logs
+            UNION ALL
+            SELECT keyword, country_code, 0, 0, 1 FROM ads_data
+        ) GROUP BY keyword, country_code
+    ''')
+    assert query(db, '''
+        SELECT hour, scrape_count, success_count, ads_count
+        FROM hourly_stats WHERE scrape_count > 0 OR ads_count > 0
+    ''') == query(db, '''
+        SELECT hour, SUM(scrapes), SUM(successes), SUM(ads) FROM (
+            SELECT substr(scrape_time, 1, 13) AS hour, 1 AS scrapes, status = 'success' AS successes, 0 AS ads
+            FROM scrape_logs
+            UNION ALL
+            SELECT substr(scrape_time, 1, 13), 0, 0, 1 FROM ads_data
+        ) GROUP BY hour
+    ''')
+
+
+def test_rollups_match_raw_counts_after_inserts_and_deletes():
+    """插入后和删除部分广告、抓取日志后，汇总表都与原始数据计数一致"""
+    with tempfile.TemporaryDirectory() as directory:
+        with AdDatabase(os.path.join(directory, 'stats.db')) as db:
+            populate(db)
+            assert_rollups_match_raw_counts(db)
+
+            conn = db._get_connection()
+            with conn:
+                conn.execute("DELETE FROM ads_data WHERE id % 3 = 0")
+                conn.execute("DELETE FROM scrape_logs WHERE id % 4 = 1")
+                conn.execute("DELETE FROM ads_data WHERE keyword = 'okx'")
+            assert_rollups_match_raw_counts(db)
+
+
+def test_visibility_rollups_match_raw_counts():
+    """可见度汇总的出现次数、位置之和和不同ref数与插入的广告一致，各粒度合计相同"""
+    with tempfile.TemporaryDirectory() as directory:
+        with AdDatabase(os.path.join(directory, 'stats.db')) as db:
+            observations = populate(db)
+            # 分两批累加，结果与一次累加相同
+            db.update_visibility_rollups(observations[:5])
+            db.update_visibility_rollups(observations[5:])
+
+            assert query(db, '''
+                SELECT bucket, keyword, country_code, serp_count, appearances, position_sum, ref_count
+                FROM visibility_buckets WHERE granularity = 'hour'
+            ''') == query(db, '''
+                SELECT substr(a.scrape_time, 1, 13), a.keyword, a.country_code,
+                       (SELECT COUNT(*) FROM scrape_logs l
+                        WHERE l.status = 'success' AND l.keyword = a.keyword AND l.country_code = a.country_code
+                          AND substr(l.scrape_time, 1, 13) = substr(a.scrape_time, 1, 13)),
+                       COUNT(*), SUM(a.position), COUNT(DISTINCT a.ref_parameter)
+                FROM ads_data a
+                GROUP BY substr(a.scrape_time, 1, 13), a.keyword, a.country_code
+            ''')
+
+            totals = query(db, '''
+                SELECT granularity, SUM(serp_count), SUM(appearances), SUM(position_sum)
+                FROM visibility_buckets GROUP BY granularity
+            ''')
+            assert len({row[1:] for row in totals}) == 1
+            assert totals[0][1:] == query(db, '''
+                SELECT (SELECT COUNT(*) FROM scrape_logs WHERE status = 'success'),
+                       COUNT(*), SUM(position)
+                FROM ads_data
+            ''')[0]
+
+
+def test_hourly_stats_cover_last_24_hours_only():
+    """最近24小时统计不会用更早的小时补齐行数"""
+    now = BASE_TIME + timedelta(days=3)
+    with tempfile.TemporaryDirectory() as directory:
+        with AdDatabase(os.path.join(directory, 'stats.db')) as db:
+            for hours_ago in (50, 30, 25, 23, 2, 0):
+                insert_scrape_log(db, 'bingx', 'de', 'success', now - timedelta(hours=hours_ago))
+
+            hours = [row[0] for row in db.get_hourly_stats(24, now=now)]
+            assert hours == [
+                (now - timedelta(hours=hours_ago)).strftime('%Y-%m-%d %H') for hours_ago in (0, 2, 23)
+            ]
+            assert len(db.get_hourly_stats(48, now=now)) == 5
+
+
+def main():
+    """主函数"""
+    test_rollups_match_raw_counts_after_inserts_and_deletes()
+    test_visibility_rollups_match_raw_counts()
+    test_hourly_stats_cover_last_24_hours_only()
+    print("\n✅ 统计汇总表测试通过")
+
+
+if __name__ == "__main__":
+    main()
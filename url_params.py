@@ -0,0 +1,78 @@
+"""
+落地页URL参数提取
+每个URL只解析一次，按配置一次取出所有需要跟踪的参数（ref、ch、utm_*、gclid 等），返回 {参数名: 值}；
+新增跟踪参数只需修改 config.TRACKED_URL_PARAMS
+"""
+
+from urllib.parse import urlsplit, parse_qsl
+
+import config
+
+# 需要跟踪的URL参数（config.py 中未定义时使用默认值），以 * 结尾表示按前缀匹配
+TRACKED_URL_PARAMS = getattr(
+    config, 'TRACKED_URL_PARAMS',
+    ('ref', 'ch', 'utm_*', 'gad_campaignid', 'gad_source', 'gclid')
+)
+
+# 参数与 ads_data 中原有字段的对应关系，这些字段继续照常填写
+LEGACY_PARAM_FIELDS = {
+    'ref': 'ref_parameter',
+    'ch': 'ch_parameter',
+    'utm_campaign': 'utm_campaign_parameter',
+}
+
+
+class ParamMatcher:
+    """预编译的参数名集合：精确名称用集合查找，前缀模式逐个比较"""
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._exact = frozenset(name for name in self.names if not name.endswith('*'))
+        self._prefixes = tuple(name[:-1] for name in self.names if name.endswith('*'))
+
+    def __contains__(self, name):
+        return name in self._exact or (bool(self._prefixes) and name.startswith(self._prefixes))
+
+
+# 原有字段对应的参数始终提取，即使配置中没有列出
+_default_matcher = ParamMatcher(tuple(TRACKED_URL_PARAMS) + tuple(LEGACY_PARAM_FIELDS))
+
+
+def extract_url_params(url, names=None):
+    """
+    解析一次URL，返回其中被跟踪参数的值
+
+    与 parse_qs(...)[name][0] 相同：值已解码，忽略空值，同名参数取第一个非空值
+
+    Args:
+        url: 要解析的URL
+        names: 参数名列表或 ParamMatcher，默认使用 TRACKED_URL_PARAMS
+
+    Returns:
+        {参数名: 值}，URL无法解析时返回空字典
+    """
+    if not url:
+        return {}
+
+    if names is None:
+        matcher = _default_matcher
+    elif isinstance(names, ParamMatcher):
+        matcher = names
+    else:
+        matcher = ParamMatcher(names)
+
+    try:
+        query = urlsplit(url).query
+    except ValueError:
+        return {}
+
+    params = {}
+    for name, value in parse_qsl(query):
+        if name not in params and name in matcher:
+            params[name] = value
+    return params
+
+
+def legacy_param_fields(params):
+    """将参数字典转换为原有的 ref_parameter/ch_parameter/utm_campaign_parameter 字段，值缺失时为None"""
+    return {field: params.get(name) for name, field in LEGACY_PARAM_FIELDS.items()}